@@ -13,6 +13,8 @@ sys.path.append(str(Path(__file__).parent))
 
 from svc_v2.config_loader import load_settings
 from svc_v2.db import Database
+from svc_v2.snapshots import publish_snapshot
+from svc_v2.commands import CommandLog, CommandWriter
 
 # Asegurar que directorio de logs exista
 os.makedirs("logs", exist_ok=True)
@@ -27,10 +29,16 @@ logging.basicConfig(
     ]
 )
 
+# Reintentos para tomar el lock de escritura al publicar el snapshot de lectura
+SNAPSHOT_LOCK_RETRIES = 5
+SNAPSHOT_RETRY_SEC = 3
+
 class Daemon:
     def __init__(self):
         self.running = True
         self.jobs_configured = False
+        self.command_log = None
+        self.commands_lock_warned = False
         
         # Manejo de señales para salir elegante (Ctrl+C o Docker Stop)
         signal.signal(signal.SIGINT, self.shutdown)
@@ -71,6 +79,9 @@ class Daemon:
             else:
                 logging.error(f"❌ Job {job_name} falló con código {result.returncode}.")
             
+            # Publicar snapshot de lectura para la API (aunque el job falle, lo ya escrito queda visible)
+            self.publish_read_snapshot(job_name)
+
             # Log next run time
             next_run = schedule.next_run()
             if next_run:
@@ -80,6 +91,55 @@ class Daemon:
         except Exception as e:
             logging.error(f"❌ Error crítico lanzando subproceso {job_name}: {e}")
 
+    def publish_read_snapshot(self, job_name: str):
+        """
+        Copia de solo lectura que sirve la API (data/snapshots/). El job ya terminó y soltó el lock de
+        escritura; si una escritura de la API lo tiene tomado, se reintenta unos segundos.
+        """
+        try:
+            cfg = load_settings()
+            if not cfg.system.read_snapshots:
+                return
+            db_path = str(Path("data") / cfg.system.db_filename)
+        except Exception as e:
+            logging.error(f"Error cargando configuración para snapshot: {e}")
+            return
+
+        for attempt in range(SNAPSHOT_LOCK_RETRIES):
+            try:
+                with Database(db_path) as db:
+                    publish_snapshot(db, job_name)
+                return
+            except Exception as e:
+                logging.warning(f"⚠️ DB ocupada al publicar snapshot ({attempt + 1}/{SNAPSHOT_LOCK_RETRIES}): {e}")
+                time.sleep(SNAPSHOT_RETRY_SEC)
+        logging.error(f"❌ Snapshot no publicado tras {job_name}: se publicará con el siguiente job")
+
+    def apply_commands(self):
+        """
+        Único escritor de las escrituras de la API (log de comandos en data/commands.sqlite). Corre en el
+        loop principal entre jobs, así nunca compite con un scan; si otro proceso tiene el lock (tools
+        lanzados desde la API) los comandos siguen pendientes y se reintentan en la siguiente vuelta.
+        """
+        try:
+            if self.command_log is None:
+                self.command_log = CommandLog(Path("data") / load_settings().system.db_filename)
+            if not self.command_log.has_pending():
+                return
+            cfg = load_settings()
+            with Database(str(Path("data") / cfg.system.db_filename)) as db:
+                # Snapshot antes del acuse: cuando la UI ve 'applied', la API ya lee el cambio
+                def publish():
+                    if publish_snapshot(db, "comandos") is None:
+                        raise RuntimeError("snapshot de lectura no publicado")
+                CommandWriter(db, self.command_log).apply_pending(before_ack=publish if cfg.system.read_snapshots else None)
+            self.commands_lock_warned = False
+        except Exception as e:
+            # Una advertencia por racha de lock ocupado (el loop reintenta cada segundo)
+            if not self.commands_lock_warned:
+                logging.warning(f"⚠️ Comandos pendientes sin aplicar (DB ocupada): {e}")
+                self.commands_lock_warned = True
+
     def bootstrap_db(self) -> bool:
         """
         Check if DB is missing or empty. If so, create/fill it from backup.
@@ -231,6 +291,54 @@ class Daemon:
                     job_name="Detailed Scan"
                 )
 
+            # 3. Correlación (Diario, después del Broad Scan)
+            corr_cfg = cfg.scheduler.jobs.get('correlation')
+            if corr_cfg and corr_cfg.enabled:
+                for t in corr_cfg.run_at or ["21:45"]:
+                    logging.info(f"   -> Programando Correlation a las {t}")
+                    schedule.every().day.at(t).do(
+                        self.run_job_subprocess,
+                        module_name="svc_v2.jobs.correlation",
+                        job_name="Correlation"
+                    )
+
+            # 4. Gap Repair (Índice de huecos + backfill acotado, después del Broad Scan)
+            gap_cfg = cfg.scheduler.jobs.get('gap_repair')
+            if gap_cfg and gap_cfg.enabled:
+                for t in gap_cfg.run_at or ["22:15"]:
+                    logging.info(f"   -> Programando Gap Repair a las {t}")
+                    schedule.every().day.at(t).do(
+                        self.run_job_subprocess,
+                        module_name="svc_v2.jobs.gap_repair",
+                        job_name="Gap Repair"
+                    )
+
+            # 5. Metadata Sync (Semanal: nombre, sector, divisa y earnings de fichas vencidas)
+            meta_cfg = cfg.scheduler.jobs.get('metadata_sync')
+            if meta_cfg and meta_cfg.enabled:
+                day = (meta_cfg.day or "sunday").lower()
+                for t in meta_cfg.run_at or ["10:00"]:
+                    logging.info(f"   -> Programando Metadata Sync los {day} a las {t}")
+                    getattr(schedule.every(), day).at(t).do(
+                        self.run_job_subprocess,
+                        module_name="svc_v2.jobs.metadata_sync",
+                        job_name="Metadata Sync",
+                        force=True  # Semanal: puede caer en fin de semana
+                    )
+
+            # 6. Storage Maintenance (Semanal: retención, reescritura ordenada, CHECKPOINT)
+            maint_cfg = cfg.scheduler.jobs.get('maintenance')
+            if maint_cfg and maint_cfg.enabled:
+                day = (maint_cfg.day or "saturday").lower()
+                for t in maint_cfg.run_at or ["06:00"]:
+                    logging.info(f"   -> Programando Storage Maintenance los {day} a las {t}")
+                    getattr(schedule.every(), day).at(t).do(
+                        self.run_job_subprocess,
+                        module_name="svc_v2.jobs.maintenance",
+                        job_name="Storage Maintenance",
+                        force=True  # Corre con el mercado cerrado
+                    )
+
             self.jobs_configured = True
             
             # Log initial next run
@@ -257,6 +365,7 @@ class Daemon:
             os.environ["FORCE_FULL_SCAN"] = "1"
             self.run_job_subprocess("svc_v2.jobs.broad_scan", "Broad Scan (Bootstrap)", force=True)
             self.run_job_subprocess("svc_v2.jobs.detailed_scan", "Detailed Scan (Bootstrap)", force=True)
+            self.run_job_subprocess("svc_v2.jobs.correlation", "Correlation (Bootstrap)", force=True)
             del os.environ["FORCE_FULL_SCAN"]
         else:
             # Normal startup: check if we missed a scheduled run
@@ -265,6 +374,7 @@ class Daemon:
         # Loop Principal
         while self.running:
             schedule.run_pending()
+            self.apply_commands()
             time.sleep(1)
 
 if __name__ == "__main__":
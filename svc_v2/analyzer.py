@@ -1,7 +1,5 @@
 import pandas as pd
-import pandas_ta as ta
 import logging
-from tqdm import tqdm
 from svc_v2.db import Database
 import numpy as np
 
@@ -25,17 +23,19 @@ class Analyzer:
         # Por ahora hardcoded basándonos en el Manifiesto
         LOOKBACK_REQUIRED = 300 # Buffer seguro para EMA200 y Weinstein
 
-        pbar = tqdm(tickers, desc=f"🧠 Analyzing {timeframe}")
-        for ticker in pbar:
+        # 1. Definir cuánta historia leer
+        limit = None if force_full else LOOKBACK_REQUIRED
+
+        # 2. Leer OHLCV de DB: una sola consulta streaming para todo el lote, un ticker a la vez
+        # (arrays NumPy desde Arrow; el DataFrame se arma solo porque pandas_ta lo necesita)
+        from tqdm import tqdm
+        pbar = tqdm(total=len(tickers), desc=f"🧠 Analyzing {timeframe}")
+        for ticker, cols in self.db.iter_candle_arrays(tickers, timeframe, last_n=limit):
+            pbar.update(1)
             try:
-                # 1. Definir cuánta historia leer
-                limit = None if force_full else LOOKBACK_REQUIRED
-                
-                # 2. Leer OHLCV de DB
-                df = self.db.get_candles(ticker, timeframe, limit=limit)
-                
-                if df.empty or len(df) < 50: # Mínimo necesario para calc algo útil
+                if len(cols['close']) < 50: # Mínimo necesario para calc algo útil
                     continue
+                df = pd.DataFrame(cols, copy=False)
 
                 # 3. Calcular Indicadores (Vectorizado con pandas_ta)
                 df = self._compute_indicators(df)
@@ -53,9 +53,14 @@ class Analyzer:
 
             except Exception as e:
                 logging.error(f"❌ Error analizando {ticker} ({timeframe}): {e}")
+        pbar.close()
 
     def _compute_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
         """Aplicación pura de indicadores sobre el DF."""
+        # Import perezoso: pandas_ta (y numba detrás) es lo más pesado del arranque de un job,
+        # y las corridas que no analizan nada no deberían pagarlo
+        import pandas_ta as ta
+
         # Copia ligera para no fragmentar
         # df tiene: timestamp, open, high, low, close, volume
         
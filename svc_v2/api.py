@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 import duckdb
 import pandas as pd
@@ -8,16 +9,29 @@ from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
 from pathlib import Path
 import logging
+import asyncio
+import base64
 import subprocess
 import sys
 import os
-from datetime import timezone
 from svc_v2.config_loader import load_settings
 from svc_v2.db import Database
+from svc_v2.screener import ScreenerEngine, ASOF_MAX_STALENESS_DAYS
+from svc_v2.relative_strength import RS_FIELDS, BENCHMARK_US, BENCHMARK_MX
+from svc_v2.correlation import CorrelationEngine, CORR_WINDOW
+from svc_v2.risk import PORTFOLIO_KEY
+from svc_v2.fx import FxService, BASE_CURRENCY, currency_sql, fx_join_sql, fx_rate_sql
+from svc_v2.ticker_health import TickerHealth
+from svc_v2.maintenance import StorageMaintenance, file_size
+from svc_v2.fundamentals import FUNDAMENTAL_FIELDS, fundamentals_select, latest_fundamentals_sql
+from svc_v2.snapshots import current_snapshot
+from svc_v2.commands import CommandLog, TRANSACTION_SIDES
+from svc_v2 import events
+from svc_v2.serialization import FastJSONResponse, records, dumps, loads
 
 # Configuración
 logging.basicConfig(level=logging.INFO)
-app = FastAPI(title="MarketDashboard V2 API")
+app = FastAPI(title="MarketDashboard V2 API", default_response_class=FastJSONResponse)
 
 # Montar archivos estáticos (Frontend)
 # html=True permite que / vaya a index.html
@@ -32,6 +46,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresión de respuestas: Brotli si está instalado (con fallback a gzip), si no gzip.
+# El canal SSE queda fuera: comprimirlo bufferiza los eventos.
+COMPRESSION_MIN_SIZE = 1024
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=COMPRESSION_MIN_SIZE,
+                       gzip_fallback=True, excluded_handlers=["/api/v2/events"])
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
 def get_db_path():
     # 1. Prioridad: Env Var (Override local/dev)
     override = os.environ.get("DB_PATH_OVERRIDE")
@@ -54,11 +78,30 @@ def get_db_path():
 
     return "data/markets.duckdb"
 
+def read_snapshots_enabled() -> bool:
+    """Env READ_SNAPSHOTS (0/1) > settings (system.read_snapshots)."""
+    env = os.environ.get("READ_SNAPSHOTS")
+    if env is not None:
+        return env != "0"
+    try:
+        return load_settings().system.read_snapshots
+    except Exception:
+        return True
+
+def get_read_db_path():
+    """
+    DB para lecturas: el snapshot publicado más reciente (sin lock compartido con los jobs del daemon).
+    Sin snapshot publicado o con snapshots desactivados, la DB principal.
+    """
+    db_path = get_db_path()
+    snapshot = current_snapshot(db_path) if read_snapshots_enabled() else None
+    return str(snapshot) if snapshot else db_path
+
 def query_db(query: str, params: list = None) -> pd.DataFrame:
     """Helper para consultar DuckDB en modo lectura."""
     try:
         # Usamos Database para ser consistentes, siempre en RO
-        with Database(get_db_path(), read_only=True) as db:
+        with Database(get_read_db_path(), read_only=True) as db:
             if params:
                 return db.conn.execute(query, params).df()
             return db.conn.execute(query).df()
@@ -92,12 +135,15 @@ def run_script(script_path: str):
         # Usamos sys.executable para garantizar que usamos el mismo venv
         subprocess.run([sys.executable, script_path], check=True)
         logging.info(f"✅ Script finished: {script_path}")
+        if read_snapshots_enabled():
+            # El daemon (único escritor) publica el snapshot al drenar la cola: la API no abre DuckDB en escritura
+            CommandLog(get_db_path()).enqueue("publish_snapshot", {"label": Path(script_path).stem})
     except Exception as e:
         logging.error(f"❌ Script failed {script_path}: {e}")
 
 # --- Endpoints ---
 
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 @app.get("/api/v2/portfolio/performance")
 def get_performance():
@@ -105,25 +151,15 @@ def get_performance():
     Calcula el P&L realizado (Closed Trades) normalizado a MXN con FX histórico.
     """
     try:
-        # 1. Obtener FX Histórico (USDMXN=X)
-        fx_df = query_db("SELECT timestamp::DATE as date, close FROM ohlcv WHERE ticker = 'USDMXN=X' AND timeframe = '1d' ORDER BY date ASC")
-        fx_map = fx_df.set_index('date')['close'].to_dict()
-        latest_fx = fx_df.iloc[-1]['close'] if not fx_df.empty else 20.0
-
-        def get_fx(dt):
-            # Buscar FX para la fecha dada o el más cercano anterior
-            d = dt.date()
-            return fx_map.get(d, latest_fx)
-
-        # 2. Obtener transacciones
+        # 1. Obtener transacciones
         tx_df = query_db("SELECT id, ticker, side, qty, price, fees, currency, timestamp FROM portfolio_transactions ORDER BY timestamp ASC, id ASC")
         if tx_df.empty:
-            return {"closed_trades": [], "stats": {}, "monthly": {}}
+            return FastJSONResponse({"closed_trades": [], "stats": {}, "monthly": {}})
 
         inventory = {} 
         closed_trades = []
         
-        for _, tx in tx_df.iterrows():
+        for tx in records(tx_df):
             t = tx['ticker']
             side = tx['side']
             q = float(tx['qty'])
@@ -150,11 +186,6 @@ def get_performance():
                     realized_orig = match_qty * p
                     pnl_orig = realized_orig - invested_orig - buy_fees_share - sell_fees_share
                     
-                    # Normalización a MXN
-                    fx_rate = get_fx(dt) if curr == 'USD' else 1.0
-                    pnl_mxn = pnl_orig * fx_rate
-                    invested_mxn = invested_orig * fx_rate
-                    
                     duration = (dt - buy_lot['date']).days
                     
                     closed_trades.append({
@@ -165,11 +196,10 @@ def get_performance():
                         "open_date": buy_lot['date'].isoformat(),
                         "close_date": dt.isoformat(),
                         "pnl_val": pnl_orig,
-                        "pnl_mxn": pnl_mxn,
+                        "pnl_mxn": pnl_orig,
                         "pnl_pct": (pnl_orig / invested_orig * 100) if invested_orig > 0 else 0,
                         "duration_days": duration,
-                        "currency": curr,
-                        "fx_rate": fx_rate
+                        "currency": (curr or "MXN").upper(),
                     })
 
                     qty_to_sell -= match_qty
@@ -177,6 +207,12 @@ def get_performance():
                     if buy_lot['qty'] <= 0.00001:
                         inventory[t].pop(0)
 
+        # 2. Normalización a MXN con el FX vigente al cierre de cada trade (una sola ASOF JOIN)
+        if closed_trades:
+            with Database(get_read_db_path(), read_only=True) as db:
+                ct_df = FxService(db).convert(pd.DataFrame(closed_trades), ["pnl_mxn"], date_col="close_date")
+            closed_trades = records(ct_df)
+
         # 3. Resumen por Mes (En MXN)
         monthly = {}
         for ct in closed_trades:
@@ -191,7 +227,7 @@ def get_performance():
 
         # 4. Estadísticas Globales (En MXN)
         if not closed_trades:
-            return {"closed_trades": [], "stats": {}, "monthly": monthly}
+            return FastJSONResponse({"closed_trades": [], "stats": {}, "monthly": monthly})
 
         total_pnl_mxn = sum(t['pnl_mxn'] for t in closed_trades)
         wins = [t for t in closed_trades if t['pnl_mxn'] > 0]
@@ -213,11 +249,11 @@ def get_performance():
             "avg_duration": sum(t['duration_days'] for t in closed_trades) / len(closed_trades)
         }
 
-        return {
+        return FastJSONResponse({
             "closed_trades": sorted(closed_trades, key=lambda x: x['close_date'], reverse=True), 
             "stats": stats,
             "monthly": monthly
-        }
+        })
     except Exception as e:
         logging.error(f"Error in performance: {e}")
         import traceback
@@ -260,6 +296,87 @@ def recalc_indicators(background_tasks: BackgroundTasks):
     background_tasks.add_task(run_script, script)
     return {"message": "Indicator recalculation triggered. This may take a while."}
 
+@app.get("/api/v2/system/ticker-health")
+def get_ticker_health(include_failing: bool = False):
+    """
+    Tickers en cuarentena (vacíos / con error en varias corridas seguidas): candidatos a corregir
+    o quitar de la configuración. include_failing=true agrega los que ya fallan sin llegar a cuarentena.
+    """
+    try:
+        with Database(get_read_db_path(), read_only=True) as db:
+            df = TickerHealth(db).report(include_failing=include_failing)
+        for col in ["last_success_at", "last_failure_at", "quarantined_until"]:
+            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M')
+        return FastJSONResponse({
+            "quarantined": int(df["in_quarantine"].sum()) if not df.empty else 0,
+            "items": records(df),
+        })
+    except Exception as e:
+        logging.error(f"Error en get_ticker_health: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/v2/system/storage")
+def get_storage_stats(days: int = 90):
+    """
+    Tamaño actual del archivo, filas por tabla/timeframe y evolución registrada por el job de mantenimiento.
+    Los bytes en disco se miden sobre la DB viva (el snapshot es una copia recién escrita, sin fragmentar);
+    bloques usados / libres vienen de la última medición del job (contarlos exige abrir la DB viva).
+    """
+    try:
+        with Database(get_read_db_path(), read_only=True) as db:
+            maint = StorageMaintenance(db)
+            counts = maint.row_counts()
+            history = maint.history(days)
+            last = maint.last_measurement()
+        history["measured_at"] = history["measured_at"].dt.strftime('%Y-%m-%d %H:%M')
+        return FastJSONResponse({
+            **file_size(get_db_path()),
+            "used_bytes": int(last["used_bytes"]) if last else None,
+            "free_bytes": int(last["free_bytes"]) if last else None,
+            "measured_at": last["measured_at"].strftime('%Y-%m-%d %H:%M') if last else None,
+            "tables": records(counts),
+            "history": records(history),
+        })
+    except Exception as e:
+        logging.error(f"Error en get_storage_stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/v2/system/query-profiles")
+def get_query_profiles(days: int = 7, limit: int = 50):
+    """
+    Queries lentas agrupadas por sitio de llamada + statement (las más lentas primero), con el id del
+    último perfil capturado. Las de la API llegan vía el daemon: se ven tras el siguiente snapshot.
+    """
+    df = query_db(f"""
+        SELECT
+            call_site, sql_hash,
+            COUNT(*) AS profiles,
+            SUM(occurrences) AS slow_runs,
+            MAX(elapsed_ms) AS max_ms,
+            AVG(elapsed_ms) AS avg_ms,
+            MAX(captured_at) AS last_captured_at,
+            arg_max(id, captured_at) AS last_id,
+            arg_max(process, captured_at) AS process,
+            arg_max(left(query, 200), captured_at) AS query_head
+        FROM query_profiles
+        WHERE captured_at > now() - INTERVAL {int(days)} DAY
+        GROUP BY call_site, sql_hash
+        ORDER BY max_ms DESC
+        LIMIT {int(limit)}
+    """)
+    if not df.empty:
+        df["last_captured_at"] = df["last_captured_at"].dt.strftime('%Y-%m-%d %H:%M')
+    return FastJSONResponse(records(df))
+
+@app.get("/api/v2/system/query-profiles/{profile_id}")
+def get_query_profile(profile_id: int):
+    """Perfil completo: statement, parámetros y salida de EXPLAIN ANALYZE."""
+    df = query_db("SELECT * FROM query_profiles WHERE id = ?", [profile_id])
+    if df.empty:
+        raise HTTPException(status_code=404, detail=f"Query profile {profile_id} not found")
+    df["captured_at"] = df["captured_at"].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return FastJSONResponse(records(df)[0])
+
 # --- Portfolio CRUD ---
 
 @app.get("/api/v2/portfolio/transactions")
@@ -267,54 +384,134 @@ def get_transactions(limit: int = 100):
     """Retorna el historial de transacciones."""
     query = f"SELECT * FROM portfolio_transactions ORDER BY timestamp DESC LIMIT {limit}"
     df = query_db(query)
-    if df.empty:
-        return []
-    # Limpieza para JSON
-    df = df.replace([np.inf, -np.inf], np.nan)
-    df = df.astype(object)
-    df = df.where(pd.notnull(df), None)
-    return df.to_dict(orient="records")
-
-@app.post("/api/v2/portfolio/transaction")
+    return FastJSONResponse(records(df))
+
+@app.post("/api/v2/portfolio/transaction", status_code=202)
 def add_transaction(tx: TransactionCreate):
-    """Registra una nueva transacción en la DB."""
+    """
+    Encola una nueva transacción en el log de comandos (no toma el lock de DuckDB).
+    El daemon la aplica entre jobs; el estado se consulta en /api/v2/commands/{command_id}.
+    """
+    # Validación aquí (400 inmediato); el writer solo falla por datos que no se pueden anticipar
+    if tx.side.upper() not in TRANSACTION_SIDES:
+        raise HTTPException(status_code=400, detail=f"Invalid side: {tx.side}")
+    if tx.timestamp and pd.isna(pd.to_datetime(tx.timestamp, errors="coerce")):
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {tx.timestamp}")
     try:
-        # Abrimos, escribimos y cerramos inmediatamente (transiente)
-        with Database(get_db_path(), read_only=False) as db:
-            db.add_transaction(
-                ticker=tx.ticker.upper(),
-                side=tx.side.upper(),
-                qty=tx.qty,
-                price=tx.price,
-                fees=tx.fees,
-                notes=tx.notes,
-                timestamp=tx.timestamp,
-                currency=tx.currency.upper()
-            )
-        return {"status": "success", "message": f"Transaction recorded for {tx.ticker}"}
+        payload = tx.model_dump()
+        payload["ticker"] = tx.ticker.upper()
+        payload["side"] = tx.side.upper()
+        payload["currency"] = (tx.currency or "MXN").upper()
+        command_id = CommandLog(get_db_path()).enqueue("add_transaction", payload)
+        return {"status": "queued", "command_id": command_id, "message": f"Transaction queued for {payload['ticker']}"}
     except Exception as e:
-        logging.error(f"Error adding transaction: {e}")
+        logging.error(f"Error queuing transaction: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/api/v2/portfolio/transaction/{tx_id}")
+@app.delete("/api/v2/portfolio/transaction/{tx_id}", status_code=202)
 def delete_transaction(tx_id: int):
-    """Elimina una transacción por ID."""
+    """Encola el borrado de una transacción por ID."""
     try:
-        with Database(get_db_path(), read_only=False) as db:
-            db.conn.execute("DELETE FROM portfolio_transactions WHERE id = ?", [tx_id])
-        return {"status": "success", "message": f"Transaction {tx_id} deleted"}
+        command_id = CommandLog(get_db_path()).enqueue("delete_transaction", {"id": tx_id})
+        return {"status": "queued", "command_id": command_id, "message": f"Delete of transaction {tx_id} queued"}
     except Exception as e:
-        logging.error(f"Error deleting transaction: {e}")
+        logging.error(f"Error queuing delete: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/v2/commands/{command_id}")
+def get_command(command_id: int):
+    """Estado de un comando encolado: pending | applied (con result) | failed (con error)."""
+    cmd = CommandLog(get_db_path()).get(command_id)
+    if cmd is None:
+        raise HTTPException(status_code=404, detail=f"Command {command_id} not found")
+    return cmd
+
+# Columnas permitidas para ordenar desde el cliente (whitelist contra SQL injection)
+SCREENER_SORT_COLUMNS = {
+    "ticker", "name", "strategies", "close", "chg_1d", "chg_2d", "chg_3d", "chg_5d", "chg_fri", "chg_prev_fri",
+    "rsi", "adx", "vol_k", "is_holding", "is_favourite", "cluster_id",
+} | set(RS_FIELDS) | set(FUNDAMENTAL_FIELDS)
+
+def _sql_in_list(tickers: List[str]) -> str:
+    """('A','B') para IN; '(NULL)' si la lista está vacía (IN () no es SQL válido)."""
+    clean = [t.replace("'", "''") for t in tickers if t]
+    return "(" + ",".join([f"'{t}'" for t in clean]) + ")" if clean else "(NULL)"
+
 @app.get("/api/v2/screener")
-def get_screener_results():
+def get_screener_results(
+    as_of: Optional[str] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    sort: Optional[str] = None,
+    order: str = "desc",
+    q: Optional[str] = None,
+    strategy: Optional[str] = None,
+    only: Optional[str] = None,
+    min_rsi: Optional[float] = None,
+    max_rsi: Optional[float] = None,
+    min_adx: Optional[float] = None,
+    min_vol_k: Optional[float] = None,
+    min_rs: Optional[float] = None,
+    min_rs_pct: Optional[float] = None,
+    max_pe: Optional[float] = None,
+    scope: str = "watchlist",
+):
     """
     Retorna los candidatos de la dynamic_watchlist MÁS los holdings y watchlist manual.
     Incluye variaciones de precio multitemporales (1D, 2D, 3D, vs Viernes Ant).
+    as_of (YYYY-MM-DD[ HH:MM]): reconstruye la watchlist y los precios vigentes en esa fecha.
+
+    Paginación / orden / filtros se resuelven en SQL:
+    - offset/limit: ventana visible (limit vacío = todo, limit=0 = solo 'total'). Respuesta incluye 'total'.
+    - sort/order: columna de SCREENER_SORT_COLUMNS, asc|desc (default: señales primero).
+    - q (ticker o nombre), strategy, only (holding|favourite|signal), min/max_rsi, min_adx, min_vol_k,
+      min_rs (rs_bench_20, pp vs benchmark), min_rs_pct (percentil de ret_20 en el universo),
+      max_pe (PE contra el cierre; sin EPS positivo no pasa).
+    - Fundamentales (pe, forward_pe, dividend_yield, market_cap, ...) del snapshot vigente en tabla fundamentals.
+    - scope: 'watchlist' (default) o 'universe' (todos los tickers con datos 1d).
     """
+    if sort and sort not in SCREENER_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort column: {sort}")
+    if order.lower() not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"Invalid order: {order}")
+    if scope not in ("watchlist", "universe"):
+        raise HTTPException(status_code=400, detail=f"Invalid scope: {scope}")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise HTTPException(status_code=400, detail=f"Invalid offset/limit: {offset}/{limit}")
+    as_of_ts = None
+    if as_of:
+        try:
+            as_of_ts = pd.Timestamp(as_of)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid as_of: {as_of}")
+
     try:
         cfg = load_settings()
+
+        # 0. Fuente de candidatos: watchlist actual o reconstruida point-in-time
+        ts_filter = stale_filter = ""
+        if as_of:
+            with Database(get_read_db_path(), read_only=True) as db:
+                replay_df = ScreenerEngine(db).watchlist_as_of(as_of_ts)
+            replay_rows = ",".join([
+                f"('{r.ticker}', '{r.reason}', TIMESTAMP '{r.added_at}')" for r in replay_df.itertuples()
+            ])
+            if replay_rows:
+                watchlist_sql = f"SELECT * FROM (VALUES {replay_rows}) AS w(ticker, reason, added_at)"
+            else:
+                watchlist_sql = "SELECT NULL::VARCHAR as ticker, NULL::VARCHAR as reason, NULL::TIMESTAMP as added_at WHERE false"
+            ts_filter = f"AND timestamp <= TIMESTAMP '{as_of_ts}'"
+            # Vela vigente solo si es reciente (igual que el replay del screener: sin tickers deslistados)
+            stale_filter = f"AND timestamp >= TIMESTAMP '{as_of_ts}' - INTERVAL {ASOF_MAX_STALENESS_DAYS} DAY"
+            fund_sql = f"""
+                SELECT * FROM fundamentals WHERE snapshot_date <= DATE '{as_of_ts.date()}'
+                QUALIFY row_number() OVER (PARTITION BY ticker ORDER BY snapshot_date DESC) = 1
+            """
+            fund_ref = f"TIMESTAMP '{as_of_ts}'"
+        else:
+            watchlist_sql = "SELECT ticker, reason, added_at FROM dynamic_watchlist WHERE expires_at > now()"
+            fund_sql = latest_fundamentals_sql()
+            fund_ref = "current_date"
         
         # 1. Obtener tickers de interés manual
         holdings = [h.ticker if hasattr(h, 'ticker') else str(h) for h in cfg.portfolios.holdings]
@@ -328,112 +525,238 @@ def get_screener_results():
             if manual_tickers_sql:
                 manual_subquery = f"""
                     UNION
-                    SELECT ticker, NULL as reason, now() as added_at
+                    SELECT ticker, NULL as reason, NULL as added_at
                     FROM (VALUES {manual_tickers_sql}) AS t(ticker)
-                    WHERE ticker NOT IN (SELECT ticker FROM dynamic_watchlist WHERE expires_at > now())
+                    WHERE ticker NOT IN (SELECT ticker FROM watchlist)
                 """
-        
-        # Query Avanzada: Window functions para deltas
-        query = f"""
-            WITH all_targets AS (
-                SELECT ticker, reason, added_at FROM dynamic_watchlist WHERE expires_at > now()
+
+        if scope == "universe":
+            targets_sql = """
+                SELECT u.ticker, w.reason, w.added_at
+                FROM (SELECT DISTINCT ticker FROM ohlcv WHERE timeframe = '1d') u
+                LEFT JOIN watchlist w ON u.ticker = w.ticker
+            """
+        else:
+            targets_sql = f"""
+                SELECT ticker, reason, added_at FROM watchlist
                 {manual_subquery}
-            ),
-            price_history AS (
-                SELECT 
-                    ticker, timestamp, close,
-                    lag(close, 1) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_1,
-                    lag(close, 2) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_2,
-                    lag(close, 3) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_3,
-                    -- Buscar el último viernes: dayofweek=5 es Friday
-                    FIRST_VALUE(close) OVER (
+            """
+
+        # 3. Filtros (pushdown a SQL, valores parametrizados)
+        filters = []
+        params = []
+        if q:
+            filters.append("(ticker ILIKE ? OR name ILIKE ?)")
+            params += [f"%{q}%", f"%{q}%"]
+        if strategy:
+            filters.append("strategies LIKE ?")
+            params.append(f"%{strategy}%")
+        if only == "holding":
+            filters.append("is_holding")
+        elif only == "favourite":
+            filters.append("is_favourite")
+        elif only == "signal":
+            filters.append("strategies != ''")
+        for col, op, val in [("rsi", ">=", min_rsi), ("rsi", "<=", max_rsi),
+                             ("adx", ">=", min_adx), ("vol_k", ">=", min_vol_k),
+                             ("rs_bench_20", ">=", min_rs), ("pct_ret_20", ">=", min_rs_pct),
+                             ("pe", "<=", max_pe)]:
+            if val is not None:
+                filters.append(f"{col} {op} ?")
+                params.append(val)
+        where_sql = f"WHERE {' AND '.join(filters)}" if filters else ""
+
+        # 4. Orden (siempre con ticker como desempate para paginación estable)
+        if sort:
+            order_sql = f"{sort} {order.upper()} NULLS LAST, ticker ASC"
+        else:
+            order_sql = "CASE WHEN strategies != '' THEN 0 ELSE 1 END, ticker ASC"
+
+        page_sql = ""
+        if limit is not None:
+            page_sql = f"LIMIT {int(limit)} OFFSET {int(offset)}"
+        elif offset:
+            page_sql = f"OFFSET {int(offset)}"
+        
+        # 5. Variaciones: tabla `returns` (precalculada por los jobs).
+        # En modo as_of se recalculan con ventanas sobre ohlcv (returns solo guarda la última vela).
+        if as_of:
+            changes_sql = f"""
+                SELECT ticker, close,
+                    ((close / NULLIF(prev_1, 0)) - 1) * 100 as chg_1d,
+                    ((close / NULLIF(prev_2, 0)) - 1) * 100 as chg_2d,
+                    ((close / NULLIF(prev_3, 0)) - 1) * 100 as chg_3d,
+                    ((close / NULLIF(prev_5, 0)) - 1) * 100 as chg_5d,
+                    ((close / NULLIF(last_friday_close, 0)) - 1) * 100 as chg_fri,
+                    ((close / NULLIF(prev_friday_close, 0)) - 1) * 100 as chg_prev_fri
+                FROM (
+                    SELECT 
+                        ticker, timestamp, close,
+                        lag(close, 1) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_1,
+                        lag(close, 2) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_2,
+                        lag(close, 3) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_3,
+                        lag(close, 5) OVER (PARTITION BY ticker ORDER BY timestamp ASC) as prev_5,
+                        -- Buscar el último viernes: dayofweek=5 es Friday
+                        FIRST_VALUE(close) OVER fri as last_friday_close,
+                        NTH_VALUE(close, 2) OVER fri as prev_friday_close,
+                        row_number() OVER (PARTITION BY ticker ORDER BY timestamp DESC) as rn
+                    FROM ohlcv
+                    WHERE timeframe = '1d' {ts_filter}
+                      AND ticker IN (SELECT ticker FROM all_targets)
+                    WINDOW fri AS (
                         PARTITION BY ticker 
                         ORDER BY CASE WHEN dayofweek(timestamp) = 5 THEN 0 ELSE 1 END, timestamp DESC
-                    ) as last_friday_close,
-                    row_number() OVER (PARTITION BY ticker ORDER BY timestamp DESC) as rn
-                FROM ohlcv
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                    )
+                ) WHERE rn = 1 {stale_filter}
+            """
+        else:
+            changes_sql = """
+                SELECT ticker, close, chg_1d, chg_2d, chg_3d, chg_5d, chg_fri, chg_prev_fri
+                FROM returns
                 WHERE timeframe = '1d'
+                  AND ticker IN (SELECT ticker FROM all_targets)
+            """
+
+        query = f"""
+            WITH watchlist AS (
+                {watchlist_sql}
+            ),
+            all_targets AS (
+                {targets_sql}
+            ),
+            changes AS (
+                {changes_sql}
+            ),
+            fund AS (
+                {fund_sql}
             ),
             latest_ind AS (
                 SELECT 
-                    ticker, rsi, adx, vol_k,
+                    ticker, rsi, adx, vol_k, {', '.join(RS_FIELDS)},
                     row_number() OVER (PARTITION BY ticker ORDER BY timestamp DESC) as rn
                 FROM indicators
-                WHERE timeframe = '1d'
+                LEFT JOIN relative_strength USING (ticker, timeframe, timestamp)
+                WHERE timeframe = '1d' {ts_filter} {stale_filter}
+                  AND ticker IN (SELECT ticker FROM all_targets)
+            ),
+            results AS (
+                SELECT 
+                    t.ticker, 
+                    m.name, 
+                    COALESCE(t.reason, '') as strategies, 
+                    t.added_at,
+                    p.close, 
+                    p.chg_1d,
+                    p.chg_2d,
+                    p.chg_3d,
+                    p.chg_5d,
+                    p.chg_fri,
+                    p.chg_prev_fri,
+                    i.rsi, 
+                    i.adx, 
+                    i.vol_k,
+                    {', '.join([f"i.{c}" for c in RS_FIELDS])},
+                    {fundamentals_select('f', 'p.close', fund_ref)},
+                    cc.cluster_id,
+                    cc.cluster_size,
+                    t.ticker IN {_sql_in_list(holdings)} as is_holding,
+                    t.ticker IN {_sql_in_list(manual_watchlist)} as is_favourite
+                FROM all_targets t
+                LEFT JOIN ticker_metadata m ON t.ticker = m.ticker
+                LEFT JOIN changes p ON t.ticker = p.ticker
+                LEFT JOIN latest_ind i ON t.ticker = i.ticker AND i.rn = 1
+                LEFT JOIN fund f ON t.ticker = f.ticker
+                -- Clusters de correlación: solo vigentes (no point-in-time), se omiten con as_of
+                LEFT JOIN correlation_clusters cc
+                       ON t.ticker = cc.ticker AND cc.window_size = {CORR_WINDOW} AND {'FALSE' if as_of else 'TRUE'}
             )
-            SELECT 
-                t.ticker, 
-                m.name, 
-                COALESCE(t.reason, '') as strategies, 
-                t.added_at,
-                p.close, 
-                ((p.close / NULLIF(p.prev_1, 0)) - 1) * 100 as chg_1d,
-                ((p.close / NULLIF(p.prev_2, 0)) - 1) * 100 as chg_2d,
-                ((p.close / NULLIF(p.prev_3, 0)) - 1) * 100 as chg_3d,
-                ((p.close / NULLIF(p.last_friday_close, 0)) - 1) * 100 as chg_fri,
-                i.rsi, 
-                i.adx, 
-                i.vol_k
-            FROM all_targets t
-            LEFT JOIN ticker_metadata m ON t.ticker = m.ticker
-            LEFT JOIN price_history p ON t.ticker = p.ticker AND p.rn = 1
-            LEFT JOIN latest_ind i ON t.ticker = i.ticker AND i.rn = 1
-            ORDER BY 
-                CASE WHEN t.reason IS NOT NULL AND t.reason != '' THEN 0 ELSE 1 END,
-                t.ticker ASC
+            SELECT *, count(*) OVER () as total
+            FROM results
+            {where_sql}
+            ORDER BY {order_sql}
         """
-        df = query_db(query)
+        df = query_db(f"{query} {page_sql}", params)
         if df.empty:
-            return []
-        
-        # Flags
-        df['is_holding'] = df['ticker'].isin(holdings)
-        df['is_favourite'] = df['ticker'].isin(manual_watchlist)
+            # Página vacía por la ventana (fuera de rango o limit=0, solo conteo): el total viene de la query sin ventana
+            total = 0
+            if page_sql:
+                cnt = query_db(f"SELECT count(*) as n FROM ({query})", params)
+                total = int(cnt['n'].iloc[0]) if not cnt.empty else 0
+            return FastJSONResponse({"items": [], "total": total, "offset": offset, "limit": limit})
+
+        total = int(df['total'].iloc[0])
+        df = df.drop(columns=['total'])
+        df['is_holding'] = df['is_holding'].fillna(False).astype(bool)
+        df['is_favourite'] = df['is_favourite'].fillna(False).astype(bool)
         
         # Limpieza
         if 'added_at' in df.columns:
-            df['added_at'] = df['added_at'].astype(str)
+            df['added_at'] = df['added_at'].astype(str).where(df['added_at'].notna(), None)
 
-        df = df.replace([np.inf, -np.inf], np.nan)
-        df = df.astype(object)
-        df = df.where(pd.notnull(df), None)
-        
-        return df.to_dict(orient="records")
+        return FastJSONResponse({"items": records(df), "total": total, "offset": offset, "limit": limit})
     except Exception as e:
         logging.error(f"Error en get_screener_results: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/v2/screener/replay")
+def replay_screener(start: str, end: str, timeframe: str = "1d", strategy: Optional[str] = None):
+    """
+    Re-ejecuta las estrategias en cada vela de [start, end] (point-in-time).
+    Devuelve los hits como entradas históricas de watchlist (as_of, strategy, ticker, added_at, expires_at).
+    """
+    try:
+        strategies = [strategy] if strategy else None
+        with Database(get_read_db_path(), read_only=True) as db:
+            df = ScreenerEngine(db).replay(start, end, timeframe=timeframe, strategies=strategies)
+        for col in ['as_of', 'timestamp', 'added_at', 'expires_at']:
+            if col in df.columns:
+                df[col] = df[col].astype(str)
+
+        return FastJSONResponse(records(df))
+    except Exception as e:
+        logging.error(f"Error en replay_screener: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/v2/portfolio")
 def get_portfolio():
     """
     Retorna las posiciones actuales del usuario con P&L calculado.
     """
     try:
-        # 1. Obtener tipo de cambio USDMXN
-        fx_df = query_db("SELECT close FROM ohlcv WHERE ticker = 'USDMXN=X' AND timeframe = '1d' ORDER BY timestamp DESC LIMIT 1")
-        fx_rate = fx_df.iloc[0]['close'] if not fx_df.empty else 20.0 # Fallback seguro
-        
-        # 2. Query con Lógica FIFO Robusta Inyectada
-        query = """
+        # 1. Query con Lógica FIFO Robusta Inyectada
+        # El costo se lleva a la divisa de cotización del ticker con el FX del día de cada compra
+        quote_ccy = currency_sql("t.ticker", "m")
+        tx_ccy = f"COALESCE(UPPER(t.currency), {quote_ccy})"
+        query = f"""
             WITH total_sold AS (
                 SELECT ticker, SUM(qty) as sold_qty
                 FROM portfolio_transactions
                 WHERE side = 'SELL'
                 GROUP BY ticker
             ),
+            buys AS (
+                SELECT
+                    t.ticker, t.qty, t.timestamp, t.id,
+                    CASE WHEN {tx_ccy} = {quote_ccy} THEN t.price
+                         ELSE t.price * {fx_rate_sql('ft', tx_ccy)} / {fx_rate_sql('fq', quote_ccy)} END as price
+                FROM portfolio_transactions t
+                LEFT JOIN ticker_metadata m ON t.ticker = m.ticker
+                {fx_join_sql('ft', tx_ccy, 't.timestamp::DATE')}
+                {fx_join_sql('fq', quote_ccy, 't.timestamp::DATE')}
+                WHERE t.side = 'BUY'
+            ),
             buy_history AS (
                 SELECT 
-                    ticker, qty, price, currency, timestamp, id,
+                    ticker, qty, price, timestamp, id,
                     SUM(qty) OVER (PARTITION BY ticker ORDER BY timestamp ASC, id ASC) - qty as prev_cum_qty,
                     SUM(qty) OVER (PARTITION BY ticker ORDER BY timestamp ASC, id ASC) as cum_qty
-                FROM portfolio_transactions
-                WHERE side = 'BUY'
+                FROM buys
             ),
             fifo_holdings AS (
                 SELECT 
                     b.ticker,
                     b.price,
-                    b.currency,
                     CASE 
                         WHEN b.cum_qty <= COALESCE(s.sold_qty, 0) THEN 0
                         WHEN b.prev_cum_qty >= COALESCE(s.sold_qty, 0) THEN b.qty
@@ -446,8 +769,7 @@ def get_portfolio():
                 SELECT 
                     ticker,
                     SUM(rem_qty) as qty,
-                    SUM(rem_qty * price) / NULLIF(SUM(rem_qty), 0) as avg_buy_price,
-                    MAX(currency) as currency
+                    SUM(rem_qty * price) / NULLIF(SUM(rem_qty), 0) as avg_buy_price
                 FROM fifo_holdings
                 GROUP BY ticker
                 HAVING SUM(rem_qty) > 0.0001
@@ -467,102 +789,90 @@ def get_portfolio():
                 h.ticker,
                 h.qty,
                 h.avg_buy_price,
-                h.currency,
+                {currency_sql("h.ticker", "m")} as currency,
                 p.close as current_price,
                 m.name,
-                COALESCE(s.strategies, '') as strategies
+                COALESCE(s.strategies, '') as strategies,
+                cc.cluster_id,
+                cc.cluster_size,
+                rk.vol_60,
+                rk.beta,
+                rk.var_95_mxn,
+                rk.drawdown
             FROM current_holdings h
             LEFT JOIN latest_prices p ON h.ticker = p.ticker AND p.rn = 1
             LEFT JOIN ticker_metadata m ON h.ticker = m.ticker
             LEFT JOIN active_signals s ON h.ticker = s.ticker
+            LEFT JOIN correlation_clusters cc ON h.ticker = cc.ticker AND cc.window_size = {CORR_WINDOW}
+            LEFT JOIN portfolio_risk rk ON h.ticker = rk.ticker
             ORDER BY h.ticker
         """
-        df = query_db(query)
-        if df.empty:
-            return {"items": [], "totals": {}}
-            
-        # Inferencia de divisa (Temporal hasta tener columna en DB o Metadata)
-        # Asumimos que tickers con "." (MX) son MXN, resto USD.
-        # Excepción: USDMXN=X es FX.
-        def infer_currency(row):
-            if ".MX" in row['ticker']: return "MXN"
-            if row['ticker'] == "USDMXN=X": return "MXN"
-            return "USD"
-            
-        df['currency'] = df.apply(infer_currency, axis=1)
-
-        # Cálculo de P&L y Totales
-        items = []
-        total_mxn_inv = 0
-        total_mxn_val = 0
-        total_usd_inv = 0
-        total_usd_val = 0
-        
-        for _, row in df.iterrows():
-            qty = float(row['qty'])
-            avg = float(row['avg_buy_price'])
-            curr = float(row['current_price']) if pd.notnull(row.get('current_price')) else avg
-            
-            invested = qty * avg
-            current_val = qty * curr
-            pnl_val = current_val - invested
-            pnl_pct = (pnl_val / invested * 100) if invested > 0 else 0
-            
-            item = row.to_dict()
-            item['pnl_val'] = pnl_val
-            item['pnl_pct'] = pnl_pct
-            item['invested'] = invested
-            item['current_val'] = current_val
-            
-            # Limpieza NaN
-            for k, v in item.items():
-                if isinstance(v, float) and (np.isnan(v) or np.isinf(v)):
-                    item[k] = None
-            
-            items.append(item)
-            
-            # Totales
-            if row['currency'] == 'MXN':
-                total_mxn_inv += invested
-                total_mxn_val += current_val
-            else:
-                total_usd_inv += invested
-                total_usd_val += current_val
+        with Database(get_read_db_path(), read_only=True) as db:
+            df = db.conn.execute(query).df()
+            if df.empty:
+                return FastJSONResponse({"items": [], "totals": {}})
+
+            # Cálculo de P&L y Totales (vectorizado)
+            avg = df['avg_buy_price'].astype(float)
+            curr = df['current_price'].astype(float).fillna(avg)
+            df['invested'] = df['qty'] * avg
+            df['current_val'] = df['qty'] * curr
+            df['pnl_val'] = df['current_val'] - df['invested']
+            df['pnl_pct'] = np.where(df['invested'] > 0, df['pnl_val'] / df['invested'] * 100, 0.0)
+
+            # Valuación en MXN con el FX vigente de la divisa de cada posición
+            fx = FxService(db)
+            fx_rate = fx.latest("USD")
+            df['as_of'] = pd.Timestamp.now()
+            mxn = fx.convert(df[['invested', 'current_val', 'currency', 'as_of']], ['invested', 'current_val'], date_col='as_of')
+
+        # Sin tipo de cambio (costo en otra divisa o valuación a MXN): la posición queda sin monto y los
+        # totales que la incluyen van en null en vez de sumarla como cero
+        df['missing_fx'] = df['invested'].isna().to_numpy() | mxn['fx_rate'].isna().to_numpy()
+        missing_fx = df.loc[df['missing_fx'], 'ticker'].tolist()
+        if missing_fx:
+            logging.warning(f"⚠️ Portfolio: sin tipo de cambio para {missing_fx}")
+        items = records(df.drop(columns=['as_of']))
 
-        # Gran Total Estimado en MXN
-        est_total_inv = total_mxn_inv + (total_usd_inv * fx_rate)
-        est_total_val = total_mxn_val + (total_usd_val * fx_rate)
-        est_pnl_val = est_total_val - est_total_inv
-        est_pnl_pct = (est_pnl_val / est_total_inv * 100) if est_total_inv > 0 else 0
+        def subtotal(inv: pd.Series, val: pd.Series) -> Dict[str, Any]:
+            if inv.isna().any():
+                return {"invested": None, "current": None, "pnl": None}
+            inv_sum, val_sum = float(inv.sum()), float(val.sum())
+            return {"invested": inv_sum, "current": val_sum, "pnl": val_sum - inv_sum}
+
+        # Totales
+        is_mxn = df['currency'] == BASE_CURRENCY
+        is_usd = df['currency'] == "USD"
+
+        # Gran Total Estimado en MXN (todas las divisas)
+        grand = subtotal(mxn['invested'], mxn['current_val'])
+        if grand["invested"] is not None:
+            grand["pnl_pct"] = (grand["pnl"] / grand["invested"] * 100) if grand["invested"] > 0 else 0
+        else:
+            grand["pnl_pct"] = None
+        grand["fx_rate"] = fx_rate
 
         totals = {
-            "mxn": {
-                "invested": total_mxn_inv,
-                "current": total_mxn_val,
-                "pnl": total_mxn_val - total_mxn_inv
-            },
-            "usd": {
-                "invested": total_usd_inv,
-                "current": total_usd_val,
-                "pnl": total_usd_val - total_usd_inv
-            },
-            "grand_total_mxn": {
-                "invested": est_total_inv,
-                "current": est_total_val,
-                "pnl": est_pnl_val,
-                "pnl_pct": est_pnl_pct,
-                "fx_rate": fx_rate
-            }
+            "mxn": subtotal(df.loc[is_mxn, 'invested'], df.loc[is_mxn, 'current_val']),
+            "usd": subtotal(df.loc[is_usd, 'invested'], df.loc[is_usd, 'current_val']),
+            "grand_total_mxn": grand,
+            "missing_fx": missing_fx
         }
+
+        # Riesgo agregado precalculado por RiskEngine (broad scan)
+        risk_df = query_db(f"SELECT * EXCLUDE (ticker, as_of, updated_at), strftime(as_of, '%Y-%m-%d') AS as_of FROM portfolio_risk WHERE ticker = '{PORTFOLIO_KEY}'")
+        if not risk_df.empty:
+            totals["risk"] = records(risk_df)[0]
         
-        return {"items": items, "totals": totals}
+        return FastJSONResponse({"items": items, "totals": totals})
     except Exception as e:
         logging.error(f"Error en get_portfolio: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/v2/ticker/{ticker}")
-def get_ticker_details(ticker: str):
+def get_ticker_details(ticker: str, timeframes: Optional[str] = None):
     """
+    timeframes (ej. "1h,15m"): limita la respuesta a esos timeframes (refresco parcial vía SSE).
     Devuelve la estructura completa para Triple Screen:
     {
         "ticker": "AAPL",
@@ -589,9 +899,10 @@ def get_ticker_details(ticker: str):
 
     # 2. Datos por Timeframe (1d, 1h, 15m)
     # Adaptamos lo que el frontend espera
-    timeframes = ["1d", "1h", "15m"]
+    all_timeframes = ["1d", "1h", "15m"]
+    requested = [t.strip() for t in timeframes.split(",")] if timeframes else all_timeframes
     
-    for tf in timeframes:
+    for tf in [t for t in all_timeframes if t in requested]:
         # Recuperar últimas N velas con indicadores
         # Limitamos a 300 para no saturar el frontend
         q = f"""
@@ -613,77 +924,43 @@ def get_ticker_details(ticker: str):
         if df.empty:
             continue
             
-        # Reemplazar NaN con None para compatibilidad JSON
-        df = df.replace({np.nan: None})
-            
         # Ordenar ascendente para el gráfico
         df = df.sort_values("timestamp")
         
         # Obtener la última fila para KPIs (Bias, Phase, etc.)
-        # IMPORTANTE: Definir antes del loop para evitar NameError
         last_row = df.iloc[-1]
         
         # Calcular Bias/Phase/Force (Lógica de Triple Screen)
         # Esto debería estar en DB idealmente, pero lo calculamos al vuelo por ahora
         bias = "neutral"
-        if last_row['close'] is not None and last_row['ema_200'] is not None:
+        if pd.notnull(last_row['close']) and pd.notnull(last_row['ema_200']):
             if last_row['close'] > last_row['ema_200']: bias = "buy"
             elif last_row['close'] < last_row['ema_200']: bias = "sell"
         
-        # Estructurar series para lightweight-charts
-        candles = []
-        vol_series = []
-        rsi_series = []
-        macd_series = []
-        ema_short = []
-        ema_mid = []
-        ema_long = []
-        donchian_h = []
-        donchian_l = []
-        
-        seen_ts = set()
-        for _, row in df.iterrows():
-            # Manejo de tiempo según timeframe
-            if tf == '1d':
-                # Para 1D, usamos string YYYY-MM-DD para evitar problemas de timezone
-                # DuckDB timestamp -> Date string
-                time_val = row['timestamp'].strftime('%Y-%m-%d')
-                # Clave única
-                ts_check = time_val
-            else:
-                # Para intradía, usamos UNIX timestamp UTC
-                ts_obj = row['timestamp'].replace(tzinfo=timezone.utc)
-                time_val = int(ts_obj.timestamp())
-                ts_check = time_val
-            
-            # 1. Evitar duplicados de tiempo
-            if ts_check in seen_ts:
-                continue
-            
-            # 2. Filtrar velas rotas (faltan precios)
-            if row['open'] is None or row['close'] is None or row['high'] is None or row['low'] is None:
-                continue
+        # Estructurar series para lightweight-charts (vectorizado, NaN -> null lo resuelve el serializer)
+        if tf == '1d':
+            # Para 1D, usamos string YYYY-MM-DD para evitar problemas de timezone
+            df['time'] = df['timestamp'].dt.strftime('%Y-%m-%d')
+        else:
+            # Para intradía, usamos UNIX timestamp UTC (timestamps naive = UTC)
+            df['time'] = df['timestamp'].astype('datetime64[s]').astype('int64')
 
-            seen_ts.add(ts_check)
-            
-            candles.append({
-                "time": time_val,
-                "open": row['open'],
-                "high": row['high'],
-                "low": row['low'],
-                "close": row['close']
-            })
-            vol_series.append({"time": time_val, "value": row['volume']})
-            
-            if pd.notnull(row['rsi']): rsi_series.append({"time": time_val, "value": row['rsi']})
-            if pd.notnull(row['macd_hist']): macd_series.append({"time": time_val, "value": row['macd_hist']})
-            
-            if pd.notnull(row['ema_20']): ema_short.append({"time": time_val, "value": row['ema_20']})
-            if pd.notnull(row['ema_50']): ema_mid.append({"time": time_val, "value": row['ema_50']})
-            if pd.notnull(row['ema_200']): ema_long.append({"time": time_val, "value": row['ema_200']})
-            
-            if pd.notnull(row['donchian_high']): donchian_h.append({"time": time_val, "value": row['donchian_high']})
-            if pd.notnull(row['donchian_low']): donchian_l.append({"time": time_val, "value": row['donchian_low']})
+        # 1. Filtrar velas rotas (faltan precios)  2. Evitar duplicados de tiempo
+        df = df.dropna(subset=['open', 'high', 'low', 'close']).drop_duplicates(subset='time', keep='first')
+
+        def series(col: str) -> list:
+            sub = df.loc[df[col].notna(), ["time", col]].rename(columns={col: "value"})
+            return records(sub)
+
+        candles = records(df[['time', 'open', 'high', 'low', 'close']])
+        vol_series = records(df[['time', 'volume']].rename(columns={'volume': 'value'}))
+        rsi_series = series('rsi')
+        macd_series = series('macd_hist')
+        ema_short = series('ema_20')
+        ema_mid = series('ema_50')
+        ema_long = series('ema_200')
+        donchian_h = series('donchian_high')
+        donchian_l = series('donchian_low')
 
         # Payload del timeframe
         # as_of: Convertimos a ISO format y agregamos Z para que JS sepa que es UTC
@@ -723,7 +1000,294 @@ def get_ticker_details(ticker: str):
     if not response["timeframes"]:
         raise HTTPException(status_code=404, detail="Ticker not found or no data")
 
-    return response
+    return FastJSONResponse(response)
+
+# --- Portfolio Risk ---
+
+@app.get("/api/v2/portfolio/risk")
+def get_portfolio_risk():
+    """Métricas de riesgo precalculadas (tabla portfolio_risk): una fila por posición + agregado del portafolio."""
+    df = query_db(f"""
+        SELECT * EXCLUDE (as_of, updated_at), strftime(as_of, '%Y-%m-%d') AS as_of
+        FROM portfolio_risk
+        WHERE ticker <> '{PORTFOLIO_KEY}'
+        ORDER BY var_95_mxn DESC NULLS LAST
+    """)
+    total = query_db(f"""
+        SELECT * EXCLUDE (ticker, as_of, updated_at), strftime(as_of, '%Y-%m-%d') AS as_of
+        FROM portfolio_risk
+        WHERE ticker = '{PORTFOLIO_KEY}'
+    """)
+    return FastJSONResponse({
+        "items": records(df),
+        "portfolio": records(total)[0] if not total.empty else {},
+    })
+
+# --- Portfolio Equity ---
+
+@app.get("/api/v2/portfolio/equity")
+def get_portfolio_equity(currency: str = "MXN", start: Optional[str] = None):
+    """
+    Curva diaria materializada del portafolio (tabla portfolio_equity) en MXN o USD,
+    con ^GSPC y ^MXX convertidos a la misma divisa y rebasados a 100 en el primer día
+    (comparables contra el índice time-weighted `twr`).
+    """
+    ccy = currency.lower()
+    if ccy not in ("mxn", "usd"):
+        raise HTTPException(status_code=400, detail="currency must be MXN or USD")
+    try:
+        date_cond = f"WHERE date >= DATE '{pd.Timestamp(start).date()}'" if start else ""
+        curve = query_db(f"""
+            SELECT strftime(date, '%Y-%m-%d') AS date, fx_rate,
+                   value_{ccy} AS value, invested_{ccy} AS invested,
+                   unrealized_{ccy} AS unrealized, realized_{ccy} AS realized,
+                   unrealized_{ccy} + realized_{ccy} AS pnl,
+                   flow_{ccy} AS flow, twr_{ccy} AS twr, drawdown_{ccy} AS drawdown
+            FROM portfolio_equity
+            {date_cond}
+            ORDER BY date
+        """)
+        if curve.empty:
+            return FastJSONResponse({"currency": currency.upper(), "curve": [], "benchmarks": {}})
+
+        # Índice USD en MXN = cierre * FX; índice MXN en USD = cierre / FX
+        to_ccy = {
+            BENCHMARK_US: "b.close * e.fx_rate" if ccy == "mxn" else "b.close",
+            BENCHMARK_MX: "b.close" if ccy == "mxn" else "b.close / e.fx_rate",
+        }
+        bench = query_db(f"""
+            WITH curve AS (
+                SELECT date, fx_rate FROM portfolio_equity {date_cond}
+            ),
+            closes AS (
+                SELECT ticker, timestamp::DATE AS date, close
+                FROM ohlcv
+                WHERE timeframe = '1d' AND ticker IN ('{BENCHMARK_US}', '{BENCHMARK_MX}')
+            ),
+            conv AS (
+                SELECT b.ticker, strftime(e.date, '%Y-%m-%d') AS date,
+                       CASE WHEN b.ticker = '{BENCHMARK_US}' THEN {to_ccy[BENCHMARK_US]}
+                            ELSE {to_ccy[BENCHMARK_MX]} END AS value
+                FROM curve e
+                CROSS JOIN (SELECT DISTINCT ticker FROM closes) t
+                ASOF JOIN closes b ON b.ticker = t.ticker AND e.date >= b.date
+            )
+            SELECT ticker, date,
+                   value / FIRST_VALUE(value) OVER (PARTITION BY ticker ORDER BY date) * 100 AS value
+            FROM conv
+            ORDER BY ticker, date
+        """)
+        benchmarks = {
+            t: records(g[["date", "value"]]) for t, g in bench.groupby("ticker", sort=False)
+        }
+        return FastJSONResponse({"currency": currency.upper(), "curve": records(curve), "benchmarks": benchmarks})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error en get_portfolio_equity: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- Correlation ---
+
+@app.get("/api/v2/correlation")
+def get_correlation(tickers: Optional[str] = None, scope: Optional[str] = None):
+    """
+    Matriz de correlación rolling (CORR_WINDOW velas 1d) y clusters.
+    - tickers (ej. "NVDA,SOXX") o scope=holdings: recorta la matriz a esos tickers.
+    - values: triángulo superior sin diagonal, float32 little-endian en base64
+      (fila i, columnas j > i). En JS: new Float32Array(bytes.buffer).
+    """
+    if scope not in (None, "holdings"):
+        raise HTTPException(status_code=400, detail="scope must be 'holdings'")
+    try:
+        wanted = [t.strip().upper() for t in tickers.split(",") if t.strip()] if tickers else None
+        with Database(get_read_db_path(), read_only=True) as db:
+            if scope == "holdings":
+                held = db.conn.execute("SELECT ticker FROM view_portfolio_holdings ORDER BY ticker").fetchall()
+                wanted = [r[0] for r in held]
+            names, as_of, corr = CorrelationEngine(db).get_matrix(wanted)
+            clusters = db.conn.execute(
+                "SELECT ticker, cluster_id, cluster_size, avg_corr FROM correlation_clusters WHERE window_size = ?",
+                [CORR_WINDOW]
+            ).df()
+
+        upper = corr[np.triu_indices(len(names), k=1)].astype("<f4")
+        clusters = clusters[clusters['ticker'].isin(names)]
+        return FastJSONResponse({
+            "window": CORR_WINDOW,
+            "as_of": as_of,
+            "tickers": names,
+            "dtype": "float32",
+            "layout": "upper",
+            "values": base64.b64encode(upper.tobytes()).decode("ascii"),
+            "clusters": records(clusters),
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error en get_correlation: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- Push Channel (Server-Sent Events) ---
+
+# Frecuencia con que el broadcaster revisa system_events (una sola query por proceso, no por cliente)
+EVENTS_POLL_SEC = 5
+EVENTS_KEEPALIVE_SEC = 15
+
+# Qué snapshots recalcular según el tipo de evento
+SCREENER_EVENTS = {events.JOB_FINISHED, events.SIGNAL}
+PORTFOLIO_EVENTS = {events.JOB_FINISHED, events.TRANSACTION}
+
+def _diff_rows(old: Dict[str, dict], new: Dict[str, dict]) -> Dict[str, Any]:
+    """Delta por fila (clave = ticker): filas nuevas/cambiadas y tickers eliminados."""
+    upserts = [row for key, row in new.items() if old.get(key) != row]
+    removed = [key for key in old if key not in new]
+    return {"upserts": upserts, "removed": removed}
+
+class EventBroadcaster:
+    """
+    Un único loop por proceso lee system_events y reparte a todos los clientes SSE.
+    Además de reenviar los eventos crudos, calcula deltas por fila del screener
+    y del portfolio contra el último snapshot enviado.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.task = None
+        self.last_id = None
+        self.screener_rows = None
+        self.portfolio_rows = None
+        self.portfolio_totals = None
+
+    async def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def _broadcast(self, kind: str, data: Any, event_id: Optional[int] = None):
+        msg = ""
+        if event_id is not None:
+            msg += f"id: {event_id}\n"
+        msg += f"event: {kind}\ndata: {dumps(data).decode()}\n\n"
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait((event_id, msg))
+            except asyncio.QueueFull:
+                # Cliente lento: lo soltamos, EventSource reconecta solo
+                self.subscribers.discard(queue)
+
+    def _read_last_id(self) -> int:
+        with Database(get_read_db_path(), read_only=True) as db:
+            return events.last_event_id(db)
+
+    def _read_events(self) -> List[dict]:
+        with Database(get_read_db_path(), read_only=True) as db:
+            return events.fetch_events(db, self.last_id)
+
+    def _screener_delta(self) -> Optional[Dict[str, Any]]:
+        rows = {r['ticker']: r for r in loads(get_screener_results().body)['items']}
+        delta = _diff_rows(self.screener_rows, rows) if self.screener_rows is not None else None
+        self.screener_rows = rows
+        return delta
+
+    def _portfolio_delta(self) -> Optional[Dict[str, Any]]:
+        data = loads(get_portfolio().body)
+        rows = {r['ticker']: r for r in data['items']}
+        delta = None
+        if self.portfolio_rows is not None:
+            delta = _diff_rows(self.portfolio_rows, rows)
+            delta["totals"] = data['totals'] if data['totals'] != self.portfolio_totals else None
+        self.portfolio_rows = rows
+        self.portfolio_totals = data['totals']
+        return delta
+
+    async def _poll_once(self):
+        new_events = await asyncio.to_thread(self._read_events)
+        if not new_events:
+            return
+
+        self.last_id = new_events[-1]['id']
+        for ev in new_events:
+            self._broadcast(ev['kind'], ev, event_id=ev['id'])
+
+        kinds = {ev['kind'] for ev in new_events}
+        if kinds & SCREENER_EVENTS:
+            delta = await asyncio.to_thread(self._screener_delta)
+            if delta and (delta['upserts'] or delta['removed']):
+                self._broadcast("screener_delta", delta)
+        if kinds & PORTFOLIO_EVENTS:
+            delta = await asyncio.to_thread(self._portfolio_delta)
+            if delta and (delta['upserts'] or delta['removed'] or delta['totals']):
+                self._broadcast("portfolio_delta", delta)
+
+    async def _run(self):
+        try:
+            self.last_id = await asyncio.to_thread(self._read_last_id)
+            # Snapshots base contra los que se calcularán los deltas
+            await asyncio.to_thread(self._screener_delta)
+            await asyncio.to_thread(self._portfolio_delta)
+
+            while self.subscribers:
+                await asyncio.sleep(EVENTS_POLL_SEC)
+                try:
+                    await self._poll_once()
+                except Exception as e:
+                    # DB ocupada por el daemon o similar: reintentar en el siguiente ciclo
+                    logging.warning(f"EventBroadcaster poll falló: {e}")
+        except Exception as e:
+            logging.error(f"Error en EventBroadcaster: {e}")
+        finally:
+            # Sin suscriptores (o error): el próximo subscribe arranca un loop limpio
+            self.screener_rows = None
+            self.portfolio_rows = None
+            self.portfolio_totals = None
+
+broadcaster = EventBroadcaster()
+
+@app.get("/api/v2/events")
+async def stream_events(request: Request):
+    """
+    Canal SSE: eventos 'job_finished', 'signal', 'transaction' y deltas por fila
+    ('screener_delta', 'portfolio_delta'). Soporta Last-Event-ID para reenviar lo perdido.
+    """
+    queue = await broadcaster.subscribe()
+    last_seen = request.headers.get("last-event-id")
+
+    async def event_stream():
+        try:
+            yield f"retry: {EVENTS_POLL_SEC * 1000}\n\n"
+            # La cola ya está suscrita: lo que el broadcaster lea durante el replay llega también por ella
+            replayed_id = None
+            if last_seen and last_seen.isdigit():
+                def read_missed():
+                    with Database(get_read_db_path(), read_only=True) as db:
+                        return events.fetch_events(db, int(last_seen))
+                for ev in await asyncio.to_thread(read_missed):
+                    replayed_id = ev['id']
+                    yield f"id: {ev['id']}\nevent: {ev['kind']}\ndata: {dumps(ev).decode()}\n\n"
+
+            while not await request.is_disconnected():
+                try:
+                    event_id, msg = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event_id is not None and replayed_id is not None and event_id <= replayed_id:
+                    continue
+                yield msg
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 if __name__ == "__main__":
     import uvicorn
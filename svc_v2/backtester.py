@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import time
+import pandas as pd
+from typing import List, Optional
+from svc_v2.db import Database
+from svc_v2.screener import STRATEGIES, RS_SELECT
+from svc_v2.fundamentals import fundamentals_select
+
+DEFAULT_HORIZONS = [1, 5, 10, 20]
+
+class Backtester:
+    """
+    Evalúa las condiciones de TODAS las estrategias sobre TODA la historia de indicators
+    en una sola pasada SQL (DuckDB), en vez de solo la última vela como el ScreenerEngine.
+    Por cada hit mide retornos forward a N velas, MAE (max adverse excursion) y hit rate.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def run(self, strategies: Optional[List[str]] = None, timeframes: Optional[List[str]] = None,
+            horizons: Optional[List[int]] = None, use_cache: bool = True) -> pd.DataFrame:
+        """
+        Devuelve estadísticas por estrategia / timeframe / horizonte.
+        Usa la tabla backtest_results como caché, indexada por el hash de la definición
+        de la estrategia y versionada por el último updated_at de indicators.
+        """
+        strategies = strategies or list(STRATEGIES.keys())
+        timeframes = timeframes or ["1d"]
+        horizons = sorted(set(horizons or DEFAULT_HORIZONS))
+
+        unknown = [s for s in strategies if s not in STRATEGIES]
+        if unknown:
+            logging.error(f"Estrategias desconocidas: {unknown}")
+            strategies = [s for s in strategies if s in STRATEGIES]
+
+        results = []
+        for tf in timeframes:
+            data_version = self._data_version(tf)
+            if data_version is None:
+                logging.warning(f"⚠️ Sin indicadores para [{tf}]. Backtest omitido.")
+                continue
+
+            hashes = {s: self.definition_hash(s, horizons) for s in strategies}
+
+            cached = pd.DataFrame()
+            if use_cache:
+                cached = self._read_cache(list(hashes.values()), tf, data_version)
+            missing = [s for s in strategies if cached.empty or hashes[s] not in set(cached['def_hash'])]
+
+            if missing:
+                t_start = time.time()
+                fresh = self._compute_stats(missing, tf, horizons)
+                fresh['def_hash'] = fresh['strategy'].map(hashes)
+                fresh['timeframe'] = tf
+                fresh['data_version'] = data_version
+                logging.info(f"📈 Backtest [{tf}] {missing}: {time.time() - t_start:.2f}s")
+                self._write_cache(fresh)
+                cached = pd.concat([cached, fresh], ignore_index=True) if not cached.empty else fresh
+
+            results.append(cached)
+
+        if not results:
+            return pd.DataFrame()
+
+        df = pd.concat(results, ignore_index=True)
+        cols = ['strategy', 'timeframe', 'horizon', 'hits', 'avg_ret', 'median_ret',
+                'hit_rate', 'avg_mae', 'worst_mae', 'def_hash', 'data_version']
+        return df[cols].sort_values(['timeframe', 'strategy', 'horizon']).reset_index(drop=True)
+
+    def get_hits(self, strategy_name: str, timeframe: str = "1d", horizons: Optional[List[int]] = None) -> pd.DataFrame:
+        """Detalle por hit (ticker/fecha) con retornos forward y MAE por horizonte."""
+        horizons = sorted(set(horizons or DEFAULT_HORIZONS))
+        query = f"""
+            {self._hits_cte([strategy_name], timeframe, horizons)}
+            SELECT * FROM hits ORDER BY timestamp DESC, ticker
+        """
+        return self.db.conn.execute(query).df()
+
+    def definition_hash(self, strategy_name: str, horizons: List[int]) -> str:
+        """Hash estable de la definición (condiciones + dirección + horizontes)."""
+        strategy = STRATEGIES[strategy_name]
+        payload = {
+            "name": strategy_name,
+            "where": " ".join(strategy['where'].split()),
+            "direction": strategy['direction'],
+            "horizons": sorted(horizons),
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:16]
+
+    # --------------------------------------------------------------------------
+    # SQL
+    # --------------------------------------------------------------------------
+
+    def _hits_cte(self, strategies: List[str], tf: str, horizons: List[int]) -> str:
+        """
+        CTE 'bars' calcula una sola vez las ventanas forward (lead / min / max)
+        y 'hits' aplica el WHERE de cada estrategia sobre esa misma pasada.
+        """
+        fwd_cols = []
+        for h in horizons:
+            frame = f"ROWS BETWEEN 1 FOLLOWING AND {h} FOLLOWING"
+            fwd_cols.append(f"lead(o.close, {h}) OVER w AS fwd_close_{h}")
+            fwd_cols.append(f"min(o.low) OVER (w {frame}) AS fwd_low_{h}")
+            fwd_cols.append(f"max(o.high) OVER (w {frame}) AS fwd_high_{h}")
+
+        hit_selects = []
+        for name in strategies:
+            s = STRATEGIES[name]
+            d = s['direction']
+            metrics = []
+            for h in horizons:
+                # Retorno y MAE expresados a favor de la estrategia (SELL invierte el signo)
+                adverse = f"(fwd_low_{h} / close - 1)" if d > 0 else f"-(fwd_high_{h} / close - 1)"
+                metrics.append(f"{d} * (fwd_close_{h} / NULLIF(close, 0) - 1) * 100 AS ret_{h}")
+                metrics.append(f"CASE WHEN fwd_close_{h} IS NOT NULL THEN {adverse} * 100 END AS mae_{h}")
+            hit_selects.append(f"""
+                SELECT '{name}' AS strategy, ticker, timestamp, close,
+                       {', '.join(metrics)}
+                FROM bars
+                WHERE ({s['where']})
+            """)
+
+        return f"""
+            WITH bars AS (
+                SELECT i.*, o.close, o.low, o.high, {RS_SELECT},
+                       {fundamentals_select('f', 'o.close', 'i.timestamp')},
+                       {', '.join(fwd_cols)}
+                FROM indicators i
+                JOIN ohlcv o USING (ticker, timeframe, timestamp)
+                LEFT JOIN relative_strength r USING (ticker, timeframe, timestamp)
+                -- Snapshot de fundamentales vigente en cada vela (point-in-time)
+                ASOF LEFT JOIN fundamentals f ON i.ticker = f.ticker AND i.timestamp >= f.snapshot_date
+                WHERE i.timeframe = '{tf}'
+                WINDOW w AS (PARTITION BY i.ticker ORDER BY i.timestamp)
+            ),
+            hits AS (
+                {' UNION ALL '.join(hit_selects)}
+            )
+        """
+
+    def _compute_stats(self, strategies: List[str], tf: str, horizons: List[int]) -> pd.DataFrame:
+        aggs = []
+        for h in horizons:
+            aggs.append(f"""
+                SELECT strategy, {h} AS horizon,
+                       count(ret_{h}) AS hits,
+                       avg(ret_{h}) AS avg_ret,
+                       median(ret_{h}) AS median_ret,
+                       avg(CASE WHEN ret_{h} > 0 THEN 1.0 ELSE 0.0 END) FILTER (WHERE ret_{h} IS NOT NULL) * 100 AS hit_rate,
+                       avg(mae_{h}) AS avg_mae,
+                       min(mae_{h}) AS worst_mae
+                FROM hits
+                GROUP BY strategy
+            """)
+
+        query = f"""
+            {self._hits_cte(strategies, tf, horizons)}
+            {' UNION ALL '.join(aggs)}
+        """
+        df = self.db.conn.execute(query).df()
+
+        # Estrategias sin hits no aparecen en el GROUP BY: las registramos en cero
+        present = set(df['strategy']) if not df.empty else set()
+        empty_rows = [{'strategy': s, 'horizon': h, 'hits': 0} for s in strategies if s not in present for h in horizons]
+        if empty_rows:
+            df = pd.concat([df, pd.DataFrame(empty_rows)], ignore_index=True)
+        return df
+
+    # --------------------------------------------------------------------------
+    # CACHE
+    # --------------------------------------------------------------------------
+
+    def _data_version(self, tf: str) -> Optional[pd.Timestamp]:
+        # relative_strength y fundamentals también cuentan: las estrategias pueden filtrar por rs_* / pct_* / pe
+        res = self.db.conn.execute("""
+            SELECT GREATEST(
+                (SELECT MAX(updated_at) FROM indicators WHERE timeframe = ?),
+                (SELECT MAX(updated_at) FROM relative_strength WHERE timeframe = ?),
+                (SELECT MAX(fetched_at) FROM fundamentals)
+            )
+        """, [tf, tf]).fetchone()
+        return pd.Timestamp(res[0]) if res and res[0] else None
+
+    def _read_cache(self, hashes: List[str], tf: str, data_version: pd.Timestamp) -> pd.DataFrame:
+        try:
+            hashes_sql = ",".join([f"'{h}'" for h in hashes])
+            return self.db.conn.execute(f"""
+                SELECT * FROM backtest_results
+                WHERE def_hash IN ({hashes_sql}) AND timeframe = ? AND data_version = ?
+            """, [tf, data_version]).df()
+        except Exception as e:
+            logging.warning(f"Caché de backtest no disponible: {e}")
+            return pd.DataFrame()
+
+    def _write_cache(self, df: pd.DataFrame):
+        """Reemplaza las filas de (def_hash, timeframe). Silencioso en conexiones read-only."""
+        try:
+            self.db.conn.register('temp_bt', df)
+            self.db.conn.execute("""
+                DELETE FROM backtest_results
+                WHERE def_hash IN (SELECT DISTINCT def_hash FROM temp_bt)
+                  AND timeframe IN (SELECT DISTINCT timeframe FROM temp_bt)
+            """)
+            self.db.conn.execute("""
+                INSERT INTO backtest_results (def_hash, strategy, timeframe, horizon, hits, avg_ret, median_ret,
+                                              hit_rate, avg_mae, worst_mae, data_version, computed_at)
+                SELECT def_hash, strategy, timeframe, horizon, hits, avg_ret, median_ret,
+                       hit_rate, avg_mae, worst_mae, data_version, now()
+                FROM temp_bt
+            """)
+        except Exception as e:
+            logging.warning(f"No se pudo guardar caché de backtest: {e}")
+        finally:
+            self.db.conn.unregister('temp_bt')
+
+if __name__ == "__main__":
+    db = Database()
+    bt = Backtester(db)
+    print(bt.run().to_string(index=False))
@@ -1,20 +1,47 @@
-import yfinance as yf
 import pandas as pd
 import logging
 from datetime import timedelta, datetime
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import time
-from tqdm import tqdm
 
 from svc_v2.db import Database
+from svc_v2.fx import FxService
+from svc_v2.events import publish_event, ADJUSTMENT
+from svc_v2.sync_planner import SyncPlanner, AdaptiveChunker
+from svc_v2.market_data import MarketDataProvider, get_provider
+from svc_v2.ticker_health import TickerHealth, Outcome
+from svc_v2.metadata import MetadataSync
+
+# Ajustes retroactivos de Yahoo (auto_adjust=True): si las velas del traslape ya no coinciden con lo guardado
+# por más de esto, la historia vieja quedó en otra escala (split / dividendo) y se reescribe completa
+ADJUSTMENT_TOLERANCE = 0.001
+# open y close deben moverse con el mismo factor; si no, es corrección de un dato y no un ajuste
+ADJUSTMENT_CONSISTENCY = 0.002
+# |factor - 1| a partir del cual el ajuste se etiqueta como split (debajo: dividendo)
+SPLIT_THRESHOLD = 0.2
+
+# Cola de reintentos: rondas extra (con pausa creciente) solo para los tickers que fallaron en la corrida
+RETRY_ROUNDS = 2
+RETRY_BACKOFF_SECONDS = 5
 
 class Collector:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, provider: MarketDataProvider = None):
         self.db = db
+        # Fuente de velas (yfinance por default; replay offline vía settings / MARKET_DATA_PROVIDER)
+        self.provider = provider or get_provider()
+        # Tickers con historia reescrita en esta corrida, por timeframe (los jobs recalculan sus indicadores completos)
+        self.adjusted: Dict[str, List[str]] = {}
+        # Tamaño de chunk aprendido en la corrida (latencia / errores) y tickers que fallaron tras los reintentos
+        self.chunker = AdaptiveChunker()
+        self.failed: Dict[str, List[str]] = {}
+        # Resultado por ticker de la última descarga (alimenta ticker_health) y cuarentena de símbolos muertos
+        self.outcomes: Dict[str, Outcome] = {}
+        self.health = TickerHealth(db)
     
-    def sync_tickers(self, tickers: List[str], timeframes: List[str]):
+    def sync_tickers(self, tickers: List[str], timeframes: List[str], dry_run: bool = False):
         """
-        Sincroniza tickers en lotes agrupados por fecha de inicio necesaria.
+        Sincroniza tickers en lotes agrupados por fecha de inicio necesaria (ver SyncPlanner).
+        dry_run: solo calcula y registra el plan, sin descargar.
         """
         if not tickers:
             logging.warning("⚠️ Lista de tickers vacía.")
@@ -24,15 +51,28 @@ class Collector:
         start_global = time.time()
 
         for tf in timeframes:
-            self._sync_timeframe_batched(tickers, tf)
+            self._sync_timeframe_batched(tickers, tf, dry_run=dry_run)
+
+        if dry_run:
+            return
+
+        # Tipos de cambio: cada sync diario deja fx_rates al día
+        if "1d" in timeframes:
+            self.sync_fx(already_synced=tickers)
         
         logging.info(f"✅ Sync Finalizado. Tiempo total: {time.time() - start_global:.2f}s")
 
-    def _sync_timeframe_batched(self, tickers: List[str], timeframe: str):
+    def sync_fx(self, already_synced: List[str] = None):
+        """Descarga (1d) los pares de divisas que falten y materializa fx_rates."""
+        fx = FxService(self.db)
+        pending = [p for p in fx.pair_tickers() if p not in set(already_synced or [])]
+        if pending:
+            self._sync_timeframe_batched(pending, "1d")
+        fx.refresh()
+
+    def plan_sync(self, tickers: List[str], timeframe: str):
+        """Plan de descargas del sync incremental sin descargar nada. Devuelve (requests, report naive vs plan)."""
         yf_interval = self._map_tf_to_yf(timeframe)
-        if not yf_interval:
-            logging.error(f"❌ Timeframe no soportado: {timeframe}")
-            return
 
         # 1. Analizar estado actual de la DB
         logging.info(f"   🔎 Buscando fechas existentes para [{timeframe}]...")
@@ -50,151 +90,251 @@ class Collector:
             logging.error(f"Error consultando fechas: {e}")
             existing_dates = {}
 
-        # 2. Agrupar por Start Date
-        groups = {}
+        # 2. Fecha de inicio por ticker (última vela - traslape, o historia completa si es nuevo)
         overlap = timedelta(days=5) 
-        
-        default_start = "2000-01-01"
-        if yf_interval in ["60m", "1h", "30m", "15m"]: 
-            default_start = (datetime.now() - timedelta(days=59)).strftime('%Y-%m-%d')
-            if yf_interval in ["60m", "1h"]:
-                 default_start = (datetime.now() - timedelta(days=720)).strftime('%Y-%m-%d')
+        default_start = self._default_start(yf_interval)
 
+        starts = {}
         for t in tickers:
             last_ts = existing_dates.get(t)
             if last_ts:
-                s_date = (pd.to_datetime(last_ts) - overlap).strftime('%Y-%m-%d')
+                starts[t] = (pd.to_datetime(last_ts) - overlap).strftime('%Y-%m-%d')
             else:
-                s_date = default_start
-            
-            if s_date not in groups:
-                groups[s_date] = []
-            groups[s_date].append(t)
-
-        logging.info(f"   ⚡ {len(groups)} grupos de descarga detectados.")
-
-        # 3. Descargar por Grupo
-        for start_date, batch_tickers in groups.items():
-            # CHUNKING (Smart Batching): Evita saturar YFinance y URLs demasiado largas
-            # 50 tickers por llamada es el sweet spot para estabilidad.
-            chunk_size = 50
-            total_chunks = (len(batch_tickers) - 1) // chunk_size + 1
-            
-            logging.info(f"      📡 Descargando {len(batch_tickers)} activos desde {start_date} ({total_chunks} chunks)...")
-            
-            for i in range(0, len(batch_tickers), chunk_size):
-                chunk = batch_tickers[i:i + chunk_size]
-                chunk_num = i // chunk_size + 1
-                
-                logging.info(f"         -> Chunk {chunk_num}/{total_chunks}: Solicitando {len(chunk)} tickers...")
-                t_start = time.time()
-                self._download_and_save_batch(chunk, start_date, yf_interval, timeframe)
-                logging.info(f"         ✅ Chunk {chunk_num} ok ({time.time() - t_start:.2f}s)")
-
-    def _download_and_save_batch(self, tickers: List[str], start_date: str, interval: str, timeframe: str):
-        try:
-            data = yf.download(tickers, start=start_date, interval=interval, auto_adjust=True, threads=False, progress=False)
-            
-            if data.empty:
-                logging.warning(f"            ⚠️ Batch vacío para {len(tickers)} tickers.")
+                starts[t] = default_start
+
+        # 3. Unir grupos de inicio con el modelo de costo (llamadas vs filas extra)
+        requests, report = SyncPlanner(timeframe, chunk_size=self.chunker.size).plan(starts)
+        naive, planned = report.loc["naive"], report.loc["planned"]
+        logging.info(
+            f"   ⚡ Plan [{timeframe}]: {int(naive['groups'])} grupos / {int(naive['requests'])} llamadas / {naive['est_mb']} MB -> "
+            f"{int(planned['groups'])} grupos / {int(planned['requests'])} llamadas / {planned['est_mb']} MB"
+        )
+        return requests, report
+
+    def _sync_timeframe_batched(self, tickers: List[str], timeframe: str, dry_run: bool = False):
+        yf_interval = self._map_tf_to_yf(timeframe)
+        if not yf_interval:
+            logging.error(f"❌ Timeframe no soportado: {timeframe}")
+            return
+
+        # Símbolos en cuarentena (vacíos / con error repetidamente) no ocupan lugar en los chunks
+        skip = self.health.quarantined(timeframe, tickers)
+        if skip:
+            logging.info(f"   🚫 [{timeframe}] {len(skip)} activos en cuarentena omitidos: {', '.join(sorted(skip)[:10])}{'...' if len(skip) > 10 else ''}")
+            tickers = [t for t in tickers if t not in skip]
+            if not tickers:
                 return
 
-            logging.info(f"            📥 Recibidos {len(data)} registros temporales.")
+        requests, _ = self.plan_sync(tickers, timeframe)
+        if dry_run:
+            for req in requests.itertuples(index=False):
+                logging.info(f"      📝 [dry-run] {req.n_tickers} activos desde {req.start} (~{req.est_rows} velas)")
+            return
+
+        # 4. Descargar por segmento del plan (mismo inicio), en chunks adaptativos
+        segments = [(start, [t for chunk in grp["tickers"] for t in chunk]) for start, grp in requests.groupby("start", sort=False)]
+        self._download_segments(segments, timeframe)
+
+        # 5. Salud por ticker (solo el sync incremental: una ventana de backfill vacía no dice que el símbolo esté muerto)
+        self.health.record(timeframe, self.outcomes)
+
+    def fetch_range(self, tickers: List[str], timeframe: str, start_date: str, end_date: str):
+        """Descarga una ventana acotada [start_date, end_date) para rellenar huecos (ver gaps.BackfillPlanner)."""
+        yf_interval = self._map_tf_to_yf(timeframe)
+        if not yf_interval:
+            logging.error(f"❌ Timeframe no soportado: {timeframe}")
+            return
+
+        self._download_segments([(start_date, tickers)], timeframe, end_date=end_date)
+
+    # --------------------------------------------------------------------------
+    # Descarga: chunks adaptativos, bisección de fallas y cola de reintentos
+    # --------------------------------------------------------------------------
 
-            # Normalizar estructura
-            # Caso A: Un solo ticker (Index es fecha, columnas son Open, Close...)
-            # Caso B: Multiples tickers (Columns Level 0: Price, Level 1: Ticker)
-            
+    def _download_segments(self, segments: List[Tuple[str, List[str]]], timeframe: str, end_date: str = None):
+        """
+        Descarga cada segmento (inicio, tickers) en chunks del tamaño actual del AdaptiveChunker.
+        Lo que falle (aislado por bisección) entra a una cola que se reintenta al final en chunks chicos;
+        lo que siga fallando queda en self.failed[timeframe].
+        """
+        retry: Dict[str, List[str]] = {}
+        calls = 0
+        self.outcomes = {}
+        for start, tickers in segments:
+            i = 0
+            while i < len(tickers):
+                chunk = tickers[i:i + self.chunker.size]
+                i += len(chunk)
+                calls += 1
+                logging.info(f"      📡 Llamada {calls}: {len(chunk)} activos desde {start} ({i}/{len(tickers)} del segmento)...")
+                for t in self._fetch_chunk(chunk, start, timeframe, end_date):
+                    retry.setdefault(start, []).append(t)
+
+        for attempt in range(1, RETRY_ROUNDS + 1):
+            if not retry:
+                break
+            pending = sum(len(t) for t in retry.values())
+            logging.warning(f"      🔁 Reintento {attempt}/{RETRY_ROUNDS}: {pending} activos fallidos (pausa {RETRY_BACKOFF_SECONDS * attempt}s)...")
+            time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+
+            queue, retry = retry, {}
+            for start, tickers in queue.items():
+                for i in range(0, len(tickers), self.chunker.size):
+                    for t in self._fetch_chunk(tickers[i:i + self.chunker.size], start, timeframe, end_date, adapt=False):
+                        retry.setdefault(start, []).append(t)
+
+        if retry:
+            lost = sorted({t for tickers in retry.values() for t in tickers})
+            self.failed.setdefault(timeframe, []).extend(lost)
+            logging.error(f"      ❌ [{timeframe}] {len(lost)} activos sin descargar tras {RETRY_ROUNDS} reintentos: {', '.join(lost[:10])}{'...' if len(lost) > 10 else ''}")
+
+    def _fetch_chunk(self, tickers: List[str], start_date: str, timeframe: str, end_date: str = None, adapt: bool = True) -> List[str]:
+        """
+        Descarga y guarda un chunk. Devuelve los tickers que fallaron:
+        - excepción: bisección recursiva para aislar los símbolos problemáticos (los buenos se guardan);
+          solo cuenta como error del chunk si falló completo,
+        - respuesta vacía en multi-ticker: todo el chunk a la cola (sin señal por símbolo; bisecar un throttle multiplica llamadas).
+        Un ticker solo que vuelve vacío no es falla de la llamada: no hay velas en la ventana.
+        Registra self.outcomes por ticker ('ok' / 'empty' / 'error'); un batch vacío no registra nada (puede ser throttle).
+        adapt=False en bisección y reintentos: un símbolo malo no debe encoger el chunk de todos.
+        """
+        t_start = time.time()
+        try:
+            # El proveedor ya entrega formato largo normalizado (ticker, date, open, high, low, close, volume)
+            df = self.provider.fetch(tickers, timeframe, start=start_date, end=end_date)
+        except Exception as e:
+            elapsed = time.time() - t_start
             if len(tickers) == 1:
-                # Caso especial: Un solo ticker puede venir como MultiIndex o Flat
-                # Si es MultiIndex (Price, Ticker), eliminamos el nivel de Ticker
-                if isinstance(data.columns, pd.MultiIndex):
-                    try:
-                        # Intentar seleccionar por nivel de ticker si existe
-                        data = data.xs(tickers[0], level=1, axis=1)
-                    except:
-                        # Fallback: drop level 1
-                        data = data.droplevel(1, axis=1)
-
-                df_to_process = data.copy()
-                df_to_process['ticker'] = tickers[0]
-                self._process_and_upsert(df_to_process, timeframe)
-                return
+                if adapt:
+                    self.chunker.record(1, elapsed, ok=False)
+                logging.error(f"            ❌ {tickers[0]}: {e}")
+                self.outcomes[tickers[0]] = ("error", str(e)[:200])
+                return tickers
+            mid = len(tickers) // 2
+            logging.warning(f"            ✂️ Error en chunk de {len(tickers)} ({e}). Bisección {mid}/{len(tickers) - mid}...")
+            failed = (self._fetch_chunk(tickers[:mid], start_date, timeframe, end_date, adapt=False)
+                      + self._fetch_chunk(tickers[mid:], start_date, timeframe, end_date, adapt=False))
+            if adapt:
+                # Si la bisección salvó parte del chunk, el problema eran símbolos y no el tamaño
+                self.chunker.record(len(tickers), elapsed, ok=len(failed) < len(tickers))
+            return failed
 
-            # Caso MultiIndex: Stackear para tener Ticker como columna
-            # data.columns levels: (Price, Ticker) -> stack level 1 (Ticker)
-            # Resultado: Index (Date, Ticker), Columns (Close, High, Low...)
-            try:
-                df_stacked = data.stack(level=1, future_stack=True)
-            except TypeError:
-                 # Compatibilidad pandas viejos
-                 df_stacked = data.stack(level=1)
-            
-            df_stacked = df_stacked.reset_index()
-            
-            # Renombrar columnas a minúsculas
-            # Stack convierte columnas a Index simple, str(c) es seguro aqui
-            df_stacked.columns = [str(c).lower() for c in df_stacked.columns]
-            
-            # Normalizar nombres de columnas esenciales
-            rename_map = {}
-            if 'date' not in df_stacked.columns and 'datetime' in df_stacked.columns:
-                rename_map['datetime'] = 'date'
-            
-            if rename_map:
-                df_stacked.rename(columns=rename_map, inplace=True)
-            
-            # Convertir TZ a naive UTC
-            if 'date' in df_stacked.columns:
-                 # Check dtype (Modern Pandas)
-                 if isinstance(df_stacked['date'].dtype, pd.DatetimeTZDtype):
-                     df_stacked['date'] = df_stacked['date'].dt.tz_convert("UTC").dt.tz_localize(None)
-
-                 # FIX DUPLICADOS 1D: Normalizar a medianoche
-                 if timeframe == '1d':
-                     df_stacked['date'] = df_stacked['date'].dt.normalize()
-
-            # Upsert masivo
-            if 'date' in df_stacked.columns:
-                self.db.upsert_ohlcv(df_stacked, timeframe)
-            else:
-                logging.error("❌ Batch ignorado: No se encontró columna 'date' tras procesar.")
+        elapsed = time.time() - t_start
+        ok = not (df.empty and len(tickers) > 1)
+        if adapt:
+            self.chunker.record(len(tickers), elapsed, ok=ok)
+        if not ok:
+            logging.warning(f"            ⚠️ Batch vacío para {len(tickers)} tickers.")
+            return tickers
+        if df.empty:
+            logging.warning(f"            ⚠️ {tickers[0]}: sin velas.")
+            self.outcomes[tickers[0]] = ("empty", None)
+            return []
 
+        logging.info(f"            📥 Recibidos {len(df)} registros ({elapsed:.2f}s).")
+        try:
+            self._save_batch(df, timeframe)
         except Exception as e:
-            logging.error(f"❌ Error batch download: {e}")
+            logging.error(f"            ❌ Error guardando batch: {e}")
+            return tickers
 
-    def _process_and_upsert(self, df: pd.DataFrame, timeframe: str):
-        """Helper para DF plano de un solo ticker."""
-        df = df.reset_index()
-        
-        # Sanitizar columnas (pueden ser tuplas si venian de multiindex mal aplanado)
-        new_cols = []
-        for c in df.columns:
-            if isinstance(c, tuple):
-                new_cols.append(str(c[0]).lower())
+        # Tickers del chunk que no vinieron en la respuesta: Yahoo no tiene datos para ellos
+        received = set(df['ticker'].unique())
+        for t in tickers:
+            self.outcomes[t] = ("ok", None) if t in received else ("empty", None)
+        return []
+
+    # --------------------------------------------------------------------------
+    # Ajustes retroactivos (splits / dividendos)
+    # --------------------------------------------------------------------------
+
+    def _save_batch(self, df: pd.DataFrame, timeframe: str):
+        """Upsert del batch; si el traslape revela un ajuste retroactivo, reescribe la historia de esos tickers."""
+        adjustments = self._detect_adjustments(df, timeframe)
+        self.db.upsert_ohlcv(df, timeframe)
+        for adj in adjustments.itertuples(index=False):
+            self._rewrite_history(adj.ticker, timeframe, adj.ref_ts, adj.factor)
+
+    def _detect_adjustments(self, df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+        """
+        Compara las velas descargadas contra las guardadas en el traslape. Con auto_adjust=True, un split o
+        dividendo re-escala toda la historia previa al ex-date, así que la vela más vieja del traslape trae
+        exactamente el factor que le falta a lo guardado. La última vela guardada se ignora (cierre provisional).
+        """
+        if not {'ticker', 'date', 'open', 'close'}.issubset(df.columns):
+            return pd.DataFrame(columns=['ticker', 'ref_ts', 'factor'])
+        new_bars = df[['ticker', 'date', 'open', 'close']].dropna(subset=['close'])
+        if new_bars.empty:
+            return pd.DataFrame(columns=['ticker', 'ref_ts', 'factor'])
+
+        self.db.conn.register('adj_new', new_bars)
+        try:
+            return self.db.conn.execute(f"""
+                WITH n AS (
+                    SELECT ticker, date AS ts, open, close FROM adj_new WHERE close > 0
+                ),
+                span AS (
+                    SELECT ticker, MIN(ts) AS min_ts FROM n GROUP BY ticker
+                ),
+                s AS (
+                    SELECT o.ticker, o.timestamp AS ts, o.open, o.close,
+                           row_number() OVER (PARTITION BY o.ticker ORDER BY o.timestamp DESC) AS rn_desc
+                    FROM ohlcv o
+                    JOIN span ON o.ticker = span.ticker AND o.timestamp >= span.min_ts
+                    WHERE o.timeframe = '{timeframe}'
+                ),
+                cmp AS (
+                    SELECT n.ticker, n.ts,
+                           n.close / s.close AS f_close,
+                           n.open / NULLIF(s.open, 0) AS f_open,
+                           row_number() OVER (PARTITION BY n.ticker ORDER BY n.ts) AS rn
+                    FROM n
+                    JOIN s ON s.ticker = n.ticker AND s.ts = n.ts
+                    WHERE s.rn_desc > 1 AND s.close > 0
+                )
+                SELECT ticker, ts AS ref_ts, f_close AS factor
+                FROM cmp
+                WHERE rn = 1
+                  AND abs(f_close - 1) > {ADJUSTMENT_TOLERANCE}
+                  AND (f_open IS NULL OR abs(f_open / f_close - 1) < {ADJUSTMENT_CONSISTENCY})
+            """).df()
+        finally:
+            self.db.conn.unregister('adj_new')
+
+    def _rewrite_history(self, ticker: str, timeframe: str, ref_ts, factor: float):
+        """Re-descarga la historia completa del ticker y la reescribe de forma atómica (indicadores invalidados)."""
+        kind = "split" if abs(factor - 1) > SPLIT_THRESHOLD else "dividend"
+        logging.warning(f"            ✂️ {ticker} [{timeframe}]: ajuste detectado ({kind}, factor {factor:.6f} en {ref_ts}). Reescribiendo historia...")
+
+        bars = 0
+        status = "failed"
+        try:
+            df = self.provider.fetch([ticker], timeframe, start=self._default_start(self._map_tf_to_yf(timeframe)))
+            if not df.empty:
+                bars = self.db.replace_ohlcv_history(ticker, timeframe, df, factor=factor, rescale_volume=(kind == "split"))
+                status = "rewritten"
+                self.adjusted.setdefault(timeframe, []).append(ticker)
             else:
-                new_cols.append(str(c).lower())
-        df.columns = new_cols
+                logging.error(f"            ❌ {ticker}: re-descarga vacía, se conserva la historia actual")
+        except Exception as e:
+            logging.error(f"            ❌ {ticker}: error reescribiendo historia: {e}")
 
-        if 'datetime' in df.columns: df.rename(columns={'datetime': 'date'}, inplace=True)
-        
-        if 'date' in df.columns and isinstance(df['date'].dtype, pd.DatetimeTZDtype):
-             df['date'] = df['date'].dt.tz_convert("UTC").dt.tz_localize(None)
+        self.db.log_adjustment(ticker, timeframe, ref_ts, factor, kind, bars, status)
+        publish_event(self.db, ADJUSTMENT, {"ticker": ticker, "timeframe": timeframe, "kind": kind, "factor": factor, "status": status})
 
-        # FIX DUPLICADOS 1D: Normalizar a medianoche
-        if timeframe == '1d' and 'date' in df.columns:
-             df['date'] = df['date'].dt.normalize()
-        
-        if 'date' in df.columns:
-            self.db.upsert_ohlcv(df, timeframe)
-        else:
-            logging.warning("⚠️ Ticker único ignorado: Falta columna 'date'")
+    def _default_start(self, yf_interval: str) -> str:
+        """Inicio de historia completa por intervalo (límites de Yahoo para intradía)."""
+        if yf_interval in ["60m", "1h"]:
+            return (datetime.now() - timedelta(days=720)).strftime('%Y-%m-%d')
+        if yf_interval in ["30m", "15m"]:
+            return (datetime.now() - timedelta(days=59)).strftime('%Y-%m-%d')
+        return "2000-01-01"
 
     def _map_tf_to_yf(self, tf: str) -> str:
         map_ = { "1d": "1d", "1h": "1h", "15m": "15m", "5m": "5m" }
         return map_.get(tf, None)
     
-    # Metadata sync separado (se llamará desde un Job semanal)
-    def sync_metadata_batch(self, tickers: List[str]):
-        """Baja metadata uno por uno (lento, usar con cuidado)."""
-        pass # Implementar si se requiere un job específico
+    # Metadata sync separado (job semanal svc_v2.jobs.metadata_sync)
+    def sync_metadata_batch(self, tickers: List[str], force: bool = False) -> Dict[str, int]:
+        """Refresca fichas vencidas (nombre, sector, divisa, earnings) con pool acotado y rate limit."""
+        return MetadataSync(self.db, self.provider).refresh(tickers, force=force)
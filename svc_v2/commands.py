@@ -0,0 +1,230 @@
+import json
+import logging
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from svc_v2.db import Database
+from svc_v2 import events
+from svc_v2.profiling import save_query_profile
+
+# Log de comandos junto al archivo principal (la API y el daemon montan la misma carpeta data/).
+# Es SQLite y no DuckDB a propósito: encolar no puede depender del lock de escritura de markets.duckdb.
+COMMAND_LOG_FILENAME = "commands.sqlite"
+
+PENDING, APPLIED, FAILED = "pending", "applied", "failed"
+
+# Comandos aplicados por pasada del writer (el daemon vuelve a su loop entre pasadas)
+MAX_BATCH = 100
+
+# Comandos terminados (applied / failed) que se conservan para consultar su estado
+COMMAND_RETENTION_DAYS = 30
+
+# Lados válidos de una transacción (mismos que entiende el replay FIFO del portafolio)
+TRANSACTION_SIDES = {"BUY", "SELL", "DIVIDEND", "SPLIT"}
+
+def command_log_path(db_path) -> Path:
+    return Path(db_path).parent / COMMAND_LOG_FILENAME
+
+class CommandLog:
+    """
+    Cola durable de escrituras (SQLite en modo WAL). La API solo inserta y consulta estados, así que
+    nunca toma el lock de DuckDB; el único escritor (CommandWriter en el daemon) aplica en orden de id.
+    """
+
+    def __init__(self, db_path):
+        self.path = command_log_path(db_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS commands (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    applied_at TEXT
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS commands_status ON commands (status, id)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.path, timeout=10)
+        con.row_factory = sqlite3.Row
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=FULL")
+            yield con
+            con.commit()
+        finally:
+            con.close()
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        out = dict(row)
+        for col in ("payload", "result"):
+            out[col] = json.loads(out[col]) if out.get(col) else None
+        return out
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        """Agrega un comando y devuelve su id (acuse: ya está en disco)."""
+        if kind not in COMMAND_HANDLERS:
+            raise ValueError(f"Comando desconocido: {kind}")
+        with self._connect() as con:
+            cur = con.execute(
+                "INSERT INTO commands (kind, payload, created_at) VALUES (?, ?, ?)",
+                [kind, json.dumps(payload, default=str), datetime.now().isoformat(sep=" ", timespec="seconds")]
+            )
+            return int(cur.lastrowid)
+
+    def get(self, command_id: int) -> Optional[Dict[str, Any]]:
+        with self._connect() as con:
+            row = con.execute("SELECT * FROM commands WHERE id = ?", [command_id]).fetchone()
+        return self._row(row) if row else None
+
+    def pending(self, limit: int = MAX_BATCH) -> List[Dict[str, Any]]:
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT * FROM commands WHERE status = ? ORDER BY id LIMIT ?", [PENDING, limit]
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def has_pending(self) -> bool:
+        with self._connect() as con:
+            return con.execute("SELECT 1 FROM commands WHERE status = ? LIMIT 1", [PENDING]).fetchone() is not None
+
+    def mark(self, command_id: int, status: str, result: Any = None, error: Optional[str] = None):
+        with self._connect() as con:
+            con.execute(
+                "UPDATE commands SET status = ?, result = ?, error = ?, applied_at = ? WHERE id = ?",
+                [status, json.dumps(result, default=str) if result is not None else None, error,
+                 datetime.now().isoformat(sep=" ", timespec="seconds"), command_id]
+            )
+
+    def purge(self, days: int = COMMAND_RETENTION_DAYS):
+        """Borra comandos terminados más viejos que `days` (los pendientes nunca)."""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat(sep=" ", timespec="seconds")
+        with self._connect() as con:
+            con.execute("DELETE FROM commands WHERE status != ? AND created_at < ?", [PENDING, cutoff])
+
+# --------------------------------------------------------------------------
+# Handlers (corren dentro de la transacción de DuckDB del writer; una excepción = comando fallido)
+# --------------------------------------------------------------------------
+
+def _add_transaction(db: Database, payload: Dict[str, Any]) -> Dict[str, Any]:
+    side = str(payload["side"]).upper()
+    if side not in TRANSACTION_SIDES:
+        raise ValueError(f"Side inválido: {side}")
+    ticker = str(payload["ticker"]).upper()
+    currency = str(payload.get("currency") or "MXN").upper()
+    tx_id = db.conn.execute("""
+        INSERT INTO portfolio_transactions (ticker, side, qty, price, fees, notes, timestamp, currency)
+        VALUES (?, ?, ?, ?, ?, ?, COALESCE(?::TIMESTAMP, now()), ?)
+        RETURNING id
+    """, [ticker, side, float(payload["qty"]), float(payload["price"]), float(payload.get("fees") or 0.0),
+          payload.get("notes"), payload.get("timestamp"), currency]).fetchone()[0]
+    logging.info(f"💰 Transacción registrada: {side} {payload['qty']} {ticker} @ {payload['price']} {currency} (#{tx_id})")
+    events.publish_event(db, events.TRANSACTION, {"action": "add", "ticker": ticker, "id": tx_id})
+    return {"id": int(tx_id)}
+
+def _delete_transaction(db: Database, payload: Dict[str, Any]) -> Dict[str, Any]:
+    tx_id = int(payload["id"])
+    deleted = db.conn.execute("DELETE FROM portfolio_transactions WHERE id = ? RETURNING id", [tx_id]).fetchall()
+    if not deleted:
+        raise ValueError(f"Transacción {tx_id} no existe")
+    events.publish_event(db, events.TRANSACTION, {"action": "delete", "id": tx_id})
+    return {"id": tx_id}
+
+def _record_query_profile(db: Database, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Perfil de una query lenta de la API (conexión de solo lectura): ver svc_v2/profiling.py
+    return {"id": save_query_profile(db.conn, payload)}
+
+def _publish_snapshot(db: Database, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Sin escritura propia: el snapshot lo publica before_ack, como con cualquier comando visible
+    # (lo encola la API tras correr un tool, para no abrir DuckDB en escritura ella misma)
+    return {"label": payload.get("label")}
+
+COMMAND_HANDLERS: Dict[str, Callable[[Database, Dict[str, Any]], Dict[str, Any]]] = {
+    "add_transaction": _add_transaction,
+    "delete_transaction": _delete_transaction,
+    "record_query_profile": _record_query_profile,
+    "publish_snapshot": _publish_snapshot,
+}
+
+# Comandos que no cambian lo que lee la UI: no ameritan publicar un snapshot antes del acuse
+BACKGROUND_COMMANDS = {"record_query_profile"}
+
+class CommandWriter:
+    """
+    Único escritor de comandos: aplica los pendientes en orden de id sobre DuckDB. Cada comando corre en
+    su propia transacción junto con su registro en applied_commands, así un corte entre DuckDB y el log
+    no lo aplica dos veces (al reintentar se encuentra el registro y solo se marca).
+    """
+
+    def __init__(self, db: Database, log: CommandLog):
+        self.db = db
+        self.log = log
+
+    def apply_pending(self, before_ack: Optional[Callable[[], Any]] = None) -> int:
+        """
+        Aplica un lote de pendientes. Devuelve cuántos se acusaron (los fallidos no cuentan).
+        `before_ack` corre después de escribir y antes de marcarlos aplicados (p. ej. publicar el snapshot
+        de lectura: cuando la UI ve 'applied', las lecturas ya muestran el cambio). Si lanza, el lote
+        queda pendiente para la siguiente pasada. No corre si el lote solo trae BACKGROUND_COMMANDS.
+        """
+        acks, visible = [], False
+        for cmd in self.log.pending(MAX_BATCH):
+            handler = COMMAND_HANDLERS.get(cmd["kind"])
+            if handler is None:
+                self.log.mark(cmd["id"], FAILED, error=f"Comando desconocido: {cmd['kind']}")
+                continue
+
+            self.db.conn.execute("BEGIN TRANSACTION")
+            try:
+                done = self.db.conn.execute(
+                    "SELECT result FROM applied_commands WHERE command_id = ?", [cmd["id"]]
+                ).fetchone()
+                if done:
+                    result = json.loads(done[0]) if done[0] else None
+                else:
+                    result = handler(self.db, cmd["payload"])
+                    self.db.conn.execute(
+                        "INSERT INTO applied_commands (command_id, kind, result) VALUES (?, ?, ?)",
+                        [cmd["id"], cmd["kind"], json.dumps(result, default=str)]
+                    )
+                self.db.conn.execute("COMMIT")
+            except Exception as e:
+                self.db.conn.execute("ROLLBACK")
+                logging.warning(f"   ⚠️ Comando #{cmd['id']} ({cmd['kind']}) falló: {e}")
+                self.log.mark(cmd["id"], FAILED, error=str(e))
+                continue
+
+            acks.append((cmd["id"], result))
+            visible = visible or cmd["kind"] not in BACKGROUND_COMMANDS
+
+        if not acks:
+            return 0
+        if before_ack and visible:
+            try:
+                before_ack()
+            except Exception as e:
+                # Sin acuse: el lote queda pendiente y el reintento solo lo marca (ya está en applied_commands)
+                logging.warning(f"   ⚠️ {len(acks)} comandos aplicados sin acuse, se reintenta: {e}")
+                return 0
+        for command_id, result in acks:
+            self.log.mark(command_id, APPLIED, result=result)
+        logging.info(f"   ✍️ {len(acks)} comandos aplicados")
+        self.log.purge()
+        return len(acks)
+
+if __name__ == "__main__":
+    # Drenado manual (desarrollo sin daemon): python -m svc_v2.commands
+    from svc_v2.config_loader import load_settings
+    cfg = load_settings()
+    db = Database(f"data/{cfg.system.db_filename}")
+    print(CommandWriter(db, CommandLog(db.db_path)).apply_pending())
+    db.close()
@@ -10,6 +10,8 @@ class SystemConfig(BaseModel):
     db_filename: str = "markets.duckdb"
     log_level: str = "INFO"
     timezone: str = "America/Mexico_City"
+    read_snapshots: bool = True  # El daemon publica una copia de solo lectura tras cada job y la API lee de ahí (copia completa; ~4x disco)
+    startup_budget_ms: int = 2000  # Arranque en frío máximo de un job (tools/bench_startup.py --check)
 
 class HoldingConfig(BaseModel):
     ticker: str
@@ -41,6 +43,12 @@ class UniverseConfig(BaseModel):
 class DataConfig(BaseModel):
     timeframes: Dict[str, List[str]]
     market_hours: Dict[str, str]
+    provider: str = "yfinance"          # 'yfinance' | 'replay' (env MARKET_DATA_PROVIDER tiene prioridad)
+    replay_path: str = "data/replay"    # Raíz del replay offline: {replay_path}/{timeframe}/{ticker}.parquet|csv
+
+class StorageConfig(BaseModel):
+    retention_days: Dict[str, int] = {"1h": 730, "15m": 180, "5m": 60}  # Historia intradía que se conserva (1d nunca se recorta)
+    size_budget_mb: Optional[int] = None  # Si la DB lo excede, el mantenimiento recorta más historia intradía
 
 class IndicatorsConfig(BaseModel):
     rsi: Dict[str, Any]
@@ -60,6 +68,7 @@ class JournalConfig(BaseModel):
 class JobConfig(BaseModel):
     enabled: bool = True
     run_at: Optional[List[str]] = None
+    day: Optional[str] = None  # Jobs semanales: "sunday", "monday", ... (run_at = hora)
     interval_min: Optional[int] = None
     respect_market_hours: bool = False
 
@@ -72,6 +81,7 @@ class SettingsV2(BaseModel):
     portfolios: PortfoliosConfig
     universe: UniverseConfig
     data: DataConfig
+    storage: StorageConfig = StorageConfig()
     indicators: IndicatorsConfig
     alerts: AlertsConfig
     journal: JournalConfig
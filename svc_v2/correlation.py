@@ -0,0 +1,299 @@
+import json
+import logging
+import time
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from svc_v2.db import Database
+
+# Ventana (en velas diarias) de la matriz de correlación
+CORR_WINDOW = 60
+
+# Tickers sin vela en los últimos N días quedan fuera del universo (deslistados / sin datos)
+CORR_STALENESS_DAYS = 10
+
+# Umbral de correlación promedio para unir grupos (average linkage)
+CLUSTER_MIN_CORR = 0.7
+
+def _to_blob(arr: np.ndarray) -> bytes:
+    return np.ascontiguousarray(arr).tobytes()
+
+def _from_blob(blob: bytes, dtype, shape) -> np.ndarray:
+    return np.frombuffer(blob, dtype=dtype).reshape(shape).copy()
+
+class CorrelationEngine:
+    """
+    Matriz de correlación rolling (retornos diarios, CORR_WINDOW velas) del universo.
+
+    Mantiene en `correlation_state` las sumas Σr y Σrrᵀ de la ventana: cada corrida
+    solo suma las velas nuevas y resta las que salen (actualización de rango k),
+    sin recalcular la matriz desde cero. Si cambia el universo se reconstruye.
+    """
+
+    def __init__(self, db: Database, window: int = CORR_WINDOW):
+        self.db = db
+        self.window = window
+
+    # --------------------------------------------------------------------------
+    # UPDATE
+    # --------------------------------------------------------------------------
+
+    def update(self, force_full: bool = False) -> Optional[pd.Timestamp]:
+        """Actualiza matriz y clusters. Devuelve la fecha (as_of) de la matriz resultante."""
+        t_start = time.time()
+        tickers = self._universe()
+        if len(tickers) < 2:
+            logging.warning("⚠️ Correlación: universo insuficiente.")
+            return None
+
+        state = None if force_full else self._load_state()
+        if state is None or state['tickers'] != tickers or self._adjusted_since(state['updated_at']):
+            state = self._rebuild(tickers)
+            mode = "full"
+        else:
+            state = self._roll(state)
+            mode = "incremental"
+
+        if state is None:
+            return None
+
+        corr = self._corr(state)
+        self._save_state(state, corr)
+        self._save_clusters(tickers, corr)
+        logging.info(f"🔗 Correlación [{self.window}d, {mode}]: {len(tickers)} tickers al {state['dates'][-1]} ({time.time() - t_start:.2f}s)")
+        return pd.Timestamp(state['dates'][-1])
+
+    def _universe(self) -> List[str]:
+        rows = self.db.conn.execute(f"""
+            SELECT ticker
+            FROM ohlcv
+            WHERE timeframe = '1d'
+            GROUP BY ticker
+            HAVING MAX(timestamp) >= (SELECT MAX(timestamp) FROM ohlcv WHERE timeframe = '1d') - INTERVAL {CORR_STALENESS_DAYS} DAY
+            ORDER BY ticker
+        """).fetchall()
+        return [r[0] for r in rows]
+
+    def _closes(self, tickers: List[str], since=None, last_n: Optional[int] = None) -> pd.DataFrame:
+        """Pivot fecha x ticker de cierres 1d (columnas en el orden de `tickers`)."""
+        tickers_sql = ",".join([f"('{t}')" for t in tickers])
+        date_filter = ""
+        if since is not None:
+            date_filter = f"AND o.timestamp >= TIMESTAMP '{since}'"
+        elif last_n is not None:
+            date_filter = f"""
+                AND o.timestamp IN (
+                    SELECT DISTINCT timestamp FROM ohlcv
+                    WHERE timeframe = '1d' AND ticker IN (SELECT ticker FROM u)
+                    ORDER BY timestamp DESC LIMIT {int(last_n)}
+                )
+            """
+        df = self.db.conn.execute(f"""
+            WITH u AS (SELECT * FROM (VALUES {tickers_sql}) AS t(ticker))
+            SELECT o.ticker, o.timestamp, o.close
+            FROM ohlcv o
+            JOIN u ON o.ticker = u.ticker
+            WHERE o.timeframe = '1d' {date_filter}
+        """).df()
+        if df.empty:
+            return pd.DataFrame(columns=tickers, dtype=float)
+        return df.pivot(index='timestamp', columns='ticker', values='close').sort_index().reindex(columns=tickers)
+
+    def _rebuild(self, tickers: List[str]) -> Optional[dict]:
+        px = self._closes(tickers, last_n=self.window + 1)
+        if len(px) < 3:
+            return None
+        # Feriados / tickers recién listados: sin cambio de precio (retorno 0)
+        px = px.ffill().bfill()
+        prices = px.to_numpy(dtype=np.float64)
+        rets = self._returns(prices)
+        return {
+            "tickers": tickers,
+            "dates": [str(d) for d in px.index],
+            "prices": prices,
+            "sum_r": rets.sum(axis=0),
+            "sum_rr": rets.T @ rets,
+        }
+
+    def _roll(self, state: dict) -> dict:
+        prices, sum_r, sum_rr = state['prices'], state['sum_r'], state['sum_rr']
+        dates = list(state['dates'])
+
+        # 1. La última vela puede haber cambiado (cierre provisional): se saca y se vuelve a leer
+        r_last = self._returns(prices[-2:])
+        sum_r = sum_r - r_last.sum(axis=0)
+        sum_rr = sum_rr - r_last.T @ r_last
+        reread_from = dates[-1]
+        prices, dates = prices[:-1], dates[:-1]
+
+        # 2. Velas nuevas (ffill sembrado con el último cierre conocido)
+        new_px = self._closes(state['tickers'], since=reread_from)
+        if not new_px.empty:
+            seed = pd.DataFrame([prices[-1]], columns=state['tickers'], index=[pd.Timestamp(dates[-1])])
+            new_px = pd.concat([seed, new_px]).ffill().iloc[1:]
+            new_prices = new_px.to_numpy(dtype=np.float64)
+            r_new = self._returns(np.vstack([prices[-1:], new_prices]))
+            sum_r = sum_r + r_new.sum(axis=0)
+            sum_rr = sum_rr + r_new.T @ r_new
+            prices = np.vstack([prices, new_prices])
+            dates += [str(d) for d in new_px.index]
+
+        # 3. Sacar de la ventana las velas viejas
+        excess = len(prices) - (self.window + 1)
+        if excess > 0:
+            r_old = self._returns(prices[:excess + 1])
+            sum_r = sum_r - r_old.sum(axis=0)
+            sum_rr = sum_rr - r_old.T @ r_old
+            prices, dates = prices[excess:], dates[excess:]
+
+        return {"tickers": state['tickers'], "dates": dates, "prices": prices, "sum_r": sum_r, "sum_rr": sum_rr}
+
+    @staticmethod
+    def _returns(prices: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rets = prices[1:] / prices[:-1] - 1
+        return np.nan_to_num(rets, nan=0.0, posinf=0.0, neginf=0.0)
+
+    @staticmethod
+    def _corr(state: dict) -> np.ndarray:
+        n = len(state['prices']) - 1
+        mean = state['sum_r'] / n
+        cov = (state['sum_rr'] - n * np.outer(mean, mean)) / (n - 1)
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = cov / np.outer(std, std)
+        corr = np.clip(corr, -1.0, 1.0)
+        np.fill_diagonal(corr, 1.0)
+        return corr.astype(np.float32)
+
+    # --------------------------------------------------------------------------
+    # CLUSTERING
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def cluster(corr: np.ndarray, min_corr: float = CLUSTER_MIN_CORR) -> np.ndarray:
+        """
+        Agrupamiento jerárquico (average linkage) sobre la correlación.
+        Une grupos mientras su correlación promedio sea >= min_corr.
+        Devuelve el id de cluster por ticker (1 = el grupo más grande).
+        """
+        n = len(corr)
+        sim = np.nan_to_num(corr.astype(np.float64), nan=-1.0)
+        np.fill_diagonal(sim, -np.inf)
+        sizes = np.ones(n)
+        labels = np.arange(n)
+
+        for _ in range(n - 1):
+            flat = np.argmax(sim)
+            i, j = divmod(flat, n)
+            if sim[i, j] < min_corr:
+                break
+            # Lance-Williams (average): similitud promedio ponderada por tamaño
+            merged = (sizes[i] * sim[i] + sizes[j] * sim[j]) / (sizes[i] + sizes[j])
+            sim[i, :] = merged
+            sim[:, i] = merged
+            sim[i, i] = -np.inf
+            sim[j, :] = -np.inf
+            sim[:, j] = -np.inf
+            sizes[i] += sizes[j]
+            labels[labels == j] = i
+
+        # Renumerar: 1..K por tamaño descendente
+        uniq, counts = np.unique(labels, return_counts=True)
+        order = uniq[np.argsort(-counts, kind='stable')]
+        remap = {old: new for new, old in enumerate(order, start=1)}
+        return np.array([remap[l] for l in labels])
+
+    # --------------------------------------------------------------------------
+    # PERSISTENCIA
+    # --------------------------------------------------------------------------
+
+    def _load_state(self) -> Optional[dict]:
+        row = self.db.conn.execute(
+            "SELECT tickers, dates, prices, sum_r, sum_rr, updated_at FROM correlation_state WHERE window_size = ?",
+            [self.window]
+        ).fetchone()
+        if not row:
+            return None
+        tickers, dates = json.loads(row[0]), json.loads(row[1])
+        n = len(tickers)
+        return {
+            "tickers": tickers,
+            "dates": dates,
+            "prices": _from_blob(row[2], np.float64, (len(dates), n)),
+            "sum_r": _from_blob(row[3], np.float64, (n,)),
+            "sum_rr": _from_blob(row[4], np.float64, (n, n)),
+            "updated_at": row[5],
+        }
+
+    def _adjusted_since(self, updated_at) -> bool:
+        """Historia 1d reescrita (split/dividendo) después del último guardado: los precios del estado ya no sirven."""
+        res = self.db.conn.execute(
+            "SELECT COUNT(*) FROM price_adjustments WHERE timeframe = '1d' AND status = 'rewritten' AND detected_at > ?",
+            [updated_at]
+        ).fetchone()
+        return bool(res and res[0])
+
+    def _save_state(self, state: dict, corr: np.ndarray):
+        self.db.conn.execute("""
+            INSERT INTO correlation_state (window_size, as_of, tickers, dates, prices, sum_r, sum_rr, corr, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, now())
+            ON CONFLICT (window_size) DO UPDATE SET
+                as_of = EXCLUDED.as_of,
+                tickers = EXCLUDED.tickers,
+                dates = EXCLUDED.dates,
+                prices = EXCLUDED.prices,
+                sum_r = EXCLUDED.sum_r,
+                sum_rr = EXCLUDED.sum_rr,
+                corr = EXCLUDED.corr,
+                updated_at = EXCLUDED.updated_at
+        """, [
+            self.window, pd.Timestamp(state['dates'][-1]).to_pydatetime(),
+            json.dumps(state['tickers']), json.dumps(state['dates']),
+            _to_blob(state['prices']), _to_blob(state['sum_r']), _to_blob(state['sum_rr']), _to_blob(corr),
+        ])
+
+    def _save_clusters(self, tickers: List[str], corr: np.ndarray):
+        labels = self.cluster(corr)
+        df = pd.DataFrame({"ticker": tickers, "cluster_id": labels})
+        df['cluster_size'] = df.groupby('cluster_id')['ticker'].transform('size')
+
+        # Correlación promedio de cada ticker con el resto de su grupo
+        avg = np.full(len(tickers), np.nan)
+        for cid in np.unique(labels):
+            idx = np.where(labels == cid)[0]
+            if len(idx) > 1:
+                sub = corr[np.ix_(idx, idx)].astype(np.float64)
+                avg[idx] = (sub.sum(axis=1) - 1.0) / (len(idx) - 1)
+        df['avg_corr'] = avg
+
+        self.db.conn.execute("DELETE FROM correlation_clusters WHERE window_size = ?", [self.window])
+        self.db.conn.register("clusters_new", df)
+        try:
+            self.db.conn.execute(f"""
+                INSERT INTO correlation_clusters (window_size, ticker, cluster_id, cluster_size, avg_corr, updated_at)
+                SELECT {int(self.window)}, ticker, cluster_id, cluster_size, avg_corr, now() FROM clusters_new
+            """)
+        finally:
+            self.db.conn.unregister("clusters_new")
+
+    # --------------------------------------------------------------------------
+    # LECTURA (API)
+    # --------------------------------------------------------------------------
+
+    def get_matrix(self, tickers: Optional[List[str]] = None):
+        """(tickers, as_of, corr float32) de la última matriz, opcionalmente recortada a `tickers`."""
+        row = self.db.conn.execute(
+            "SELECT tickers, as_of, corr FROM correlation_state WHERE window_size = ?", [self.window]
+        ).fetchone()
+        if not row:
+            return [], None, np.zeros((0, 0), dtype=np.float32)
+
+        all_tickers = json.loads(row[0])
+        corr = _from_blob(row[2], np.float32, (len(all_tickers), len(all_tickers)))
+        if tickers:
+            pos = {t: k for k, t in enumerate(all_tickers)}
+            keep = [t for t in tickers if t in pos]
+            idx = [pos[t] for t in keep]
+            return keep, row[1], corr[np.ix_(idx, idx)]
+        return all_tickers, row[1], corr
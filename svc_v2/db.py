@@ -1,25 +1,36 @@
 import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import logging
 from pathlib import Path
 from threading import Lock
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from svc_v2.profiling import ProfiledConnection, save_query_profile
 
 # Configuración por defecto (será sobreescrita por el config loader)
 DEFAULT_DB_PATH = "data/markets.duckdb"
 
+CANDLE_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+# Filas por record batch en las lecturas streaming (memoria acotada: un ticker + un batch)
+STREAM_BATCH_ROWS = 100_000
+
 class Database:
     def __init__(self, db_path: str = DEFAULT_DB_PATH, read_only: bool = False):
         self._init_db(db_path, read_only)
 
     def _init_db(self, db_path: str, read_only: bool):
         self.db_path = Path(db_path)
+        self.read_only = read_only
         if not read_only:
             self.db_path.parent.mkdir(parents=True, exist_ok=True)
         
-        self.conn = duckdb.connect(str(self.db_path), read_only=read_only)
+        # Conexión envuelta: cada statement se cronometra y los lentos van a query_profiles
+        self.conn = ProfiledConnection(duckdb.connect(str(self.db_path), read_only=read_only), self)
         if not read_only:
             self._create_tables()
+            self._backfill_fx_rates()
         logging.info(f"🦆 DuckDB conectada en: {self.db_path} (RO={read_only})")
 
     def __enter__(self):
@@ -49,42 +60,44 @@ class Database:
         """)
 
         # 2. Tabla INDICATORS (Datos calculados)
-        # Separada para permitir borrar y recalcular sin perder precios
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS indicators (
-                ticker VARCHAR,
-                timeframe VARCHAR,
-                timestamp TIMESTAMP,
-                
-                -- Momentum
-                rsi DOUBLE,
-                macd DOUBLE,
-                macd_signal DOUBLE,
-                macd_hist DOUBLE,
-                adx DOUBLE,
-                
-                -- Trend / Structure
-                ema_20 DOUBLE,
-                ema_50 DOUBLE,
-                ema_200 DOUBLE,
-                donchian_high DOUBLE,
-                donchian_low DOUBLE,
-                
-                -- Volatility / Bands
-                bb_upper DOUBLE,
-                bb_mid DOUBLE,
-                bb_lower DOUBLE,
-                
-                -- Custom Metrics (Manifiesto)
-                vol_k DOUBLE,
-                gap_pct DOUBLE,
-                chg_pct DOUBLE,
-                
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (ticker, timeframe, timestamp),
-                FOREIGN KEY (ticker, timeframe, timestamp) REFERENCES ohlcv(ticker, timeframe, timestamp)
-            );
-        """)
+        # Separada para permitir borrar y recalcular sin perder precios.
+        # El IF NOT EXISTS con FOREIGN KEY reescribe ohlcv en el catálogo aunque la tabla ya exista: se chequea antes
+        if not self._table_exists("indicators"):
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS indicators (
+                    ticker VARCHAR,
+                    timeframe VARCHAR,
+                    timestamp TIMESTAMP,
+
+                    -- Momentum
+                    rsi DOUBLE,
+                    macd DOUBLE,
+                    macd_signal DOUBLE,
+                    macd_hist DOUBLE,
+                    adx DOUBLE,
+
+                    -- Trend / Structure
+                    ema_20 DOUBLE,
+                    ema_50 DOUBLE,
+                    ema_200 DOUBLE,
+                    donchian_high DOUBLE,
+                    donchian_low DOUBLE,
+
+                    -- Volatility / Bands
+                    bb_upper DOUBLE,
+                    bb_mid DOUBLE,
+                    bb_lower DOUBLE,
+
+                    -- Custom Metrics (Manifiesto)
+                    vol_k DOUBLE,
+                    gap_pct DOUBLE,
+                    chg_pct DOUBLE,
+
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (ticker, timeframe, timestamp),
+                    FOREIGN KEY (ticker, timeframe, timestamp) REFERENCES ohlcv(ticker, timeframe, timestamp)
+                );
+            """)
 
         # 3. Tabla LOGS (Auditoría interna)
         self.conn.execute("""
@@ -96,8 +109,12 @@ class Database:
                 message VARCHAR
             );
             CREATE SEQUENCE IF NOT EXISTS log_id_seq;
-            ALTER TABLE system_logs ALTER COLUMN id SET DEFAULT nextval('log_id_seq');
         """)
+        # Solo en bases viejas: un ALTER en cada apertura reescribe el catálogo (y el snapshot ya no se salta)
+        if self.conn.execute(
+            "SELECT column_default IS NULL FROM duckdb_columns() WHERE table_name = 'system_logs' AND column_name = 'id'"
+        ).fetchone()[0]:
+            self.conn.execute("ALTER TABLE system_logs ALTER COLUMN id SET DEFAULT nextval('log_id_seq')")
 
         # 4. Tabla METADATA (Earnings, Sector, etc.)
         self.conn.execute("""
@@ -107,8 +124,14 @@ class Database:
                 next_earnings TIMESTAMP,
                 sector VARCHAR,
                 industry VARCHAR,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                currency VARCHAR,       -- Divisa de cotización (NULL = se infiere del símbolo)
+                asset_type VARCHAR,     -- 'Stock' | 'ETF' | 'FIBRA' | 'Fund' ...
+                metadata_synced_at TIMESTAMP -- Última ficha bajada del proveedor (TTL del job metadata_sync)
             );
+            ALTER TABLE ticker_metadata ADD COLUMN IF NOT EXISTS currency VARCHAR;
+            ALTER TABLE ticker_metadata ADD COLUMN IF NOT EXISTS asset_type VARCHAR;
+            ALTER TABLE ticker_metadata ADD COLUMN IF NOT EXISTS metadata_synced_at TIMESTAMP;
         """)
 
         # 5. Tabla DYNAMIC WATCHLIST (El puente entre Broad y Detailed)
@@ -149,8 +172,7 @@ class Database:
         """)
 
         # 7. Vista PORTFOLIO HOLDINGS (Lógica FIFO Robusta)
-        self.conn.execute("""
-            CREATE OR REPLACE VIEW view_portfolio_holdings AS
+        self._ensure_view("view_portfolio_holdings", """
             WITH total_sold AS (
                 SELECT ticker, SUM(qty) as sold_qty
                 FROM portfolio_transactions
@@ -184,9 +206,327 @@ class Database:
                 SUM(rem_qty * price) / NULLIF(SUM(rem_qty), 0) as avg_buy_price
             FROM remaining_buys
             GROUP BY ticker
-            HAVING SUM(rem_qty) > 0;
+            HAVING SUM(rem_qty) > 0
+        """)
+
+        # 8. Tabla BACKTEST RESULTS (Caché de estadísticas por definición de estrategia)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS backtest_results (
+                def_hash VARCHAR,       -- Hash de condiciones + dirección + horizontes
+                strategy VARCHAR,
+                timeframe VARCHAR,
+                horizon INTEGER,        -- Velas hacia adelante
+                hits INTEGER,
+                avg_ret DOUBLE,         -- % a favor de la estrategia
+                median_ret DOUBLE,
+                hit_rate DOUBLE,        -- % de hits con retorno > 0
+                avg_mae DOUBLE,         -- Max Adverse Excursion promedio (%)
+                worst_mae DOUBLE,
+                data_version TIMESTAMP, -- MAX(updated_at) de indicators al calcular
+                computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (def_hash, timeframe, horizon)
+            );
+        """)
+
+        # 9. Tabla SYSTEM EVENTS (Bus de cambios para el push SSE de la API)
+        self.conn.execute("""
+            CREATE SEQUENCE IF NOT EXISTS event_id_seq;
+            CREATE TABLE IF NOT EXISTS system_events (
+                id BIGINT PRIMARY KEY DEFAULT nextval('event_id_seq'),
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                kind VARCHAR,       -- job_finished | signal | transaction
+                payload VARCHAR     -- JSON
+            );
+        """)
+
+        # 10. Tabla RETURNS (Variaciones multi-horizonte precalculadas, 1 fila por ticker/timeframe)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS returns (
+                ticker VARCHAR,
+                timeframe VARCHAR,
+                timestamp TIMESTAMP,    -- Última vela usada
+                close DOUBLE,
+                chg_1d DOUBLE,          -- vs cierre de N sesiones atrás
+                chg_2d DOUBLE,
+                chg_3d DOUBLE,
+                chg_5d DOUBLE,
+                chg_1b DOUBLE,          -- vs N velas atrás (offsets intradía)
+                chg_4b DOUBLE,
+                chg_fri DOUBLE,         -- vs último viernes
+                chg_prev_fri DOUBLE,    -- vs viernes anterior
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (ticker, timeframe)
+            );
         """)
 
+        # 11. Tabla RELATIVE STRENGTH (Fuerza relativa y percentiles cross-sectional por vela)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS relative_strength (
+                ticker VARCHAR,
+                timeframe VARCHAR,
+                timestamp TIMESTAMP,
+                benchmark VARCHAR,      -- ^GSPC o ^MXX
+                ret_20 DOUBLE,          -- Retorno % en N velas
+                ret_60 DOUBLE,
+                rs_bench_20 DOUBLE,     -- ret - ret del benchmark (pp)
+                rs_bench_60 DOUBLE,
+                rs_sector_20 DOUBLE,    -- ret - mediana del sector (pp)
+                rs_sector_60 DOUBLE,
+                pct_ret_20 DOUBLE,      -- Percentil 0-100 en el universo
+                pct_ret_60 DOUBLE,
+                pct_rsi DOUBLE,
+                pct_adx DOUBLE,
+                pct_vol_k DOUBLE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (ticker, timeframe, timestamp)
+            );
+        """)
+
+        # 12. Tabla CORRELATION STATE (Sumas rolling + matriz de correlación del universo)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS correlation_state (
+                window_size INTEGER PRIMARY KEY,  -- Ventana en velas 1d
+                as_of TIMESTAMP,                  -- Última vela incluida
+                tickers VARCHAR,                  -- JSON: orden de filas/columnas
+                dates VARCHAR,                    -- JSON: fechas de la ventana de precios
+                prices BLOB,                      -- float64 (window+1 x N)
+                sum_r BLOB,                       -- float64 N      (Σ r)
+                sum_rr BLOB,                      -- float64 N x N  (Σ r rᵀ)
+                corr BLOB,                        -- float32 N x N
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # 13. Tabla CORRELATION CLUSTERS (Grupos de tickers correlacionados)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS correlation_clusters (
+                window_size INTEGER,
+                ticker VARCHAR,
+                cluster_id INTEGER,     -- 1 = grupo más grande
+                cluster_size INTEGER,
+                avg_corr DOUBLE,        -- Correlación promedio con el resto del grupo
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (window_size, ticker)
+            );
+        """)
+
+        # 14. Tabla PORTFOLIO EQUITY (Curva diaria del portafolio en MXN y USD)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS portfolio_equity (
+                date DATE PRIMARY KEY,
+                fx_rate DOUBLE,                          -- USDMXN vigente ese día
+                value_mxn DOUBLE, value_usd DOUBLE,      -- Valor de mercado de las posiciones
+                invested_mxn DOUBLE, invested_usd DOUBLE, -- Costo FIFO de lo que sigue abierto
+                unrealized_mxn DOUBLE, unrealized_usd DOUBLE,
+                realized_mxn DOUBLE, realized_usd DOUBLE, -- Acumulado (FX del día de la venta)
+                flow_mxn DOUBLE, flow_usd DOUBLE,        -- Aportes netos del día (compras - ventas)
+                twr_mxn DOUBLE, twr_usd DOUBLE,          -- Índice time-weighted (base 100)
+                drawdown_mxn DOUBLE, drawdown_usd DOUBLE, -- % desde el máximo del índice
+                tx_sig UBIGINT,                          -- Firma acumulada de transacciones hasta la fecha
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # 15. Tabla PORTFOLIO RISK (Métricas de riesgo por posición + fila '_PORTFOLIO_')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS portfolio_risk (
+                ticker VARCHAR PRIMARY KEY,
+                as_of DATE,             -- Última vela 1d usada
+                benchmark VARCHAR,
+                value_mxn DOUBLE,
+                weight DOUBLE,          -- % del valor del portafolio
+                vol_20 DOUBLE,          -- Volatilidad anualizada % (20 / 60 sesiones)
+                vol_60 DOUBLE,
+                beta DOUBLE,            -- vs benchmark (252 sesiones)
+                corr_bench DOUBLE,
+                var_95_mxn DOUBLE,      -- VaR histórico 1 día (pérdida en MXN, retornos convertidos con FX)
+                var_99_mxn DOUBLE,
+                es_95_mxn DOUBLE,       -- Expected Shortfall 95%
+                var_95_pct DOUBLE,
+                max_drawdown DOUBLE,    -- % dentro de la ventana
+                drawdown DOUBLE,        -- % actual desde el máximo
+                n_obs INTEGER,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # 16. Tabla FX RATES (Tipo de cambio diario por divisa, en MXN por unidad)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fx_rates (
+                currency VARCHAR,       -- 'USD', 'EUR', ... (la base MXN no se guarda: vale 1)
+                date DATE,
+                rate DOUBLE,            -- MXN por 1 unidad de currency (cierre 1d del par)
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (currency, date)
+            );
+        """)
+
+        # 17. Tabla OHLCV GAPS (Índice de huecos: sesiones esperadas sin vela, como rangos)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ohlcv_gaps (
+                ticker VARCHAR,
+                timeframe VARCHAR,
+                exchange VARCHAR,           -- Calendario inferido ('US', 'BMV', 'FX', ...)
+                gap_start TIMESTAMP,        -- Primera sesión faltante
+                gap_end TIMESTAMP,          -- Última sesión faltante (inclusive)
+                missing_bars INTEGER,
+                status VARCHAR,             -- 'open' | 'exhausted' | 'out_of_range'
+                attempts INTEGER DEFAULT 0, -- Backfills intentados sobre este rango
+                detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_attempt_at TIMESTAMP,
+                PRIMARY KEY (ticker, timeframe, gap_start)
+            );
+        """)
+
+        # 18. Tabla PRICE ADJUSTMENTS (Splits / dividendos detectados en el traslape y reescrituras de historia)
+        self.conn.execute("""
+            CREATE SEQUENCE IF NOT EXISTS adjustment_id_seq;
+            CREATE TABLE IF NOT EXISTS price_adjustments (
+                id INTEGER PRIMARY KEY DEFAULT nextval('adjustment_id_seq'),
+                ticker VARCHAR,
+                timeframe VARCHAR,
+                detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                ref_timestamp TIMESTAMP,    -- Vela del traslape comparada
+                factor DOUBLE,              -- Nuevo / guardado (0.25 = split 4:1)
+                kind VARCHAR,               -- 'split' | 'dividend'
+                bars_rewritten INTEGER,
+                status VARCHAR              -- 'rewritten' | 'failed'
+            );
+        """)
+
+        # 19. Tabla TICKER HEALTH (Fallas consecutivas de descarga y cuarentena con backoff exponencial)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ticker_health (
+                ticker VARCHAR,
+                timeframe VARCHAR,
+                status VARCHAR,                 -- 'ok' | 'failing' | 'quarantined'
+                consecutive_failures INTEGER DEFAULT 0,
+                total_failures INTEGER DEFAULT 0,
+                last_outcome VARCHAR,           -- 'ok' | 'empty' | 'error'
+                last_error VARCHAR,
+                last_success_at TIMESTAMP,
+                last_failure_at TIMESTAMP,
+                quarantined_until TIMESTAMP,    -- El sync salta el ticker mientras now() < quarantined_until
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (ticker, timeframe)
+            );
+        """)
+
+        # 20. Tabla FUNDAMENTALS (Snapshots fechados de fundamentales de cambio lento; ratios de precio se derivan al leer)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fundamentals (
+                ticker VARCHAR,
+                snapshot_date DATE,
+                -- Por acción / balance (TTL 30 días)
+                trailing_eps DOUBLE,
+                book_value DOUBLE,
+                shares_outstanding DOUBLE,
+                dividend_rate DOUBLE,
+                payout_ratio DOUBLE,        -- Fracción (0.25 = 25%)
+                profit_margin DOUBLE,       -- Fracción
+                roe DOUBLE,                 -- Fracción
+                ebitda DOUBLE,
+                free_cashflow DOUBLE,
+                total_debt DOUBLE,
+                total_cash DOUBLE,
+                beta DOUBLE,
+                financial_currency VARCHAR, -- Divisa de los estados financieros (TTL 90)
+                quote_currency VARCHAR,     -- Divisa de cotización (TTL 90)
+                -- Estimados / analistas (TTL 7 días)
+                forward_eps DOUBLE,
+                recommendation_key VARCHAR,
+                analyst_rating VARCHAR,
+                -- ETFs / fondos
+                aum DOUBLE,                 -- TTL 7
+                expense_ratio DOUBLE,       -- Fracción, TTL 90
+                fund_category VARCHAR,      -- TTL 90
+                fund_yield DOUBLE,          -- Fracción, TTL 30
+                ret_3y DOUBLE,
+                ret_5y DOUBLE,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (ticker, snapshot_date)
+            );
+        """)
+
+        # 21. Tabla STORAGE STATS (Tamaño del archivo y filas por tabla/timeframe en cada mantenimiento)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS storage_stats (
+                measured_at TIMESTAMP,
+                table_name VARCHAR,         -- 'database' = totales del archivo
+                timeframe VARCHAR,          -- '*' en la fila 'database'
+                row_count BIGINT,
+                file_bytes BIGINT,          -- Solo fila 'database'
+                wal_bytes BIGINT,
+                used_bytes BIGINT,
+                free_bytes BIGINT,          -- Bloques libres (se reutilizan; el archivo no se encoge)
+                PRIMARY KEY (measured_at, table_name, timeframe)
+            );
+        """)
+
+        # 22. Tabla APPLIED COMMANDS (Comandos del log de escrituras ya aplicados: evita aplicarlos dos veces)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS applied_commands (
+                command_id BIGINT PRIMARY KEY,  -- id en data/commands.sqlite
+                kind VARCHAR,
+                result VARCHAR,                 -- JSON devuelto por el handler
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # 23. Tabla QUERY PROFILES (Statements lentos con su sitio de llamada y EXPLAIN ANALYZE)
+        self.conn.execute("""
+            CREATE SEQUENCE IF NOT EXISTS query_profile_id_seq;
+            CREATE TABLE IF NOT EXISTS query_profiles (
+                id INTEGER PRIMARY KEY DEFAULT nextval('query_profile_id_seq'),
+                captured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                call_site VARCHAR,          -- 'screener.py:_screen:145 < api.py:get_screener:530'
+                sql_hash VARCHAR,
+                elapsed_ms DOUBLE,          -- execute + primer fetch
+                occurrences INTEGER,        -- Ejecuciones lentas del mismo sitio/query desde el perfil anterior
+                process VARCHAR,            -- Script del proceso (uvicorn, broad_scan.py...)
+                query VARCHAR,
+                params VARCHAR,             -- JSON
+                profile VARCHAR             -- Salida de EXPLAIN ANALYZE (NULL si el statement escribe)
+            );
+        """)
+
+    def _table_exists(self, name: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM duckdb_tables() WHERE database_name = current_database() AND table_name = ?", [name]
+        ).fetchone() is not None
+
+    def _ensure_view(self, name: str, body: str):
+        """
+        CREATE OR REPLACE VIEW solo si la definición cambió: reemplazarla en cada apertura ensucia el archivo
+        aunque sea idéntica. Se compara contra una vista TEMP (en memoria) con el SQL ya normalizado por DuckDB.
+        """
+        self.conn.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS {body}")
+        try:
+            defs = dict(self.conn.execute(
+                f"SELECT temporary, replace(sql, 'CREATE TEMP VIEW', 'CREATE VIEW') FROM duckdb_views() WHERE view_name = '{name}'"
+            ).fetchall())
+        finally:
+            self.conn.execute(f"DROP VIEW temp.main.{name}")
+        if defs.get(False) != defs.get(True):
+            self.conn.execute(f"CREATE OR REPLACE VIEW {name} AS {body}")
+
+    def _backfill_fx_rates(self):
+        """
+        Migración: materializa fx_rates para las divisas que no tienen ninguna tasa pero cuyo par ya tiene
+        velas 1d (bases anteriores a fx_rates, o restauradas sin que el Collector haya corrido desde entonces).
+        """
+        from svc_v2.fx import FxService, pair_ticker  # fx importa este módulo
+
+        fx = FxService(self)
+        present = {r[0] for r in self.conn.execute("SELECT DISTINCT currency FROM fx_rates").fetchall()}
+        missing = [c for c in fx.required_currencies() if c not in present]
+        if not missing:
+            return
+        pairs = ",".join([f"'{pair_ticker(c)}'" for c in missing])
+        if self.conn.execute(f"SELECT 1 FROM ohlcv WHERE timeframe = '1d' AND ticker IN ({pairs}) LIMIT 1").fetchone():
+            logging.info(f"💱 fx_rates sin {missing}: backfill desde velas 1d")
+            fx.refresh()
+
     # --------------------------------------------------------------------------
     # WRITE OPERATIONS (Upserts)
     # --------------------------------------------------------------------------
@@ -235,20 +575,21 @@ class Database:
             logging.error(f"DB Error reading dynamic watchlist: {e}")
             return []
 
-    def upsert_metadata(self, ticker: str, next_earnings: pd.Timestamp = None, sector: str = None, industry: str = None, name: str = None):
+    def upsert_metadata(self, ticker: str, next_earnings: pd.Timestamp = None, sector: str = None, industry: str = None, name: str = None, currency: str = None):
         """Guarda metadatos del ticker."""
         try:
             # Upsert inteligente: actualiza solo lo que no sea None
             self.conn.execute("""
-                INSERT INTO ticker_metadata (ticker, name, next_earnings, sector, industry, updated_at)
-                VALUES (?, ?, ?, ?, ?, now())
+                INSERT INTO ticker_metadata (ticker, name, next_earnings, sector, industry, currency, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, now())
                 ON CONFLICT (ticker) DO UPDATE SET
                     name = COALESCE(EXCLUDED.name, ticker_metadata.name),
                     next_earnings = COALESCE(EXCLUDED.next_earnings, ticker_metadata.next_earnings),
                     sector = COALESCE(EXCLUDED.sector, ticker_metadata.sector),
                     industry = COALESCE(EXCLUDED.industry, ticker_metadata.industry),
+                    currency = COALESCE(EXCLUDED.currency, ticker_metadata.currency),
                     updated_at = now();
-            """, [ticker, name, next_earnings, sector, industry])
+            """, [ticker, name, next_earnings, sector, industry, currency.upper() if currency else None])
         except Exception as e:
             logging.error(f"DB Error upserting metadata {ticker}: {e}")
 
@@ -306,6 +647,65 @@ class Database:
             logging.error(f"DB Error upserting OHLCV: {e}")
             raise
 
+    def replace_ohlcv_history(self, ticker: str, timeframe: str, df: pd.DataFrame,
+                              factor: Optional[float] = None, rescale_volume: bool = False) -> int:
+        """
+        Reescribe la historia de un ticker/timeframe (tras un split o dividendo retroactivo).
+        En una transacción: invalida sus indicadores, sobreescribe las velas re-descargadas y re-escala por
+        `factor` las guardadas más viejas que la re-descarga (Yahoo solo devuelve ~60 días de 15m: sin esto
+        se perdería el resto de la retención). El volumen se divide por el factor solo en splits.
+        Después borra las velas dentro del rango re-descargado que el proveedor ya no devuelve (DuckDB no
+        permite borrar filas referenciadas en la misma transacción). Sin `factor`, las más viejas se borran.
+        """
+        if df.empty:
+            return 0
+        first = pd.Timestamp(df['date'].min())
+
+        self.conn.execute("BEGIN TRANSACTION")
+        try:
+            self.conn.execute("DELETE FROM indicators WHERE ticker = ? AND timeframe = ?", [ticker, timeframe])
+            if factor:
+                volume = f"volume = volume / {float(factor)}," if rescale_volume else ""
+                rescaled = self.conn.execute(f"""
+                    UPDATE ohlcv
+                    SET open = open * ?, high = high * ?, low = low * ?, close = close * ?, {volume}
+                        updated_at = now()
+                    WHERE ticker = ? AND timeframe = ? AND timestamp < ?
+                """, [factor] * 4 + [ticker, timeframe, first]).fetchone()[0]
+                if rescaled:
+                    logging.info(f"            ↕️ {ticker} [{timeframe}]: {rescaled} velas previas a {first} re-escaladas x{factor:.6f}")
+            self.upsert_ohlcv(df, timeframe)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self.conn.register('temp_history_df', df[['date']])
+        try:
+            older = "" if not factor else "AND timestamp >= ?"
+            params = [ticker, timeframe] + ([first] if factor else [])
+            dropped = self.conn.execute(f"""
+                DELETE FROM ohlcv
+                WHERE ticker = ? AND timeframe = ?
+                  AND timestamp NOT IN (SELECT date FROM temp_history_df)
+                  {older}
+            """, params).fetchone()[0]
+        finally:
+            self.conn.unregister('temp_history_df')
+        if dropped:
+            logging.warning(f"            🗑️ {ticker} [{timeframe}]: {dropped} velas guardadas que la re-descarga no trae fueron borradas")
+        return len(df)
+
+    def log_adjustment(self, ticker: str, timeframe: str, ref_timestamp, factor: float, kind: str, bars_rewritten: int, status: str):
+        """Registra un ajuste retroactivo detectado por el Collector."""
+        try:
+            self.conn.execute("""
+                INSERT INTO price_adjustments (ticker, timeframe, ref_timestamp, factor, kind, bars_rewritten, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [ticker, timeframe, ref_timestamp, factor, kind, bars_rewritten, status])
+        except Exception as e:
+            logging.error(f"DB Error logging adjustment {ticker}: {e}")
+
     # --------------------------------------------------------------------------
     # READ OPERATIONS
     # --------------------------------------------------------------------------
@@ -344,6 +744,75 @@ class Database:
         
         return self.conn.execute(query).df()
 
+    def stream_candles(self, tickers: List[str], timeframe: str, start: str = None, end: str = None,
+                       last_n: int = None, batch_rows: int = STREAM_BATCH_ROWS) -> pa.RecordBatchReader:
+        """
+        Velas de muchos tickers en una sola consulta, como record batches de Arrow (ticker + CANDLE_COLUMNS)
+        ordenados por ticker y timestamp. Corre en un cursor propio: el caller puede seguir escribiendo
+        en self.conn mientras consume el lector.
+        :param last_n: Solo las últimas N velas de cada ticker (mismo criterio que get_candles(limit=N)).
+        """
+        conds = [f"timeframe = '{timeframe}'"]
+        if tickers:
+            in_list = ",".join([f"'{t}'" for t in tickers])
+            conds.append(f"ticker IN ({in_list})")
+        if start:
+            conds.append(f"timestamp >= TIMESTAMP '{start}'")
+        if end:
+            conds.append(f"timestamp <= TIMESTAMP '{end}'")
+        window = f"QUALIFY row_number() OVER (PARTITION BY ticker ORDER BY timestamp DESC) <= {int(last_n)}" if last_n else ""
+
+        query = f"""
+            SELECT ticker, {', '.join(CANDLE_COLUMNS)}
+            FROM ohlcv
+            WHERE {' AND '.join(conds)}
+            {window}
+            ORDER BY ticker, timestamp
+        """
+        return self.conn.cursor().execute(query).fetch_record_batch(batch_rows)
+
+    def iter_candle_tables(self, tickers: List[str], timeframe: str, start: str = None, end: str = None,
+                           last_n: int = None, batch_rows: int = STREAM_BATCH_ROWS) -> Iterator[Tuple[str, pa.Table]]:
+        """
+        Recorre stream_candles agrupado por ticker: (ticker, tabla Arrow con CANDLE_COLUMNS) con la historia
+        del ticker en el rango. En memoria solo vive el ticker en curso y el batch que se está leyendo.
+        """
+        ticker, chunks = None, []
+        for batch in self.stream_candles(tickers, timeframe, start, end, last_n, batch_rows):
+            names = batch.column(0).to_numpy(zero_copy_only=False)
+            # Inicio de cada tramo del mismo ticker dentro del batch (el lector viene ordenado por ticker)
+            cuts = [0, *(np.flatnonzero(names[1:] != names[:-1]) + 1), len(names)]
+            for lo, hi in zip(cuts[:-1], cuts[1:]):
+                if names[lo] != ticker:
+                    if chunks:
+                        yield ticker, pa.Table.from_batches(chunks).select(CANDLE_COLUMNS)
+                    ticker, chunks = names[lo], []
+                chunks.append(batch.slice(lo, hi - lo))
+        if chunks:
+            yield ticker, pa.Table.from_batches(chunks).select(CANDLE_COLUMNS)
+
+    def iter_candle_arrays(self, tickers: List[str], timeframe: str, start: str = None, end: str = None,
+                           last_n: int = None, batch_rows: int = STREAM_BATCH_ROWS) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """Igual que iter_candle_tables pero con una columna NumPy por campo (NULL -> NaN en los DOUBLE)."""
+        for ticker, table in self.iter_candle_tables(tickers, timeframe, start, end, last_n, batch_rows):
+            yield ticker, {c: table.column(c).to_numpy() for c in CANDLE_COLUMNS}
+
+    def record_query_profile(self, payload: Dict[str, Any]):
+        """
+        Guarda el perfil de una query lenta. Con conexión de escritura, directo (cursor aparte, fuera de la
+        transacción del caller); en solo lectura (API sobre snapshots) se encola en el log de comandos y
+        lo escribe el daemon.
+        """
+        if not self.read_only:
+            save_query_profile(self.conn.cursor(), payload)
+            return
+        from svc_v2.commands import CommandLog
+        from svc_v2.snapshots import SNAPSHOT_DIRNAME
+        # El log vive junto a la DB principal (un snapshot está en {data}/snapshots/)
+        in_snapshot = self.db_path.parent.name == SNAPSHOT_DIRNAME
+        data_dir = self.db_path.parent.parent if in_snapshot else self.db_path.parent
+        CommandLog(data_dir / self.db_path.name).enqueue("record_query_profile", payload)
+
     def close(self):
         self.conn.close()
 
@@ -0,0 +1,340 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Tuple
+import numpy as np
+import pandas as pd
+from svc_v2.db import Database
+from svc_v2.relative_strength import BENCHMARK_US, BENCHMARK_MX
+from svc_v2.fx import FxService, fx_join_sql, fx_rate_sql, pair_ticker
+
+# Días ya materializados que se revalúan en cada corrida (último cierre provisional / velas tardías)
+PRICE_REVISION_DAYS = 5
+
+# Firma de una transacción: cualquier alta, baja o edición cambia el XOR acumulado desde su fecha
+TX_SIG_EXPR = "hash(id, ticker, side, qty, price, fees, currency, timestamp)"
+
+EQUITY_COLUMNS = [
+    "fx_rate",
+    "value_mxn", "value_usd",
+    "invested_mxn", "invested_usd",
+    "unrealized_mxn", "unrealized_usd",
+    "realized_mxn", "realized_usd",
+    "flow_mxn", "flow_usd",
+    "twr_mxn", "twr_usd",
+    "drawdown_mxn", "drawdown_usd",
+]
+
+class EquityCurveEngine:
+    """
+    Mantiene `portfolio_equity`: curva diaria del portafolio (valor, capital invertido,
+    P&L no realizado / realizado, índice time-weighted y drawdown) en MXN y USD.
+
+    - Posiciones y costo: replay FIFO de `portfolio_transactions` (barato, son pocas filas).
+    - Valuación: SQL set-based (ASOF de posiciones, cierres 1d y fx_rates por fecha).
+    - Incremental: solo se reescribe desde la primera fecha cuya firma de transacciones
+      cambió (altas retroactivas, bajas, ediciones) o los últimos PRICE_REVISION_DAYS.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def refresh(self, force_full: bool = False) -> int:
+        """Extiende / recalcula la curva. Devuelve filas escritas."""
+        t_start = time.time()
+        positions, events = self._replay()
+
+        if positions.empty:
+            self.db.conn.execute("DELETE FROM portfolio_equity")
+            return 0
+
+        start = None if force_full else self._dirty_from()
+
+        curve = self._value(positions, events, start)
+        if curve.empty:
+            return 0
+        curve = self._chain(curve, start)
+
+        self.db.conn.register("equity_new", curve)
+        self.db.conn.execute("BEGIN TRANSACTION")
+        try:
+            if start is None:
+                self.db.conn.execute("DELETE FROM portfolio_equity")
+            else:
+                self.db.conn.execute(f"DELETE FROM portfolio_equity WHERE date >= DATE '{start}'")
+            self.db.conn.execute(f"""
+                INSERT INTO portfolio_equity (date, {', '.join(EQUITY_COLUMNS)}, tx_sig, updated_at)
+                SELECT date, {', '.join(EQUITY_COLUMNS)}, tx_sig, now() FROM equity_new
+            """)
+            self.db.conn.execute("COMMIT")
+        except Exception:
+            self.db.conn.execute("ROLLBACK")
+            raise
+        finally:
+            self.db.conn.unregister("equity_new")
+
+        since = "inicio" if start is None else str(start)
+        logging.info(f"💰 Equity Curve: {len(curve)} días desde {since} ({time.time() - t_start:.2f}s)")
+        return len(curve)
+
+    # --------------------------------------------------------------------------
+    # Detección de cambios
+    # --------------------------------------------------------------------------
+
+    def _dirty_from(self):
+        """
+        Primera fecha a reescribir. None = reconstrucción completa.
+        Compara la firma acumulada guardada en cada fila contra la actual de portfolio_transactions.
+        """
+        bounds = self.db.conn.execute("SELECT MIN(date), MAX(date) FROM portfolio_equity").fetchone()
+        if not bounds or bounds[0] is None:
+            return None
+
+        mismatch = self.db.conn.execute(f"""
+            WITH tx AS (
+                SELECT timestamp::DATE AS d, bit_xor({TX_SIG_EXPR}) AS sig
+                FROM portfolio_transactions
+                GROUP BY d
+            ),
+            cum AS (
+                SELECT d, bit_xor(sig) OVER (ORDER BY d) AS sig FROM tx
+            )
+            SELECT MIN(e.date)
+            FROM portfolio_equity e
+            ASOF LEFT JOIN cum c ON e.date >= c.d
+            WHERE COALESCE(c.sig, 0) <> e.tx_sig
+        """).fetchone()[0]
+
+        # Cambio en el primer día (p.ej. compra anterior a toda la curva): la malla arranca antes
+        if mismatch == bounds[0]:
+            return None
+        revision = bounds[1] - timedelta(days=PRICE_REVISION_DAYS)
+        if mismatch is not None and mismatch < revision:
+            logging.info(f"💰 Equity Curve: transacciones cambiadas desde {mismatch}, recalculando desde ahí")
+            return mismatch
+        return revision
+
+    # --------------------------------------------------------------------------
+    # Replay FIFO
+    # --------------------------------------------------------------------------
+
+    def _replay(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Recorre las transacciones en orden y devuelve, en la divisa de cotización de cada ticker:
+        - positions: (ticker, currency, date, qty, cost) estado al cierre de cada fecha con movimiento.
+        - events: (date, currency, flow_in, flow_out, realized) flujos de capital y P&L realizado.
+        Mismo FIFO y reparto de comisiones que /api/v2/portfolio/performance. Precio y comisión
+        capturados en otra divisa (p.ej. NVDA comprada en MXN vía SIC) se convierten al FX de ese día.
+        """
+        tx_df = self.db.conn.execute("""
+            SELECT ticker, side, qty, price, COALESCE(fees, 0) AS fees, UPPER(currency) AS currency, timestamp
+            FROM portfolio_transactions
+            WHERE side IN ('BUY', 'SELL')
+            ORDER BY timestamp ASC, id ASC
+        """).df()
+
+        fx = FxService(self.db)
+        tx_df["quote"] = tx_df["ticker"].map(fx.currencies(tx_df["ticker"]))
+        tx_df["currency"] = tx_df["currency"].fillna(tx_df["quote"])
+        tx_df = fx.convert(tx_df, ["price", "fees"], date_col="timestamp", to_col="quote")
+
+        inventory = {}
+        positions = {}
+        events = []
+
+        for ticker, side, q, p, f, ts, ccy in tx_df[["ticker", "side", "qty", "price", "fees", "timestamp", "quote"]].itertuples(index=False):
+            lots = inventory.setdefault(ticker, [])
+            d = ts.date()
+            q, p, f = float(q), float(p), float(f)
+
+            if side == "BUY":
+                lots.append([q, p, f])
+                events.append((d, ccy, q * p + f, 0.0, 0.0))
+            else:
+                qty_to_sell = q
+                realized = 0.0
+                while qty_to_sell > 0 and lots:
+                    lot = lots[0]
+                    match_qty = min(lot[0], qty_to_sell)
+                    buy_fees_share = (lot[2] / lot[0]) * match_qty if lot[0] > 0 else 0
+                    sell_fees_share = (f / q) * match_qty if q > 0 else 0
+                    realized += match_qty * (p - lot[1]) - buy_fees_share - sell_fees_share
+
+                    lot[2] -= buy_fees_share
+                    lot[0] -= match_qty
+                    qty_to_sell -= match_qty
+                    if lot[0] <= 0.00001:
+                        lots.pop(0)
+                # Solo sale capital por lo que se pudo casar contra lotes abiertos
+                matched = q - qty_to_sell
+                proceeds = matched * p - (f * matched / q if q > 0 else 0)
+                events.append((d, ccy, 0.0, proceeds, realized))
+
+            positions[(ticker, d)] = (
+                ticker, ccy, d,
+                sum(l[0] for l in lots),
+                sum(l[0] * l[1] for l in lots),
+            )
+
+        pos_df = pd.DataFrame(list(positions.values()), columns=["ticker", "currency", "date", "qty", "cost"])
+        ev_df = pd.DataFrame(events, columns=["date", "currency", "flow_in", "flow_out", "realized"])
+        return pos_df, ev_df
+
+    # --------------------------------------------------------------------------
+    # Valuación diaria (SQL)
+    # --------------------------------------------------------------------------
+
+    def _value(self, positions: pd.DataFrame, events: pd.DataFrame, start) -> pd.DataFrame:
+        """Una fila por día de mercado desde `start`: valor/costo por divisa, flujos y realizado del día."""
+        held = ",".join([f"'{t}'" for t in positions["ticker"].unique()])
+        grid_tickers = f"{held}, '{BENCHMARK_US}', '{BENCHMARK_MX}', '{pair_ticker('USD')}'"
+        first_tx = positions["date"].min()
+        start_cond = f"WHERE date >= DATE '{start}'" if start is not None else ""
+
+        self.db.conn.register("positions_df", positions)
+        self.db.conn.register("events_df", events)
+        try:
+            return self.db.conn.execute(f"""
+                WITH grid_all AS (
+                    SELECT DISTINCT timestamp::DATE AS date
+                    FROM ohlcv
+                    WHERE timeframe = '1d' AND ticker IN ({grid_tickers})
+                      AND timestamp::DATE >= DATE '{first_tx}'
+                ),
+                grid AS (
+                    SELECT date FROM grid_all {start_cond}
+                ),
+                px AS (
+                    SELECT ticker, timestamp::DATE AS date, close
+                    FROM ohlcv WHERE timeframe = '1d' AND ticker IN ({held})
+                ),
+                book AS (
+                    SELECT g.date, t.ticker, t.currency
+                    FROM grid g
+                    CROSS JOIN (SELECT DISTINCT ticker, currency FROM positions_df) t
+                ),
+                held AS (
+                    SELECT b.date, b.ticker, b.currency, p.qty, p.cost
+                    FROM book b
+                    ASOF JOIN positions_df p ON b.ticker = p.ticker AND b.date >= p.date
+                ),
+                priced AS (
+                    -- Sin cierre disponible se valúa a costo (igual que get_portfolio)
+                    SELECT h.date, h.currency, h.cost,
+                           h.qty * COALESCE(x.close, h.cost / NULLIF(h.qty, 0), 0) AS value
+                    FROM held h
+                    ASOF LEFT JOIN px x ON h.ticker = x.ticker AND h.date >= x.date
+                ),
+                valued AS (
+                    -- Posiciones a MXN con la tasa de su divisa vigente ese día
+                    SELECT p.date,
+                           SUM(p.value * {fx_rate_sql('r', 'p.currency')}) AS value_mxn,
+                           SUM(p.cost * {fx_rate_sql('r', 'p.currency')}) AS invested_mxn
+                    FROM priced p
+                    {fx_join_sql('r', 'p.currency', 'p.date')}
+                    GROUP BY p.date
+                ),
+                ev AS (
+                    -- Flujos y realizado se convierten al FX del día de la operación
+                    SELECT e.date,
+                           e.flow_in * {fx_rate_sql('r', 'e.currency')} AS in_mxn,
+                           e.flow_out * {fx_rate_sql('r', 'e.currency')} AS out_mxn,
+                           e.realized * {fx_rate_sql('r', 'e.currency')} AS realized_mxn,
+                           u.rate AS usd_rate
+                    FROM events_df e
+                    {fx_join_sql('r', 'e.currency', 'e.date')}
+                    {fx_join_sql('u', "'USD'", 'e.date')}
+                ),
+                flows AS (
+                    -- Operaciones en días sin mercado caen en el siguiente día de la malla
+                    -- (contra la malla completa: las anteriores a `start` ya están guardadas)
+                    SELECT g.date,
+                           SUM(e.in_mxn) AS in_mxn,
+                           SUM(e.out_mxn) AS out_mxn,
+                           SUM(e.in_mxn / e.usd_rate) AS in_usd,
+                           SUM(e.out_mxn / e.usd_rate) AS out_usd,
+                           SUM(e.realized_mxn) AS realized_mxn,
+                           SUM(e.realized_mxn / e.usd_rate) AS realized_usd
+                    FROM ev e
+                    ASOF JOIN grid_all g ON e.date <= g.date
+                    GROUP BY g.date
+                ),
+                tx_sig AS (
+                    SELECT d, bit_xor(sig) OVER (ORDER BY d) AS sig
+                    FROM (
+                        SELECT timestamp::DATE AS d, bit_xor({TX_SIG_EXPR}) AS sig
+                        FROM portfolio_transactions
+                        GROUP BY d
+                    )
+                ),
+                daily AS (
+                    SELECT g.date, u.rate AS fx_rate,
+                           COALESCE(v.value_mxn, 0) AS value_mxn,
+                           COALESCE(v.invested_mxn, 0) AS invested_mxn,
+                           COALESCE(fl.in_mxn, 0) AS in_mxn, COALESCE(fl.out_mxn, 0) AS out_mxn,
+                           COALESCE(fl.in_usd, 0) AS in_usd, COALESCE(fl.out_usd, 0) AS out_usd,
+                           COALESCE(fl.realized_mxn, 0) AS day_realized_mxn,
+                           COALESCE(fl.realized_usd, 0) AS day_realized_usd
+                    FROM grid g
+                    LEFT JOIN valued v ON g.date = v.date
+                    LEFT JOIN flows fl ON g.date = fl.date
+                    {fx_join_sql('u', "'USD'", 'g.date')}
+                )
+                SELECT d.date, d.fx_rate,
+                       d.value_mxn, d.value_mxn / d.fx_rate AS value_usd,
+                       d.invested_mxn, d.invested_mxn / d.fx_rate AS invested_usd,
+                       d.in_mxn, d.out_mxn, d.in_usd, d.out_usd,
+                       d.day_realized_mxn, d.day_realized_usd,
+                       COALESCE(s.sig, 0) AS tx_sig
+                FROM daily d
+                ASOF LEFT JOIN tx_sig s ON d.date >= s.d
+                ORDER BY d.date
+            """).df()
+        finally:
+            self.db.conn.unregister("positions_df")
+            self.db.conn.unregister("events_df")
+
+    def _chain(self, curve: pd.DataFrame, start) -> pd.DataFrame:
+        """
+        Columnas encadenadas día a día (realizado acumulado, índice TWR, drawdown),
+        continuando desde la última fila guardada antes de `start`.
+        """
+        prev = None
+        if start is not None:
+            prev = self.db.conn.execute(f"""
+                SELECT realized_mxn, realized_usd, value_mxn, value_usd, twr_mxn, twr_usd,
+                       (SELECT MAX(twr_mxn) FROM portfolio_equity WHERE date < DATE '{start}'),
+                       (SELECT MAX(twr_usd) FROM portfolio_equity WHERE date < DATE '{start}')
+                FROM portfolio_equity
+                WHERE date < DATE '{start}'
+                ORDER BY date DESC LIMIT 1
+            """).fetchone()
+
+        for ccy, i in (("mxn", 0), ("usd", 1)):
+            defaults = (0.0, 0.0, 100.0, 100.0)
+            stored = (None,) * 4 if prev is None else (prev[i], prev[2 + i], prev[4 + i], prev[6 + i])
+            # NULL guardado (p.ej. días sin tipo de cambio) -> se reinicia desde el default
+            realized0, value0, twr0, peak0 = [d if v is None else v for v, d in zip(stored, defaults)]
+            value = curve[f"value_{ccy}"].to_numpy(dtype=float)
+            f_in = curve[f"in_{ccy}"].to_numpy(dtype=float)
+            f_out = curve[f"out_{ccy}"].to_numpy(dtype=float)
+            value_prev = np.concatenate([[value0], value[:-1]])
+
+            # Retorno diario time-weighted: compras al inicio del día, ventas al cierre
+            base = value_prev + f_in
+            ret = np.divide(value + f_out - base, base, out=np.zeros_like(base), where=base > 1e-9)
+
+            twr = twr0 * np.cumprod(1 + ret)
+            peak = np.maximum.accumulate(np.maximum(twr, peak0))
+
+            curve[f"realized_{ccy}"] = realized0 + curve[f"day_realized_{ccy}"].cumsum()
+            curve[f"unrealized_{ccy}"] = curve[f"value_{ccy}"] - curve[f"invested_{ccy}"]
+            curve[f"flow_{ccy}"] = curve[f"in_{ccy}"] - curve[f"out_{ccy}"]
+            curve[f"twr_{ccy}"] = twr
+            curve[f"drawdown_{ccy}"] = (twr / peak - 1) * 100
+        return curve
+
+if __name__ == "__main__":
+    db = Database()
+    n = EquityCurveEngine(db).refresh()
+    print(f"Equity curve: {n} días escritos")
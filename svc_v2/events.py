@@ -0,0 +1,52 @@
+import json
+import logging
+from typing import List, Optional
+from svc_v2.db import Database
+
+# Tipos de evento (bus de cambios Daemon/API -> SSE)
+JOB_FINISHED = "job_finished"   # {job, timeframes}
+SIGNAL = "signal"               # {strategy, timeframe, tickers}
+TRANSACTION = "transaction"     # {action, ticker, id}
+ADJUSTMENT = "adjustment"       # {ticker, timeframe, kind, factor, status}
+
+# Retención del bus: los eventos solo sirven para notificar, no son auditoría
+EVENTS_RETENTION_DAYS = 7
+
+def publish_event(db: Database, kind: str, payload: Optional[dict] = None):
+    """Registra un evento en system_events. Nunca rompe al caller (best effort)."""
+    try:
+        db.conn.execute(
+            "INSERT INTO system_events (kind, payload) VALUES (?, ?)",
+            [kind, json.dumps(payload or {}, default=str)]
+        )
+        if kind == JOB_FINISHED:
+            db.conn.execute(f"DELETE FROM system_events WHERE timestamp < now() - INTERVAL {EVENTS_RETENTION_DAYS} DAY")
+    except Exception as e:
+        logging.error(f"Error publicando evento {kind}: {e}")
+
+def fetch_events(db: Database, after_id: int = 0, limit: int = 500) -> List[dict]:
+    """Eventos con id > after_id en orden de llegada."""
+    try:
+        rows = db.conn.execute("""
+            SELECT id, timestamp, kind, payload
+            FROM system_events
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+        """, [after_id, limit]).fetchall()
+    except Exception as e:
+        logging.error(f"Error leyendo eventos: {e}")
+        return []
+
+    return [
+        {"id": r[0], "timestamp": str(r[1]), "kind": r[2], "payload": json.loads(r[3] or "{}")}
+        for r in rows
+    ]
+
+def last_event_id(db: Database) -> int:
+    """Último id publicado (0 si el bus está vacío o no existe la tabla)."""
+    try:
+        res = db.conn.execute("SELECT MAX(id) FROM system_events").fetchone()
+        return int(res[0]) if res and res[0] is not None else 0
+    except Exception:
+        return 0
@@ -0,0 +1,159 @@
+import logging
+from datetime import date
+from typing import Any, Dict, List
+import pandas as pd
+from svc_v2.db import Database
+
+# Fundamentales guardados por snapshot: (columna, clave en `info` de Yahoo, tipo SQL, TTL en días).
+# Solo se guardan insumos de cambio lento; los ratios que dependen del precio (PE, P/B, yield, market cap,
+# EV/EBITDA) se derivan al momento del screen contra el cierre de la vela (ver FUNDAMENTAL_FIELDS).
+FUNDAMENTAL_SOURCES = [
+    # Por acción / balance (cambian con cada reporte trimestral)
+    ("trailing_eps", "trailingEps", "DOUBLE", 30),
+    ("book_value", "bookValue", "DOUBLE", 30),
+    ("shares_outstanding", "sharesOutstanding", "DOUBLE", 30),
+    ("dividend_rate", "dividendRate", "DOUBLE", 30),
+    ("payout_ratio", "payoutRatio", "DOUBLE", 30),
+    ("profit_margin", "profitMargins", "DOUBLE", 30),
+    ("roe", "returnOnEquity", "DOUBLE", 30),
+    ("ebitda", "ebitda", "DOUBLE", 30),
+    ("free_cashflow", "freeCashflow", "DOUBLE", 30),
+    ("total_debt", "totalDebt", "DOUBLE", 30),
+    ("total_cash", "totalCash", "DOUBLE", 30),
+    ("beta", "beta", "DOUBLE", 30),
+    ("financial_currency", "financialCurrency", "VARCHAR", 90),
+    ("quote_currency", "currency", "VARCHAR", 90),
+    # Estimados / analistas (se mueven entre reportes)
+    ("forward_eps", "forwardEps", "DOUBLE", 7),
+    ("recommendation_key", "recommendationKey", "VARCHAR", 7),
+    ("analyst_rating", "averageAnalystRating", "VARCHAR", 7),
+    # ETFs / fondos
+    ("aum", "totalAssets", "DOUBLE", 7),
+    ("expense_ratio", "annualReportExpenseRatio", "DOUBLE", 90),
+    ("fund_category", "category", "VARCHAR", 90),
+    ("fund_yield", "yield", "DOUBLE", 30),
+    ("ret_3y", "threeYearAverageReturn", "DOUBLE", 30),
+    ("ret_5y", "fiveYearAverageReturn", "DOUBLE", 30),
+]
+
+FUNDAMENTAL_COLUMNS = [c for c, _, _, _ in FUNDAMENTAL_SOURCES]
+FIELD_TTL_DAYS = {c: ttl for c, _, _, ttl in FUNDAMENTAL_SOURCES}
+
+# Un snapshot se refresca completo (una sola llamada a Yahoo) aunque venza un solo campo; ninguno pasa de esto
+MAX_TTL_DAYS = 90
+
+# Al leer, un campo más viejo que TTL x este factor se considera vencido (NULL): si el job deja de correr
+# los screens no filtran con datos de hace meses
+READ_TTL_FACTOR = 3
+
+# Columnas que ve el Screener / Backtester (mismos nombres en estrategias y API)
+FUNDAMENTAL_FIELDS = [
+    "market_cap", "pe", "forward_pe", "price_to_book", "ev_to_ebitda", "dividend_yield",
+    "payout_ratio", "profit_margin", "roe", "beta", "free_cashflow",
+    "aum", "expense_ratio", "fund_yield", "recommendation_key", "analyst_rating",
+]
+
+def fundamentals_select(f: str = "f", close: str = "close", ref_date: str = "current_date") -> str:
+    """
+    Expresiones SQL de FUNDAMENTAL_FIELDS a partir del snapshot `f` (alias de la tabla fundamentals),
+    el cierre de la vela y la fecha de referencia (TTL de lectura por campo).
+    Ratios de balance (P/B, EV/EBITDA) solo si el reporte está en la misma divisa de cotización (ADRs).
+    """
+    def v(col: str) -> str:
+        ttl = FIELD_TTL_DAYS[col] * READ_TTL_FACTOR
+        return f"(CASE WHEN {ref_date}::DATE - {f}.snapshot_date <= {ttl} THEN {f}.{col} END)"
+
+    same_ccy = f"COALESCE({v('financial_currency')} = {v('quote_currency')}, FALSE)"
+    exprs = {
+        "market_cap": f"{close} * {v('shares_outstanding')}",
+        "pe": f"CASE WHEN {v('trailing_eps')} > 0 THEN {close} / {v('trailing_eps')} END",
+        "forward_pe": f"CASE WHEN {v('forward_eps')} > 0 THEN {close} / {v('forward_eps')} END",
+        "price_to_book": f"CASE WHEN {same_ccy} AND {v('book_value')} > 0 THEN {close} / {v('book_value')} END",
+        "ev_to_ebitda": (
+            f"CASE WHEN {same_ccy} AND {v('ebitda')} > 0 THEN "
+            f"({close} * {v('shares_outstanding')} + COALESCE({v('total_debt')}, 0) - COALESCE({v('total_cash')}, 0)) / {v('ebitda')} END"
+        ),
+        "dividend_yield": f"{v('dividend_rate')} / NULLIF({close}, 0) * 100",
+        "payout_ratio": f"{v('payout_ratio')} * 100",
+        "profit_margin": f"{v('profit_margin')} * 100",
+        "roe": f"{v('roe')} * 100",
+        "fund_yield": f"{v('fund_yield')} * 100",
+    }
+    return ",\n".join([f"{exprs[name] if name in exprs else v(name)} AS {name}" for name in FUNDAMENTAL_FIELDS])
+
+def latest_fundamentals_sql() -> str:
+    """Último snapshot por ticker."""
+    return """
+        SELECT * FROM fundamentals
+        QUALIFY row_number() OVER (PARTITION BY ticker ORDER BY snapshot_date DESC) = 1
+    """
+
+def fundamentals_from_info(ticker: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Ficha del proveedor -> fila tipada de fundamentals (como svc.collector.GetTickerInfo, sin ratios de precio)."""
+    info = payload.get("info") or {}
+    row: Dict[str, Any] = {"ticker": ticker}
+    for col, key, sql_type, _ in FUNDAMENTAL_SOURCES:
+        val = info.get(key)
+        if sql_type == "DOUBLE":
+            val = pd.to_numeric(val, errors="coerce")
+            row[col] = None if pd.isna(val) else float(val)
+        else:
+            row[col] = str(val).strip() if val not in (None, "") else None
+    # yfinance reciente reporta el expense ratio en 'netExpenseRatio' (en %, no fracción)
+    if row["expense_ratio"] is None and info.get("netExpenseRatio") is not None:
+        net = pd.to_numeric(info.get("netExpenseRatio"), errors="coerce")
+        row["expense_ratio"] = None if pd.isna(net) else float(net) / 100
+    return row
+
+class FundamentalsStore:
+    """
+    Snapshots fechados de fundamentales (tabla fundamentals, una fila por ticker y día).
+    Un ticker vence cuando algún campo con dato supera su TTL (o el snapshot supera MAX_TTL_DAYS); la
+    descarga la hace MetadataSync con la misma ficha de Yahoo que trae sector / earnings.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def due(self, tickers: List[str]) -> List[str]:
+        """Tickers sin snapshot o con algún campo vencido."""
+        if not tickers:
+            return []
+        in_list = ",".join([f"'{t}'" for t in tickers])
+        # TTL efectivo del snapshot: el menor entre los campos que sí traen dato (un ETF no vence por forward_eps)
+        ttl_expr = "LEAST(" + ", ".join(
+            [f"CASE WHEN {c} IS NOT NULL THEN {ttl} END" for c, _, _, ttl in FUNDAMENTAL_SOURCES] + [str(MAX_TTL_DAYS)]
+        ) + ")"
+        fresh = self.db.conn.execute(f"""
+            SELECT ticker FROM ({latest_fundamentals_sql()})
+            WHERE ticker IN ({in_list})
+              AND current_date - snapshot_date < {ttl_expr}
+        """).fetchall()
+        fresh = {r[0] for r in fresh}
+        return [t for t in tickers if t not in fresh]
+
+    def save(self, rows: List[Dict[str, Any]], snapshot_date: date = None):
+        """Snapshot del día (si ya existe uno de hoy para el ticker, se reemplaza)."""
+        if not rows:
+            return
+        df = pd.DataFrame(rows, columns=["ticker"] + FUNDAMENTAL_COLUMNS)
+        df["snapshot_date"] = pd.Timestamp(snapshot_date or date.today())
+        self.db.conn.register("fund_new", df)
+        try:
+            self.db.conn.execute(f"""
+                INSERT OR REPLACE INTO fundamentals (ticker, snapshot_date, {', '.join(FUNDAMENTAL_COLUMNS)}, fetched_at)
+                SELECT ticker, snapshot_date::DATE, {', '.join(FUNDAMENTAL_COLUMNS)}, now()
+                FROM fund_new
+            """)
+        finally:
+            self.db.conn.unregister("fund_new")
+        logging.info(f"      📊 Fundamentales: {len(df)} snapshots guardados")
+
+if __name__ == "__main__":
+    db = Database()
+    print(db.conn.execute(f"""
+        SELECT o.ticker, o.close, {fundamentals_select('f', 'o.close')}
+        FROM ({latest_fundamentals_sql()}) f
+        JOIN ohlcv o ON o.ticker = f.ticker AND o.timeframe = '1d'
+        QUALIFY row_number() OVER (PARTITION BY o.ticker ORDER BY o.timestamp DESC) = 1
+    """).df())
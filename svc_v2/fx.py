@@ -0,0 +1,216 @@
+import logging
+import time
+from typing import Iterable, List, Optional
+import pandas as pd
+from svc_v2.db import Database
+
+# Divisa de reporte: fx_rates guarda cuántos MXN vale 1 unidad de cada divisa
+BASE_CURRENCY = "MXN"
+
+# Divisas que siempre se mantienen aunque no haya transacciones en ellas
+DEFAULT_CURRENCIES = ["USD"]
+
+# Días ya materializados que se reescriben (último cierre provisional de Yahoo)
+REFRESH_OVERLAP_DAYS = 5
+
+# Divisa de cotización por sufijo / símbolo cuando ticker_metadata.currency está vacío
+SUFFIX_CURRENCY = {".MX": "MXN"}
+SYMBOL_CURRENCY = {"^MXX": "MXN"}
+
+def pair_ticker(currency: str) -> str:
+    """Ticker de Yahoo del par contra la base (USD -> USDMXN=X)."""
+    return f"{currency}{BASE_CURRENCY}=X"
+
+def currency_from_symbol(ticker: str) -> str:
+    """Divisa inferida del símbolo: pares =X cotizan en su divisa 'quote', .MX en MXN, resto USD."""
+    if ticker in SYMBOL_CURRENCY:
+        return SYMBOL_CURRENCY[ticker]
+    if ticker.endswith("=X") and len(ticker) == 8:
+        return ticker[3:6]
+    for suffix, ccy in SUFFIX_CURRENCY.items():
+        if ticker.endswith(suffix):
+            return ccy
+    return "USD"
+
+def currency_sql(ticker_col: str, meta_alias: Optional[str] = None) -> str:
+    """Misma regla que currency_from_symbol como expresión SQL (con override de ticker_metadata si hay alias)."""
+    cases = [f"WHEN {ticker_col} = '{t}' THEN '{c}'" for t, c in SYMBOL_CURRENCY.items()]
+    cases.append(f"WHEN {ticker_col} LIKE '%=X' AND length({ticker_col}) = 8 THEN substr({ticker_col}, 4, 3)")
+    cases += [f"WHEN {ticker_col} LIKE '%{s}' THEN '{c}'" for s, c in SUFFIX_CURRENCY.items()]
+    rule = f"CASE {' '.join(cases)} ELSE 'USD' END"
+    return f"COALESCE({meta_alias}.currency, {rule})" if meta_alias else rule
+
+def fx_join_sql(alias: str, currency_expr: str, date_expr: str) -> str:
+    """ASOF JOIN contra fx_rates: tasa vigente de `currency_expr` en `date_expr` (DATE)."""
+    return f"ASOF LEFT JOIN fx_rates {alias} ON {alias}.currency = {currency_expr} AND {date_expr} >= {alias}.date"
+
+def fx_rate_sql(alias: str, currency_expr: str) -> str:
+    """Tasa a MXN de un fx_join_sql (la base vale 1)."""
+    return f"(CASE WHEN {currency_expr} = '{BASE_CURRENCY}' THEN 1.0 ELSE {alias}.rate END)"
+
+class FxService:
+    """
+    Tipos de cambio diarios (tabla fx_rates) y conversión as-of vectorizada.
+    Todas las rutas de dinero (portfolio, journal, equity, riesgo) convierten por aquí:
+    una sola ASOF JOIN por columna, sin diccionarios por fecha ni fallbacks fijos.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    # --------------------------------------------------------------------------
+    # Mantenimiento (lo invoca el Collector tras sincronizar 1d)
+    # --------------------------------------------------------------------------
+
+    def required_currencies(self) -> List[str]:
+        """Divisas a mantener: default + las que aparecen en transacciones o metadata."""
+        rows = self.db.conn.execute(f"""
+            SELECT DISTINCT currency FROM portfolio_transactions WHERE currency IS NOT NULL
+            UNION
+            SELECT DISTINCT currency FROM ticker_metadata WHERE currency IS NOT NULL
+        """).fetchall()
+        found = {r[0].upper() for r in rows}
+        return sorted((found | set(DEFAULT_CURRENCIES)) - {BASE_CURRENCY})
+
+    def pair_tickers(self) -> List[str]:
+        return [pair_ticker(c) for c in self.required_currencies()]
+
+    def refresh(self) -> int:
+        """Materializa cierres 1d de los pares en fx_rates (incremental con traslape)."""
+        t_start = time.time()
+        pairs = ",".join([f"('{c}', '{pair_ticker(c)}')" for c in self.required_currencies()])
+        if not pairs:
+            return 0
+
+        self.db.conn.execute(f"""
+            INSERT INTO fx_rates (currency, date, rate, updated_at)
+            WITH pairs AS (
+                SELECT * FROM (VALUES {pairs}) AS p(currency, ticker)
+            ),
+            last AS (
+                SELECT p.currency, p.ticker, MAX(f.date) AS last_date
+                FROM pairs p
+                LEFT JOIN fx_rates f ON f.currency = p.currency
+                GROUP BY p.currency, p.ticker
+            )
+            SELECT l.currency, o.timestamp::DATE, o.close, now()
+            FROM ohlcv o
+            JOIN last l ON o.ticker = l.ticker
+            WHERE o.timeframe = '1d' AND o.close > 0
+              AND (l.last_date IS NULL OR o.timestamp >= l.last_date - INTERVAL {REFRESH_OVERLAP_DAYS} DAY)
+            ON CONFLICT (currency, date) DO UPDATE SET
+                rate = EXCLUDED.rate,
+                updated_at = EXCLUDED.updated_at
+        """)
+
+        stats = self.db.conn.execute(
+            "SELECT currency, count(*), MAX(date) FROM fx_rates GROUP BY currency ORDER BY currency"
+        ).fetchall()
+        missing = set(self.required_currencies()) - {s[0] for s in stats}
+        if missing:
+            logging.warning(f"⚠️ FX: sin tipo de cambio para {sorted(missing)} (¿par {pair_ticker(sorted(missing)[0])} sin datos?)")
+        summary = ", ".join([f"{c}={n} (hasta {d})" for c, n, d in stats])
+        logging.info(f"💱 FX Rates: {summary} ({time.time() - t_start:.2f}s)")
+        return len(stats)
+
+    # --------------------------------------------------------------------------
+    # Lectura
+    # --------------------------------------------------------------------------
+
+    def currencies(self, tickers: Iterable[str]) -> pd.Series:
+        """Divisa de cotización por ticker: ticker_metadata.currency o regla por símbolo."""
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return pd.Series(dtype=object)
+        in_list = ",".join([f"'{t}'" for t in tickers])
+        meta = self.db.conn.execute(
+            f"SELECT ticker, currency FROM ticker_metadata WHERE ticker IN ({in_list}) AND currency IS NOT NULL"
+        ).df().set_index("ticker")["currency"]
+        return pd.Series({t: meta.get(t) or currency_from_symbol(t) for t in tickers}, dtype=object)
+
+    def latest(self, currency: str, to: str = BASE_CURRENCY) -> Optional[float]:
+        """Última tasa currency -> to (None si falta alguna de las dos)."""
+        if currency == to:
+            return 1.0
+        res = self.db.conn.execute("""
+            SELECT
+                (SELECT arg_max(rate, date) FROM fx_rates WHERE currency = ?),
+                (SELECT arg_max(rate, date) FROM fx_rates WHERE currency = ?)
+        """, [currency, to]).fetchone()
+        num = 1.0 if currency == BASE_CURRENCY else res[0]
+        den = 1.0 if to == BASE_CURRENCY else res[1]
+        if num is None or den is None:
+            return None
+        return num / den
+
+    def convert(self, df: pd.DataFrame, columns: List[str], date_col: str, from_col: str = "currency",
+                to: str = BASE_CURRENCY, to_col: Optional[str] = None, rate_col: str = "fx_rate") -> pd.DataFrame:
+        """
+        Convierte columnas de montos con la tasa vigente en `date_col` (as-of: último día hábil <= fecha).
+        - Divisa origen por fila (`from_col`); destino fijo (`to`) o por fila (`to_col`).
+        - Devuelve una copia con las columnas convertidas y la tasa aplicada en `rate_col`.
+        """
+        out = df.copy()
+        if out.empty:
+            out[rate_col] = pd.Series(dtype=float)
+            return out
+
+        frame = pd.DataFrame({
+            "_row": range(len(out)),
+            "_d": pd.to_datetime(out[date_col]).to_numpy(),
+            "_from": out[from_col].to_numpy(),
+            "_to": out[to_col].to_numpy() if to_col else to,
+        })
+        self.db.conn.register("fx_frame", frame)
+        try:
+            rates = self.db.conn.execute(f"""
+                WITH f AS (
+                    SELECT _row, _from, _to, _d::DATE AS d FROM fx_frame
+                )
+                SELECT f._row,
+                       CASE WHEN f._from = f._to THEN 1.0
+                            ELSE {fx_rate_sql('a', 'f._from')} / {fx_rate_sql('b', 'f._to')} END AS rate
+                FROM f
+                {fx_join_sql('a', 'f._from', 'f.d')}
+                {fx_join_sql('b', 'f._to', 'f.d')}
+                ORDER BY f._row
+            """).df()
+        finally:
+            self.db.conn.unregister("fx_frame")
+
+        rate = rates["rate"].to_numpy(dtype=float)
+        for col in columns:
+            out[col] = out[col].astype(float).to_numpy() * rate
+        out[rate_col] = rate
+        return out
+
+    def rate_matrix(self, currencies: pd.Series, index: pd.DatetimeIndex, to: str = BASE_CURRENCY) -> pd.DataFrame:
+        """
+        Matriz fechas x columnas con la tasa as-of de la divisa de cada columna hacia `to`.
+        `currencies`: Series columna -> divisa (p.ej. salida de currencies()). Pensada para matrices de precios.
+        """
+        needed = sorted((set(currencies.values) | {to}) - {BASE_CURRENCY})
+        table = pd.DataFrame(index=pd.DatetimeIndex([], name="date"))
+        if needed:
+            in_list = ",".join([f"'{c}'" for c in needed])
+            raw = self.db.conn.execute(
+                f"SELECT date::TIMESTAMP AS date, currency, rate FROM fx_rates WHERE currency IN ({in_list})"
+            ).df()
+            if not raw.empty:
+                table = raw.pivot(index="date", columns="currency", values="rate")
+
+        dates = table.index.union(pd.DatetimeIndex(index).normalize())
+        table = table.reindex(dates).sort_index().ffill()
+        table[BASE_CURRENCY] = 1.0
+        table = table.reindex(columns=sorted(set(table.columns) | set(needed)))
+        # Día con hora (velas intradía) -> tasa de ese día
+        table = table.reindex(pd.DatetimeIndex(index).normalize())
+        table.index = index
+
+        matrix = table.reindex(columns=list(currencies.values))
+        matrix.columns = list(currencies.index)
+        return matrix.div(table[to], axis=0)
+
+if __name__ == "__main__":
+    db = Database()
+    FxService(db).refresh()
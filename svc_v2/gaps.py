@@ -0,0 +1,237 @@
+import logging
+import time
+from typing import Dict, List, Optional
+import pandas as pd
+from svc_v2.db import Database
+
+# Sesión esperada de un exchange: timestamp donde al menos esta fracción de sus tickers "vivos" tiene vela
+SESSION_QUORUM = 0.5
+
+# Historia máxima que Yahoo entrega por timeframe (mismos límites que Collector); huecos más viejos no se piden
+PROVIDER_LOOKBACK_DAYS = {"1h": 720, "15m": 59, "5m": 59}
+
+# Intentos de backfill antes de dar un hueco por perdido (halts, suspensiones, datos que Yahoo no tiene)
+MAX_ATTEMPTS = 3
+
+# Huecos del mismo ticker separados por menos de esto se piden en una sola ventana
+MERGE_DAYS = {"1d": 20}
+DEFAULT_MERGE_DAYS = 3
+
+# Tickers por llamada (mismo sweet spot que el sync normal)
+CHUNK_SIZE = 50
+
+def exchange_sql(ticker_col: str) -> str:
+    """Exchange inferido del símbolo (agrupa tickers que comparten calendario de sesiones)."""
+    return f"""(CASE
+        WHEN {ticker_col} LIKE '%=X' THEN 'FX'
+        WHEN {ticker_col} LIKE '%.MX' OR {ticker_col} = '^MXX' THEN 'BMV'
+        WHEN {ticker_col} LIKE '%-USD' THEN 'CRYPTO'
+        ELSE 'US'
+    END)"""
+
+class GapDetector:
+    """
+    Índice de huecos en ohlcv. Las sesiones esperadas de cada exchange se infieren de los propios datos
+    (timestamps donde la mayoría de sus tickers tiene vela), así feriados y medias sesiones salen solos
+    sin depender de un calendario externo. Por ticker se buscan sesiones faltantes entre su primera y
+    su última vela (la cola la cubre el sync normal) y se guardan como rangos en ohlcv_gaps.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def scan(self, timeframes: List[str], tickers: Optional[List[str]] = None) -> pd.DataFrame:
+        """Re-escanea los timeframes y reemplaza su índice (solo el de `tickers`, si se pasan). Devuelve resumen por timeframe/status."""
+        ticker_filter = ""
+        if tickers:
+            ticker_filter = "AND ticker IN (" + ",".join([f"'{t}'" for t in tickers]) + ")"
+
+        for tf in timeframes:
+            t_start = time.time()
+            found = self._find_gaps(tf, tickers)
+
+            self.db.conn.register("gaps_new", found)
+            self.db.conn.execute("BEGIN TRANSACTION")
+            try:
+                # Con tickers, solo se reemplaza su parte del índice (el resto conserva attempts / historial)
+                self.db.conn.execute(f"DELETE FROM ohlcv_gaps WHERE timeframe = '{tf}' {ticker_filter}")
+                if not found.empty:
+                    self.db.conn.execute("""
+                        INSERT INTO ohlcv_gaps
+                            (ticker, timeframe, exchange, gap_start, gap_end, missing_bars, status, attempts, detected_at, last_attempt_at)
+                        SELECT ticker, timeframe, exchange, gap_start, gap_end, missing_bars, status, attempts, detected_at, last_attempt_at
+                        FROM gaps_new
+                    """)
+                self.db.conn.execute("COMMIT")
+            except Exception:
+                self.db.conn.execute("ROLLBACK")
+                raise
+            finally:
+                self.db.conn.unregister("gaps_new")
+
+            n_open = int((found["status"] == "open").sum()) if not found.empty else 0
+            n_bars = int(found["missing_bars"].sum()) if not found.empty else 0
+            logging.info(f"🕳️ Gaps [{tf}]: {len(found)} rangos ({n_open} abiertos, {n_bars} velas faltantes) ({time.time() - t_start:.2f}s)")
+
+        return self.summary(timeframes)
+
+    def summary(self, timeframes: Optional[List[str]] = None) -> pd.DataFrame:
+        where = ""
+        if timeframes:
+            where = "WHERE timeframe IN (" + ",".join([f"'{tf}'" for tf in timeframes]) + ")"
+        return self.db.conn.execute(f"""
+            SELECT timeframe, status, COUNT(*) AS ranges, COUNT(DISTINCT ticker) AS tickers, SUM(missing_bars) AS missing_bars
+            FROM ohlcv_gaps {where}
+            GROUP BY ALL ORDER BY timeframe, status
+        """).df()
+
+    def _find_gaps(self, timeframe: str, tickers: Optional[List[str]]) -> pd.DataFrame:
+        ticker_filter = ""
+        if tickers:
+            ticker_filter = "AND s.ticker IN (" + ",".join([f"'{t}'" for t in tickers]) + ")"
+        lookback = PROVIDER_LOOKBACK_DAYS.get(timeframe)
+        out_of_range = f"g.gap_start < now() - INTERVAL {lookback} DAY" if lookback else "FALSE"
+
+        # Todas las velas del timeframe definen las sesiones; el filtro de tickers solo limita qué se reporta
+        return self.db.conn.execute(f"""
+            WITH bars AS (
+                SELECT ticker, timestamp AS ts, {exchange_sql('ticker')} AS exchange
+                FROM ohlcv WHERE timeframe = '{timeframe}'
+            ),
+            span AS (
+                SELECT ticker, exchange, MIN(ts) AS first_ts, MAX(ts) AS last_ts
+                FROM bars GROUP BY ALL
+            ),
+            present AS (
+                SELECT exchange, ts, COUNT(*) AS n FROM bars GROUP BY ALL
+            ),
+            sessions AS (
+                SELECT p.exchange, p.ts
+                FROM present p
+                JOIN span s ON s.exchange = p.exchange AND p.ts BETWEEN s.first_ts AND s.last_ts
+                GROUP BY p.exchange, p.ts, p.n
+                HAVING p.n >= {SESSION_QUORUM} * COUNT(*)
+            ),
+            indexed AS (
+                SELECT exchange, ts, row_number() OVER (PARTITION BY exchange ORDER BY ts) AS idx
+                FROM sessions
+            ),
+            missing AS (
+                SELECT s.ticker, s.exchange, i.ts, i.idx
+                FROM span s
+                JOIN indexed i ON i.exchange = s.exchange AND i.ts > s.first_ts AND i.ts < s.last_ts
+                ANTI JOIN bars b ON b.ticker = s.ticker AND b.ts = i.ts
+                WHERE 1=1 {ticker_filter}
+            ),
+            islands AS (
+                -- Sesiones consecutivas faltantes -> un rango
+                SELECT ticker, exchange, ts,
+                       idx - row_number() OVER (PARTITION BY ticker ORDER BY idx) AS grp
+                FROM missing
+            ),
+            g AS (
+                SELECT ticker, exchange, MIN(ts) AS gap_start, MAX(ts) AS gap_end, COUNT(*) AS missing_bars
+                FROM islands GROUP BY ticker, exchange, grp
+            ),
+            prev AS (
+                -- Intentos previos de cualquier rango que se traslape (un backfill parcial mueve los bordes)
+                SELECT g.ticker, g.gap_start,
+                       COALESCE(MAX(o.attempts), 0) AS attempts,
+                       MIN(o.detected_at) AS detected_at,
+                       MAX(o.last_attempt_at) AS last_attempt_at
+                FROM g
+                LEFT JOIN ohlcv_gaps o ON o.ticker = g.ticker AND o.timeframe = '{timeframe}'
+                    AND o.gap_start <= g.gap_end AND o.gap_end >= g.gap_start
+                GROUP BY g.ticker, g.gap_start
+            )
+            SELECT g.ticker, '{timeframe}' AS timeframe, g.exchange, g.gap_start, g.gap_end, g.missing_bars,
+                   CASE WHEN {out_of_range} THEN 'out_of_range'
+                        WHEN p.attempts >= {MAX_ATTEMPTS} THEN 'exhausted'
+                        ELSE 'open' END AS status,
+                   p.attempts,
+                   COALESCE(p.detected_at, now()) AS detected_at,
+                   p.last_attempt_at
+            FROM g JOIN prev p USING (ticker, gap_start)
+            ORDER BY g.ticker, g.gap_start
+        """).df()
+
+class BackfillPlanner:
+    """
+    Convierte los huecos abiertos de ohlcv_gaps en descargas acotadas:
+    1) une huecos cercanos del mismo ticker en una ventana,
+    2) alinea ventanas a semanas completas y agrupa tickers que comparten ventana (una llamada multi-ticker),
+    3) parte en chunks de CHUNK_SIZE.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def plan(self, timeframes: Optional[List[str]] = None, tickers: Optional[List[str]] = None) -> pd.DataFrame:
+        """Plan de descargas: una fila por llamada (timeframe, start, end exclusivo, tickers)."""
+        filters = ["status = 'open'"]
+        if timeframes:
+            filters.append("timeframe IN (" + ",".join([f"'{tf}'" for tf in timeframes]) + ")")
+        if tickers:
+            filters.append("ticker IN (" + ",".join([f"'{t}'" for t in tickers]) + ")")
+        gaps = self.db.conn.execute(f"""
+            SELECT ticker, timeframe, gap_start, gap_end, missing_bars
+            FROM ohlcv_gaps WHERE {' AND '.join(filters)}
+            ORDER BY timeframe, ticker, gap_start
+        """).df()
+
+        columns = ["timeframe", "start", "end", "tickers", "n_tickers", "missing_bars"]
+        if gaps.empty:
+            return pd.DataFrame(columns=columns)
+
+        # 1. Ventanas por ticker: [día del inicio, día siguiente al fin) y unión de huecos cercanos
+        gaps["start"] = gaps["gap_start"].dt.normalize()
+        gaps["end"] = gaps["gap_end"].dt.normalize() + pd.Timedelta(days=1)
+        merge = gaps["timeframe"].map(MERGE_DAYS).fillna(DEFAULT_MERGE_DAYS)
+        prev_end = gaps.groupby(["timeframe", "ticker"])["end"].shift()
+        new_window = prev_end.isna() | ((gaps["start"] - prev_end).dt.days > merge)
+        gaps["window"] = new_window.cumsum()
+        windows = gaps.groupby("window").agg(
+            timeframe=("timeframe", "first"), ticker=("ticker", "first"),
+            start=("start", "min"), end=("end", "max"), missing_bars=("missing_bars", "sum"),
+        )
+
+        # 2. Semanas completas: ventanas parecidas de distintos tickers caen en la misma llamada
+        windows["start"] = windows["start"] - pd.to_timedelta(windows["start"].dt.weekday, unit="D")
+        windows["end"] = windows["end"] + pd.to_timedelta((7 - windows["end"].dt.weekday) % 7, unit="D")
+
+        # 3. Una fila por chunk de tickers que comparten (timeframe, start, end)
+        rows = []
+        for (tf, start, end), grp in windows.groupby(["timeframe", "start", "end"], sort=True):
+            names = grp["ticker"].tolist()
+            bars = grp.set_index("ticker")["missing_bars"]
+            for i in range(0, len(names), CHUNK_SIZE):
+                chunk = names[i:i + CHUNK_SIZE]
+                rows.append({
+                    "timeframe": tf, "start": start, "end": end,
+                    "tickers": chunk, "n_tickers": len(chunk),
+                    "missing_bars": int(bars[chunk].sum()),
+                })
+        return pd.DataFrame(rows, columns=columns)
+
+    def execute(self, plan: pd.DataFrame, collector) -> Dict[str, List[str]]:
+        """Ejecuta el plan con el Collector y suma un intento a los huecos cubiertos. Devuelve tickers tocados por timeframe."""
+        touched: Dict[str, List[str]] = {}
+        for n, req in enumerate(plan.itertuples(index=False), start=1):
+            start, end = req.start.strftime('%Y-%m-%d'), req.end.strftime('%Y-%m-%d')
+            logging.info(f"   🩹 Backfill {n}/{len(plan)} [{req.timeframe}] {start} -> {end}: {req.n_tickers} tickers ({req.missing_bars} velas)")
+            collector.fetch_range(req.tickers, req.timeframe, start, end)
+
+            in_list = ",".join([f"'{t}'" for t in req.tickers])
+            self.db.conn.execute(f"""
+                UPDATE ohlcv_gaps
+                SET attempts = attempts + 1, last_attempt_at = now()
+                WHERE timeframe = '{req.timeframe}' AND ticker IN ({in_list})
+                  AND gap_start >= TIMESTAMP '{start}' AND gap_end < TIMESTAMP '{end}'
+            """)
+            touched.setdefault(req.timeframe, []).extend(req.tickers)
+        return {tf: sorted(set(t)) for tf, t in touched.items()}
+
+if __name__ == "__main__":
+    db = Database()
+    print(GapDetector(db).scan(["1d"]))
+    print(BackfillPlanner(db).plan(["1d"]))
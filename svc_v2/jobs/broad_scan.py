@@ -6,6 +6,11 @@ from svc_v2.db import Database
 from svc_v2.collector import Collector
 from svc_v2.analyzer import Analyzer
 from svc_v2.screener import ScreenerEngine
+from svc_v2.returns import ReturnsEngine
+from svc_v2.relative_strength import RelativeStrengthEngine
+from svc_v2.equity import EquityCurveEngine
+from svc_v2.risk import RiskEngine
+from svc_v2.events import publish_event, JOB_FINISHED, SIGNAL
 from svc_v2.universe_loader import get_sp500_tickers, get_nasdaq100_tickers, get_key_etfs_indices
 
 # Configurar logs
@@ -62,7 +67,8 @@ def main():
     # Importante para que el reporte salga bonito
     print("   -> Sincronizando metadatos...")
     for t, n in universe_dict.items():
-        db.upsert_metadata(ticker=t, name=n)
+        # Manuales (nombre temporal = ticker) no pisan el nombre que trae metadata_sync
+        db.upsert_metadata(ticker=t, name=n if n != t else None)
 
     # 5. Sync Data (Collector)
     # Broad Scan siempre es Diario ('1d') según config default
@@ -78,12 +84,33 @@ def main():
     
     alz.analyze_tickers(full_universe, timeframes, force_full=force_full)
 
+    # 6a. Tickers con historia reescrita por split/dividendo: indicadores de toda la historia
+    if not force_full:
+        for tf, adjusted in col.adjusted.items():
+            alz.analyze_tickers(adjusted, [tf], force_full=True)
+
+    # 6b. Returns precalculados (solo tickers con velas nuevas)
+    ReturnsEngine(db).refresh(timeframes, full_universe)
+
+    # 6c. Fuerza relativa y percentiles del universo (cross-sectional). Con historia reescrita por
+    # split/dividendo se recalcula todo el timeframe: los retornos y rankings viejos traen el salto sin ajustar
+    rs = RelativeStrengthEngine(db)
+    for tf in timeframes:
+        rs.compute([tf], force_full=force_full or bool(col.adjusted.get(tf)))
+
+    # 6d. Curva diaria del portafolio (solo reescribe desde transacciones cambiadas / últimos días)
+    EquityCurveEngine(db).refresh(force_full=force_full or bool(col.adjusted.get('1d')))
+
+    # 6e. Riesgo por posición y del portafolio (vol, beta, VaR histórico, drawdown)
+    RiskEngine(db).compute()
+
     # 7. Execute Screeners (The Funnel)
     print("\n🔍 Ejecutando Filtros Tácticos...")
     
     strategies = {
         "🟢 BUY_BOUNCE (Pánico)": "BUY_BOUNCE",
         "🟡 BUY_TREND (U2)": "BUY_TREND",
+        "🟢 BUY_VALUE_TREND (U2 + PE < 25)": "BUY_VALUE_TREND",
         "🔴 SELL_STRENGTH (Euforia)": "SELL_STRENGTH"
     }
     
@@ -103,6 +130,7 @@ def main():
             print(f"   💾 Guardando {len(candidates)} candidatos para monitoreo intradía (3 días)...")
             for t in candidates['ticker'].tolist():
                 db.add_to_dynamic_watchlist(t, reason=strat_key, days_to_keep=3)
+            publish_event(db, SIGNAL, {"strategy": strat_key, "timeframe": "1d", "tickers": candidates['ticker'].tolist()})
             # --------------------------------------
 
             # Columnas dinámicas según estrategia
@@ -112,6 +140,8 @@ def main():
                 extra_cols = ['gap_pct', 'chg_pct', 'rsi', 'vol_k']
             elif strat_key == "BUY_TREND":
                 extra_cols = ['adx', 'ema_50', 'macd_hist']
+            elif strat_key == "BUY_VALUE_TREND":
+                extra_cols = ['adx', 'pe', 'forward_pe', 'dividend_yield']
             elif strat_key == "SELL_STRENGTH":
                 extra_cols = ['rsi', 'vol_k']
             
@@ -140,6 +170,7 @@ def main():
     except Exception as e:
         print(f"Error checking earnings: {e}")
 
+    publish_event(db, JOB_FINISHED, {"job": "broad_scan", "timeframes": timeframes})
     print("\n✅ Broad Scan Finalizado.")
     db.close()
 
@@ -0,0 +1,32 @@
+import logging
+import os
+from svc_v2.config_loader import load_settings
+from svc_v2.db import Database
+from svc_v2.correlation import CorrelationEngine
+from svc_v2.events import publish_event, JOB_FINISHED
+
+# Configurar logs
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    print("\n🔗 MARKET DASHBOARD V2: Correlation Matrix 🔗\n")
+
+    # 1. Cargar Configuración
+    try:
+        cfg = load_settings()
+    except Exception as e:
+        logging.error(f"Fallo crítico cargando configuración: {e}")
+        return
+
+    # 2. Init System
+    db = Database(f"data/{cfg.system.db_filename}")
+
+    # 3. Actualizar matriz rolling + clusters (incremental salvo bootstrap)
+    as_of = CorrelationEngine(db).update(force_full=(os.environ.get("FORCE_FULL_SCAN") == "1"))
+
+    publish_event(db, JOB_FINISHED, {"job": "correlation", "timeframes": ["1d"], "as_of": as_of})
+    print("\n✅ Correlation Finalizado.")
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,10 @@ from svc_v2.db import Database
 from svc_v2.collector import Collector
 from svc_v2.analyzer import Analyzer
 from svc_v2.screener import ScreenerEngine
+from svc_v2.returns import ReturnsEngine
+from svc_v2.relative_strength import RelativeStrengthEngine
 from svc_v2.notifier import Notifier
+from svc_v2.events import publish_event, JOB_FINISHED, SIGNAL
 
 # Configurar logs
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -58,7 +61,8 @@ def main():
 
     # Obtener mapa de nombres para el reporte
     try:
-        q_names = f"SELECT ticker, name FROM ticker_metadata WHERE ticker IN ({','.join([f"'{t}'" for t in vip_tickers])})"
+        in_list = ",".join([f"'{t}'" for t in vip_tickers])
+        q_names = f"SELECT ticker, name FROM ticker_metadata WHERE ticker IN ({in_list})"
         name_map = db.conn.execute(q_names).df().set_index('ticker')['name'].to_dict()
     except Exception:
         name_map = {}
@@ -72,6 +76,12 @@ def main():
         # A) Sync & Analyze TODO el universo
         col.sync_tickers(full_universe, [tf])
         alz.analyze_tickers(full_universe, [tf], force_full=(os.environ.get("FORCE_FULL_SCAN") == "1"))
+        if col.adjusted.get(tf):
+            # Historia reescrita por split/dividendo: indicadores completos
+            alz.analyze_tickers(col.adjusted[tf], [tf], force_full=True)
+        ReturnsEngine(db).refresh([tf], full_universe)
+        # Con historia reescrita, RS de todo el timeframe (retornos y percentiles del universo en esas fechas)
+        RelativeStrengthEngine(db).compute([tf], force_full=(os.environ.get("FORCE_FULL_SCAN") == "1") or bool(col.adjusted.get(tf)))
         
         # B) Screen & Batch Notif
         print(f"   🔎 Evaluando Alertas VIP...")
@@ -88,6 +98,8 @@ def main():
             candidates = eng.run_screen(strat_key, timeframe=tf)
             # Solo VIPs
             candidates = candidates[candidates['ticker'].isin(vip_tickers)]
+            if not candidates.empty:
+                publish_event(db, SIGNAL, {"strategy": strat_key, "timeframe": tf, "tickers": candidates['ticker'].tolist()})
             
             for _, row in candidates.iterrows():
                 signal_data = {
@@ -111,6 +123,7 @@ def main():
             print(f"   🔭 Enviando batch de {len(batch_market)} alertas de MARKET...")
             notif.notify_batch(batch_market, title_prefix="🔭 MARKET SCAN", timeframe=tf)
 
+    publish_event(db, JOB_FINISHED, {"job": "detailed_scan", "timeframes": timeframes})
     print("\n✅ Detailed Scan Finalizado.")
     db.close()
 
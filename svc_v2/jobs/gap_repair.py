@@ -0,0 +1,68 @@
+import argparse
+import logging
+from svc_v2.config_loader import load_settings
+from svc_v2.db import Database
+from svc_v2.collector import Collector
+from svc_v2.analyzer import Analyzer
+from svc_v2.gaps import GapDetector, BackfillPlanner
+from svc_v2.returns import ReturnsEngine
+from svc_v2.events import publish_event, JOB_FINISHED
+
+# Configurar logs
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Detecta huecos en ohlcv y rellena solo esos rangos")
+    parser.add_argument("--timeframes", nargs="+", help="Default: todos los de settings (broad + detailed)")
+    parser.add_argument("--tickers", nargs="+", help="Limitar el reporte/backfill a estos tickers")
+    parser.add_argument("--dry-run", action="store_true", help="Solo escanear y mostrar el plan, sin descargar")
+    args = parser.parse_args()
+
+    print("\n🕳️ MARKET DASHBOARD V2: Gap Repair 🕳️\n")
+
+    # 1. Cargar Configuración
+    try:
+        cfg = load_settings()
+    except Exception as e:
+        logging.error(f"Fallo crítico cargando configuración: {e}")
+        return
+
+    timeframes = args.timeframes or sorted({tf for tfs in cfg.data.timeframes.values() for tf in tfs})
+
+    # 2. Init System
+    db = Database(f"data/{cfg.system.db_filename}")
+    detector = GapDetector(db)
+    planner = BackfillPlanner(db)
+
+    # 3. Índice de huecos
+    print(detector.scan(timeframes, args.tickers).to_string(index=False))
+
+    # 4. Plan de descargas acotadas
+    plan = planner.plan(timeframes, args.tickers)
+    if plan.empty:
+        print("\n✅ Sin huecos abiertos.")
+        db.close()
+        return
+
+    print(f"\n📋 Plan: {len(plan)} descargas, {plan['n_tickers'].sum()} ticker-ventanas, {plan['missing_bars'].sum()} velas faltantes")
+    print(plan.drop(columns=["tickers"]).to_string(index=False))
+    if args.dry_run:
+        db.close()
+        return
+
+    # 5. Backfill + re-escaneo (lo que siga faltando suma un intento; tras MAX_ATTEMPTS queda 'exhausted')
+    touched = planner.execute(plan, Collector(db))
+    print(detector.scan(timeframes, args.tickers).to_string(index=False))
+
+    # 6. Recalcular derivados de los tickers tocados (historia completa: el hueco puede estar lejos de la cola)
+    alz = Analyzer(db)
+    for tf, tickers in touched.items():
+        alz.analyze_tickers(tickers, [tf], force_full=True)
+        ReturnsEngine(db).refresh([tf], tickers)
+
+    publish_event(db, JOB_FINISHED, {"job": "gap_repair", "timeframes": sorted(touched)})
+    print("\n✅ Gap Repair Finalizado.")
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import logging
+from svc_v2.config_loader import load_settings
+from svc_v2.db import Database
+from svc_v2.maintenance import StorageMaintenance
+from svc_v2.events import publish_event, JOB_FINISHED
+
+# Configurar logs
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Retención intradía, compactación del archivo (series ordenadas) y registro de tamaño")
+    parser.add_argument("--budget-mb", type=int, help="Presupuesto del archivo (default: storage.size_budget_mb)")
+    parser.add_argument("--no-compact", action="store_true", help="Solo retención + CHECKPOINT, sin reescribir el archivo")
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar tamaño y lo que se borraría")
+    args = parser.parse_args()
+
+    print("\n🧹 MARKET DASHBOARD V2: Storage Maintenance 🧹\n")
+
+    # 1. Cargar Configuración
+    try:
+        cfg = load_settings()
+    except Exception as e:
+        logging.error(f"Fallo crítico cargando configuración: {e}")
+        return
+
+    # 2. Init System
+    db = Database(f"data/{cfg.system.db_filename}")
+    maint = StorageMaintenance(db)
+
+    # 3. Mantenimiento
+    budget = args.budget_mb if args.budget_mb is not None else cfg.storage.size_budget_mb
+    summary = maint.run(cfg.storage.retention_days, budget_mb=budget,
+                        compact=not args.no_compact, dry_run=args.dry_run)
+
+    # 4. Filas por tabla / timeframe
+    print(maint.row_counts().to_string(index=False))
+
+    if not args.dry_run:
+        publish_event(db, JOB_FINISHED, {
+            "job": "maintenance",
+            "deleted": summary["deleted"],
+            "file_bytes": summary["after"]["file_bytes"],
+            "used_bytes": summary["after"]["used_bytes"],
+        })
+    print("\n✅ Storage Maintenance Finalizado.")
+    db.close()
+
+if __name__ == "__main__":
+    main()
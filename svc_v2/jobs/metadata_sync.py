@@ -0,0 +1,51 @@
+import argparse
+import logging
+from svc_v2.config_loader import load_settings
+from svc_v2.db import Database
+from svc_v2.metadata import MetadataSync, METADATA_TTL_DAYS
+from svc_v2.ticker_health import TickerHealth
+from svc_v2.events import publish_event, JOB_FINISHED
+
+# Configurar logs
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresca ticker_metadata (nombre, sector, divisa, earnings) de las fichas vencidas")
+    parser.add_argument("--tickers", nargs="+", help="Default: universo con velas 1d + holdings + watchlist")
+    parser.add_argument("--ttl-days", type=int, default=METADATA_TTL_DAYS, help="Antigüedad máxima de una ficha")
+    parser.add_argument("--force", action="store_true", help="Refrescar todas, sin importar el TTL")
+    args = parser.parse_args()
+
+    print("\n🗂️ MARKET DASHBOARD V2: Metadata Sync 🗂️\n")
+
+    # 1. Cargar Configuración
+    try:
+        cfg = load_settings()
+    except Exception as e:
+        logging.error(f"Fallo crítico cargando configuración: {e}")
+        return
+
+    # 2. Init System
+    db = Database(f"data/{cfg.system.db_filename}")
+
+    # 3. Universo: lo que ya sincroniza el Broad Scan + manuales, sin símbolos en cuarentena
+    tickers = args.tickers
+    if not tickers:
+        holding_tickers = [h.ticker if hasattr(h, 'ticker') else h for h in cfg.portfolios.holdings]
+        synced = [r[0] for r in db.conn.execute("SELECT DISTINCT ticker FROM ohlcv WHERE timeframe = '1d'").fetchall()]
+        tickers = sorted(set(synced + holding_tickers + cfg.universe.watchlist))
+        skip = TickerHealth(db).quarantined('1d', tickers)
+        tickers = [t for t in tickers if t not in skip]
+        # Pares FX e índices no tienen ficha útil
+        tickers = [t for t in tickers if not t.endswith('=X') and not t.startswith('^')]
+    print(f"   -> {len(tickers)} tickers en el universo.")
+
+    # 4. Refresco concurrente de las fichas vencidas
+    stats = MetadataSync(db).refresh(tickers, force=args.force, ttl_days=args.ttl_days)
+
+    publish_event(db, JOB_FINISHED, {"job": "metadata_sync", **stats})
+    print("\n✅ Metadata Sync Finalizado.")
+    db.close()
+
+if __name__ == "__main__":
+    main()
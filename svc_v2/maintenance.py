@@ -0,0 +1,312 @@
+import logging
+import os
+import time
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import pandas as pd
+from svc_v2.db import Database
+
+# Tablas de series por (ticker, timeframe, timestamp), padre primero (indicators tiene FK a ohlcv)
+SERIES_TABLES = ["ohlcv", "indicators", "relative_strength"]
+
+# Piso al recortar por presupuesto: 30 días de 1h son ~210 velas, suficientes para la EMA 200
+MIN_RETENTION_DAYS = 30
+
+# Mientras la DB exceda el presupuesto, la retención intradía se multiplica por este factor
+BUDGET_STEP = 0.75
+
+# Orden físico tras la reescritura (zone maps por timeframe -> ticker -> rango de fechas)
+CLUSTER_ORDER = "timeframe, ticker, timestamp"
+
+# Alias y sufijo del archivo nuevo durante la compactación ({db}.compact.duckdb, se renombra sobre el original)
+COMPACT_ALIAS = "compact"
+COMPACT_SUFFIX = ".compact.duckdb"
+
+def file_size(db_path) -> Dict[str, int]:
+    """Bytes en disco del archivo y de su WAL, sin abrirlo (la API mide así la DB viva, no el snapshot)."""
+    db_path = Path(db_path)
+    wal_path = Path(f"{db_path}.wal")
+    return {
+        "file_bytes": db_path.stat().st_size if db_path.exists() else 0,
+        "wal_bytes": wal_path.stat().st_size if wal_path.exists() else 0,
+    }
+
+class StorageMaintenance:
+    """
+    Mantenimiento del archivo DuckDB. Los upserts cada 15 min fragmentan ohlcv / indicators (filas
+    borradas dentro de row groups viejos, filas nuevas al final), así que los zone maps dejan de
+    descartar row groups al filtrar por ticker; y DuckDB nunca encoge el archivo: los bloques que se
+    liberan solo se reutilizan. El job:
+    1. Recorta historia intradía más vieja que la retención (y más, si la DB excede el presupuesto).
+    2. Compacta: copia todo a un archivo nuevo (series ordenadas por (timeframe, ticker, timestamp))
+       y lo renombra sobre el original. Es la única forma de devolver espacio al disco.
+    3. Guarda tamaño del archivo y filas por tabla/timeframe en storage_stats.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    # --------------------------------------------------------------------------
+    # Medición
+    # --------------------------------------------------------------------------
+
+    def size(self) -> Dict[str, int]:
+        """Tamaño del archivo y bloques usados / libres (los libres se reutilizan, el archivo no se encoge)."""
+        block_size, used, free = self.db.conn.execute(
+            "SELECT block_size, used_blocks, free_blocks FROM pragma_database_size() WHERE database_name = current_database()"
+        ).fetchone()
+        return {
+            **file_size(self.db.db_path),
+            "used_bytes": int(used) * int(block_size),
+            "free_bytes": int(free) * int(block_size),
+        }
+
+    def row_counts(self) -> pd.DataFrame:
+        """Filas por tabla de series y timeframe."""
+        return self.db.conn.execute(" UNION ALL ".join([
+            f"SELECT '{t}' AS table_name, timeframe, COUNT(*) AS row_count FROM {t} GROUP BY timeframe"
+            for t in SERIES_TABLES
+        ]) + " ORDER BY table_name, timeframe").df()
+
+    def record(self) -> pd.DataFrame:
+        """Snapshot de tamaño y filas en storage_stats (fila 'database' con los bytes del archivo)."""
+        size = self.size()
+        counts = self.row_counts()
+        now = datetime.now()
+        df = pd.concat([
+            pd.DataFrame([{"table_name": "database", "timeframe": "*", "row_count": int(counts["row_count"].sum()), **size}]),
+            counts,
+        ], ignore_index=True)
+        df["measured_at"] = now
+        self.db.conn.register("stats_new", df)
+        try:
+            self.db.conn.execute("""
+                INSERT INTO storage_stats (measured_at, table_name, timeframe, row_count, file_bytes, wal_bytes, used_bytes, free_bytes)
+                SELECT measured_at, table_name, timeframe, row_count, file_bytes, wal_bytes, used_bytes, free_bytes
+                FROM stats_new
+            """)
+        finally:
+            self.db.conn.unregister("stats_new")
+        return df
+
+    def last_measurement(self) -> Optional[Dict[str, Any]]:
+        """Fila 'database' más reciente de storage_stats (None si el job no ha corrido)."""
+        df = self.db.conn.execute("""
+            SELECT measured_at, row_count, file_bytes, wal_bytes, used_bytes, free_bytes
+            FROM storage_stats
+            WHERE table_name = 'database'
+            ORDER BY measured_at DESC
+            LIMIT 1
+        """).df()
+        return df.iloc[0].to_dict() if not df.empty else None
+
+    def history(self, days: int = 90) -> pd.DataFrame:
+        """Evolución del tamaño del archivo (una fila por corrida)."""
+        return self.db.conn.execute(f"""
+            SELECT measured_at, row_count, file_bytes, wal_bytes, used_bytes, free_bytes
+            FROM storage_stats
+            WHERE table_name = 'database' AND measured_at > now() - INTERVAL {int(days)} DAY
+            ORDER BY measured_at
+        """).df()
+
+    # --------------------------------------------------------------------------
+    # Retención
+    # --------------------------------------------------------------------------
+
+    def budget_retention(self, retention: Dict[str, int], budget_mb: Optional[float], compact: bool = True) -> Dict[str, int]:
+        """
+        Retención efectiva: la configurada, recortada por pasos (BUDGET_STEP, piso MIN_RETENTION_DAYS)
+        hasta que las filas que se borrarían cubran el exceso sobre el presupuesto.
+        El presupuesto es sobre el archivo (file_bytes). Con compactación el archivo queda en ~used_bytes,
+        así que el exceso se mide sobre lo usado; sin ella el archivo no se encoge y se mide sobre file_bytes.
+        Bytes por fila = bytes usados / filas de series (estimado; el resto de tablas es marginal).
+        """
+        retention = {tf: days for tf, days in retention.items() if tf != "1d"}
+        if not budget_mb or not retention:
+            return retention
+
+        size = self.size()
+        budget = budget_mb * 1024 * 1024
+        if size["file_bytes"] <= budget:
+            return retention
+
+        projected = size["used_bytes"] if compact else size["file_bytes"]
+        if projected <= budget:
+            logging.info(f"   💰 Archivo {size['file_bytes'] / 1e6:.0f} MB > presupuesto {budget_mb} MB: alcanza con compactar")
+            return retention
+
+        total_rows = int(self.row_counts()["row_count"].sum())
+        if total_rows == 0:
+            return retention
+        excess_rows = (projected - budget) / (size["used_bytes"] / total_rows)
+
+        effective = dict(retention)
+        while self._rows_before(effective) < excess_rows:
+            shrinkable = [tf for tf, days in effective.items() if days > MIN_RETENTION_DAYS]
+            if not shrinkable:
+                logging.warning(f"   ⚠️ Presupuesto de {budget_mb} MB inalcanzable con la retención mínima ({MIN_RETENTION_DAYS} días)")
+                break
+            for tf in shrinkable:
+                effective[tf] = max(MIN_RETENTION_DAYS, int(effective[tf] * BUDGET_STEP))
+
+        logging.info(f"   💰 Archivo {size['file_bytes'] / 1e6:.0f} MB > presupuesto {budget_mb} MB -> retención {retention} => {effective}")
+        if not compact:
+            logging.warning("   ⚠️ Sin compactación el archivo no se encoge: lo borrado solo se reutiliza")
+        return effective
+
+    def _rows_before(self, retention: Dict[str, int]) -> int:
+        """Filas de series que quedan fuera de la retención."""
+        conds = " OR ".join([
+            f"(timeframe = '{tf}' AND timestamp < now() - INTERVAL {int(days)} DAY)" for tf, days in retention.items()
+        ])
+        return int(sum(
+            self.db.conn.execute(f"SELECT COUNT(*) FROM {t} WHERE {conds}").fetchone()[0] for t in SERIES_TABLES
+        ))
+
+    def prune(self, retention: Dict[str, int], dry_run: bool = False) -> Dict[str, int]:
+        """Borra velas (y sus derivados) más viejas que la retención de su timeframe. Devuelve velas borradas por tf."""
+        deleted = {}
+        for tf, days in retention.items():
+            if tf == "1d":
+                continue
+            cutoff = (datetime.now() - timedelta(days=int(days))).strftime('%Y-%m-%d %H:%M:%S')
+            n = self.db.conn.execute(
+                f"SELECT COUNT(*) FROM ohlcv WHERE timeframe = '{tf}' AND timestamp < TIMESTAMP '{cutoff}'"
+            ).fetchone()[0]
+            deleted[tf] = int(n)
+            if dry_run or n == 0:
+                continue
+
+            # Derivados primero y en otra transacción: DuckDB no deja borrar filas referenciadas por la FK
+            # de indicators en la misma transacción en que se borran las que las referencian
+            self.db.conn.execute("BEGIN TRANSACTION")
+            try:
+                for t in ["indicators", "relative_strength"]:
+                    self.db.conn.execute(f"DELETE FROM {t} WHERE timeframe = '{tf}' AND timestamp < TIMESTAMP '{cutoff}'")
+                self.db.conn.execute(f"DELETE FROM ohlcv_gaps WHERE timeframe = '{tf}' AND gap_end < TIMESTAMP '{cutoff}'")
+                self.db.conn.execute("COMMIT")
+            except Exception:
+                self.db.conn.execute("ROLLBACK")
+                raise
+            self.db.conn.execute(f"DELETE FROM ohlcv WHERE timeframe = '{tf}' AND timestamp < TIMESTAMP '{cutoff}'")
+            logging.info(f"   ✂️ Retención [{tf}]: {n} velas anteriores a {cutoff[:10]} borradas ({days} días)")
+        return deleted
+
+    # --------------------------------------------------------------------------
+    # Compactación
+    # --------------------------------------------------------------------------
+
+    def compact(self):
+        """
+        Copia la DB a un archivo nuevo y lo renombra sobre el original (el archivo queda del tamaño de
+        los datos). Las series se insertan ordenadas por CLUSTER_ORDER. COPY FROM DATABASE no sirve:
+        copia indicators antes que ohlcv y choca con la FK, así que se recrea el esquema en orden
+        (secuencias en su valor actual, tablas padre primero, vistas al final).
+        Cierra y reabre db.conn: el caller no debe tener resultados pendientes.
+        """
+        t_start = time.time()
+        src = Path(self.db.db_path)
+        dst = src.with_name(src.stem + COMPACT_SUFFIX)
+        dst.unlink(missing_ok=True)
+        Path(f"{dst}.wal").unlink(missing_ok=True)
+
+        conn = self.db.conn
+        main = conn.execute("SELECT current_database()").fetchone()[0]
+        conn.execute("CHECKPOINT")
+
+        sequences = conn.execute(f"""
+            SELECT sequence_name, COALESCE(last_value + increment_by, start_value)
+            FROM duckdb_sequences() WHERE database_name = '{main}' AND NOT temporary
+        """).fetchall()
+        with_fk = {r[0] for r in conn.execute(f"""
+            SELECT DISTINCT table_name FROM duckdb_constraints()
+            WHERE database_name = '{main}' AND constraint_type = 'FOREIGN KEY'
+        """).fetchall()}
+        tables = conn.execute(f"""
+            SELECT table_name, sql FROM duckdb_tables() WHERE database_name = '{main}' AND NOT temporary
+        """).fetchall()
+        tables.sort(key=lambda t: t[0] in with_fk)  # padres primero
+        views = conn.execute(f"""
+            SELECT sql FROM duckdb_views() WHERE database_name = '{main}' AND NOT internal AND NOT temporary
+        """).fetchall()
+        indexes = conn.execute(f"""
+            SELECT sql FROM duckdb_indexes() WHERE database_name = '{main}' AND sql IS NOT NULL
+        """).fetchall()
+
+        conn.execute(f"ATTACH '{dst}' AS {COMPACT_ALIAS}")
+        try:
+            # El DDL guardado no lleva catálogo: se ejecuta con el archivo nuevo como default
+            conn.execute(f"USE {COMPACT_ALIAS}")
+            for name, start in sequences:
+                conn.execute(f"CREATE SEQUENCE {name} START WITH {int(start)}")
+            for name, ddl in tables:
+                conn.execute(ddl)
+                order = f" ORDER BY {CLUSTER_ORDER}" if name in SERIES_TABLES else ""
+                conn.execute(f"INSERT INTO {COMPACT_ALIAS}.main.{name} SELECT * FROM {main}.main.{name}{order}")
+            for (ddl,) in views + indexes:
+                conn.execute(ddl)
+
+            for name, _ in tables:
+                n_src = conn.execute(f"SELECT COUNT(*) FROM {main}.main.{name}").fetchone()[0]
+                n_dst = conn.execute(f"SELECT COUNT(*) FROM {COMPACT_ALIAS}.main.{name}").fetchone()[0]
+                if n_src != n_dst:
+                    raise RuntimeError(f"Compactación: {name} tiene {n_dst} filas, se esperaban {n_src}")
+            conn.execute("CHECKPOINT")
+        except Exception:
+            conn.execute(f"USE {main}")
+            conn.execute(f"DETACH {COMPACT_ALIAS}")
+            dst.unlink(missing_ok=True)
+            Path(f"{dst}.wal").unlink(missing_ok=True)
+            raise
+        conn.execute(f"USE {main}")
+        conn.execute(f"DETACH {COMPACT_ALIAS}")
+
+        # Swap: nadie más escribe (el job tiene el lock); la API lee de snapshots, no de este archivo
+        conn.close()
+        os.replace(dst, src)
+        Path(f"{src}.wal").unlink(missing_ok=True)
+        self.db._init_db(str(src), read_only=False)
+        logging.info(f"   🧱 Compactación a archivo nuevo, series ordenadas por {CLUSTER_ORDER} ({time.time() - t_start:.1f}s)")
+
+    # --------------------------------------------------------------------------
+    # Orquestación
+    # --------------------------------------------------------------------------
+
+    def checkpoint(self):
+        """Vacía el WAL al archivo y recalcula estadísticas (los bloques libres se reutilizan, no se devuelven)."""
+        self.db.conn.execute("CHECKPOINT")
+        self.db.conn.execute("VACUUM ANALYZE")
+
+    def run(self, retention: Dict[str, int], budget_mb: Optional[float] = None,
+            compact: bool = True, dry_run: bool = False) -> Dict[str, object]:
+        """Corrida completa. Devuelve resumen (bytes antes / después, velas borradas por tf)."""
+        before = self.size()
+        logging.info(
+            f"   💾 Antes: archivo {before['file_bytes'] / 1e6:.1f} MB "
+            f"(usado {before['used_bytes'] / 1e6:.1f} MB, libre {before['free_bytes'] / 1e6:.1f} MB, WAL {before['wal_bytes'] / 1e6:.1f} MB)"
+        )
+
+        effective = self.budget_retention(retention, budget_mb, compact=compact)
+        deleted = self.prune(effective, dry_run=dry_run)
+        if dry_run:
+            logging.info(f"   🔍 Dry run: se borrarían {deleted} velas, sin compactación")
+            return {"retention": effective, "deleted": deleted, "before": before, "after": before}
+
+        if compact:
+            self.compact()
+        self.checkpoint()
+
+        after = self.size()
+        self.record()
+        logging.info(
+            f"   💾 Después: archivo {after['file_bytes'] / 1e6:.1f} MB "
+            f"(usado {after['used_bytes'] / 1e6:.1f} MB, libre {after['free_bytes'] / 1e6:.1f} MB)"
+        )
+        return {"retention": effective, "deleted": deleted, "before": before, "after": after}
+
+if __name__ == "__main__":
+    db = Database()
+    m = StorageMaintenance(db)
+    print(m.size())
+    print(m.row_counts())
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import duckdb
+import pandas as pd
+
+# Formato único que devuelve cualquier proveedor (lo que espera Database.upsert_ohlcv)
+OHLCV_COLUMNS = ["ticker", "date", "open", "high", "low", "close", "volume"]
+
+# Extensiones que entiende el proveedor de replay, en orden de preferencia
+REPLAY_FORMATS = ["parquet", "csv"]
+
+def empty_frame() -> pd.DataFrame:
+    return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+def period_start(period: str, now: Optional[datetime] = None) -> str:
+    """Convierte un periodo estilo Yahoo ('10y', '730d', '6mo') en fecha de inicio YYYY-MM-DD."""
+    now = now or datetime.now()
+    m = re.fullmatch(r"(\d+)(d|mo|y)", period or "")
+    if not m:
+        return "2000-01-01"
+    n, unit = int(m.group(1)), m.group(2)
+    days = {"d": 1, "mo": 31, "y": 366}[unit] * n
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d')
+
+def normalize_frame(data: pd.DataFrame, tickers: List[str], timeframe: str) -> pd.DataFrame:
+    """
+    Normalización única de velas (antes duplicada en Collector y force_full_sync):
+    - Wide de Yahoo (MultiIndex Price x Ticker) o plano de un ticker -> formato largo con columna 'ticker'.
+    - Columnas en minúsculas, 'datetime' -> 'date', fechas naive en UTC; 1d normalizado a medianoche.
+    - Se descartan filas sin precio (tickers sin vela en ese timestamp dentro de un batch mixto).
+    """
+    if data is None or data.empty:
+        return empty_frame()
+
+    if isinstance(data.columns, pd.MultiIndex) and len(tickers) > 1:
+        # Multiples tickers: Columns Level 0 = Price, Level 1 = Ticker -> stack del nivel Ticker
+        try:
+            df = data.stack(level=1, future_stack=True)
+        except TypeError:
+            # Compatibilidad pandas viejos
+            df = data.stack(level=1)
+        df = df.reset_index()
+        df.columns = [str(c).lower() for c in df.columns]
+    else:
+        # Un solo ticker puede venir como MultiIndex (Price, Ticker): eliminamos el nivel de Ticker
+        if isinstance(data.columns, pd.MultiIndex):
+            try:
+                data = data.xs(tickers[0], level=1, axis=1)
+            except KeyError:
+                data = data.droplevel(1, axis=1)
+        df = data.copy().reset_index()
+        df.columns = [str(c[0] if isinstance(c, tuple) else c).lower() for c in df.columns]
+        df['ticker'] = tickers[0]
+
+    if 'date' not in df.columns and 'datetime' in df.columns:
+        df = df.rename(columns={'datetime': 'date'})
+    if 'date' not in df.columns:
+        logging.error("❌ Datos ignorados: No se encontró columna 'date' tras normalizar.")
+        return empty_frame()
+
+    df['date'] = pd.to_datetime(df['date'])
+    if isinstance(df['date'].dtype, pd.DatetimeTZDtype):
+        df['date'] = df['date'].dt.tz_convert("UTC").dt.tz_localize(None)
+    # FIX DUPLICADOS 1D: Normalizar a medianoche
+    if timeframe == '1d':
+        df['date'] = df['date'].dt.normalize()
+
+    for col in OHLCV_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df.dropna(subset=['open', 'high', 'low', 'close'], how='all')
+    return df[OHLCV_COLUMNS].reset_index(drop=True)
+
+class MarketDataProvider(ABC):
+    """
+    Interfaz de proveedor de velas. `fetch` devuelve siempre el formato largo de OHLCV_COLUMNS
+    (fechas naive UTC) o un DataFrame vacío; el Collector y las herramientas no conocen al proveedor.
+    """
+    name = "base"
+
+    @abstractmethod
+    def fetch(self, tickers: List[str], timeframe: str, start: Optional[str] = None,
+              end: Optional[str] = None, period: Optional[str] = None) -> pd.DataFrame:
+        """Velas de `tickers` en [start, end) o del último `period` ('10y', '730d')."""
+
+    @abstractmethod
+    def fetch_info(self, ticker: str) -> Dict[str, Any]:
+        """
+        Ficha del ticker: {"info": dict estilo Yahoo (name, sector, currency, fundamentales...),
+        "next_earnings": Timestamp naive UTC o None}. Dict vacío si el proveedor no tiene datos.
+        """
+
+class YFinanceProvider(MarketDataProvider):
+    """Yahoo Finance vía yfinance (auto_adjust=True: precios ajustados por splits y dividendos)."""
+    name = "yfinance"
+
+    INTERVALS = {"1d": "1d", "1h": "1h", "15m": "15m", "5m": "5m"}
+
+    def fetch(self, tickers: List[str], timeframe: str, start: Optional[str] = None,
+              end: Optional[str] = None, period: Optional[str] = None) -> pd.DataFrame:
+        import yfinance as yf
+
+        interval = self.INTERVALS.get(timeframe)
+        if not interval:
+            logging.error(f"❌ Timeframe no soportado: {timeframe}")
+            return empty_frame()
+
+        kwargs = {"period": period} if period and not start else {"start": start, "end": end}
+        data = yf.download(tickers, interval=interval, auto_adjust=True, threads=False, progress=False, **kwargs)
+        return normalize_frame(data, tickers, timeframe)
+
+    def fetch_info(self, ticker: str) -> Dict[str, Any]:
+        import yfinance as yf
+
+        yt = yf.Ticker(ticker)
+        info = yt.get_info() or {}
+        if not info or len(info) <= 1:
+            return {}
+        return {"info": info, "next_earnings": self._next_earnings(yt, info)}
+
+    @staticmethod
+    def _next_earnings(yt, info: Dict[str, Any]) -> Optional[pd.Timestamp]:
+        """Próximo earnings: timestamps de `info` (sin llamada extra) y si no, el calendario (como svc.collector.GetTickerInfo)."""
+        now = pd.Timestamp.now(tz="UTC")
+        for key in ("earningsTimestampStart", "earningsTimestamp"):
+            ts = pd.to_datetime(info.get(key), unit="s", errors="coerce", utc=True)
+            if pd.notna(ts) and ts >= now:
+                return ts.tz_localize(None)
+
+        try:
+            cal = yt.calendar
+            val = None
+            if isinstance(cal, dict):
+                val = cal.get("Earnings Date")
+            elif isinstance(cal, pd.DataFrame):
+                if "Earnings Date" in cal.index:
+                    val = cal.loc["Earnings Date"].iloc[0]
+                elif "Earnings Date" in cal.columns:
+                    val = cal["Earnings Date"].iloc[0]
+            elif isinstance(cal, pd.Series):
+                val = cal.get("Earnings Date")
+            if isinstance(val, (list, tuple)):
+                val = val[0] if val else None
+            ts = pd.to_datetime(val, errors="coerce", utc=True)
+            if pd.notna(ts) and ts >= now.normalize():
+                return ts.tz_localize(None)
+        except Exception as e:
+            logging.debug(f"Calendario no disponible para {yt.ticker}: {e}")
+        return None
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Replay offline desde disco: `{root}/{timeframe}/{ticker}.parquet` (o `.csv`) con columnas
+    date, open, high, low, close, volume. Permite correr el pipeline completo sin red
+    (benchmarks, CI, desarrollo). `tools/export_replay.py` genera los archivos desde la DB.
+    Fichas opcionales en `{root}/info/{ticker}.json` con el mismo formato que `fetch_info`.
+    """
+    name = "replay"
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path_for(self, ticker: str, timeframe: str, fmt: str = "parquet") -> Path:
+        return self.root / timeframe / f"{ticker}.{fmt}"
+
+    def fetch(self, tickers: List[str], timeframe: str, start: Optional[str] = None,
+              end: Optional[str] = None, period: Optional[str] = None) -> pd.DataFrame:
+        if period and not start:
+            start = period_start(period)
+
+        sources = []
+        for t in tickers:
+            path = next((p for p in (self.path_for(t, timeframe, f) for f in REPLAY_FORMATS) if p.exists()), None)
+            if path is None:
+                continue
+            reader = "read_parquet" if path.suffix == ".parquet" else "read_csv_auto"
+            safe_ticker = t.replace("'", "''")
+            safe_path = str(path).replace("'", "''")
+            sources.append(
+                f"SELECT '{safe_ticker}' AS ticker, date::TIMESTAMP AS date, open, high, low, close, volume "
+                f"FROM {reader}('{safe_path}')"
+            )
+        if not sources:
+            return empty_frame()
+
+        filters = []
+        if start:
+            filters.append(f"date >= TIMESTAMP '{start}'")
+        if end:
+            filters.append(f"date < TIMESTAMP '{end}'")
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+
+        with duckdb.connect() as con:
+            # Fechas con zona horaria en los archivos -> naive UTC, igual que yfinance normalizado
+            con.execute("SET TimeZone = 'UTC'")
+            df = con.execute(f"SELECT * FROM ({' UNION ALL '.join(sources)}) {where} ORDER BY ticker, date").df()
+
+        if timeframe == '1d':
+            df['date'] = df['date'].dt.normalize()
+        return df.dropna(subset=['open', 'high', 'low', 'close'], how='all')[OHLCV_COLUMNS].reset_index(drop=True)
+
+    def fetch_info(self, ticker: str) -> Dict[str, Any]:
+        path = self.root / "info" / f"{ticker}.json"
+        if not path.exists():
+            return {}
+        payload = json.loads(path.read_text())
+        earnings = pd.to_datetime(payload.get("next_earnings"), errors="coerce")
+        return {"info": payload.get("info") or {}, "next_earnings": None if pd.isna(earnings) else earnings}
+
+def get_provider(name: Optional[str] = None) -> MarketDataProvider:
+    """
+    Proveedor configurado: argumento > env MARKET_DATA_PROVIDER > settings (data.provider) > yfinance.
+    El replay lee de env REPLAY_PATH > settings (data.replay_path).
+    """
+    provider, replay_path = "yfinance", "data/replay"
+    try:
+        from svc_v2.config_loader import load_settings
+        cfg = load_settings()
+        provider, replay_path = cfg.data.provider, cfg.data.replay_path
+    except Exception as e:
+        logging.debug(f"Settings no disponibles para el proveedor de datos: {e}")
+
+    name = name or os.environ.get("MARKET_DATA_PROVIDER") or provider
+    if name == ReplayProvider.name:
+        root = os.environ.get("REPLAY_PATH") or replay_path
+        logging.info(f"📼 Proveedor de velas: replay ({root})")
+        return ReplayProvider(root)
+    if name != YFinanceProvider.name:
+        logging.warning(f"⚠️ Proveedor desconocido '{name}', usando yfinance")
+    return YFinanceProvider()
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+import pandas as pd
+from svc_v2.db import Database
+from svc_v2.market_data import MarketDataProvider, get_provider
+from svc_v2.fundamentals import FundamentalsStore, fundamentals_from_info
+
+# Ficha (nombre, sector, divisa, earnings) vigente por esta cantidad de días
+METADATA_TTL_DAYS = 7
+
+# Pool acotado + tope de llamadas por segundo al proveedor (una ficha = 1-2 requests a Yahoo)
+MAX_WORKERS = 8
+MAX_CALLS_PER_SEC = 4.0
+
+# Filas acumuladas antes de escribir (si el job se corta, lo ya bajado queda guardado)
+FLUSH_EVERY = 100
+
+METADATA_COLUMNS = ["ticker", "name", "sector", "industry", "currency", "asset_type", "next_earnings"]
+
+class RateLimiter:
+    """Espaciado mínimo entre llamadas compartido por todos los hilos (1 / rate segundos)."""
+
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+def asset_type_from_info(info: Dict[str, Any]) -> Optional[str]:
+    """Tipo de activo (Stock, ETF, FIBRA, Fund...), misma regla que svc.collector._asset_from_info."""
+    qt = (info.get("quoteType") or "").upper()
+    ind = (info.get("industry") or "").upper()
+    nm = (info.get("displayName") or info.get("longName") or info.get("shortName") or "").upper()
+    if "REIT" in ind or "FIBRA" in nm:
+        return "FIBRA"
+    if qt == "ETF":
+        return "ETF"
+    if qt in ("MUTUALFUND", "FUND"):
+        return "Fund"
+    if qt == "EQUITY":
+        return "Stock"
+    return qt or None
+
+def metadata_from_info(ticker: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Ficha del proveedor -> fila de ticker_metadata (None = no pisar lo guardado)."""
+    info = payload.get("info") or {}
+    name = (info.get("displayName") or info.get("longName") or info.get("shortName") or "").strip()
+    currency = (info.get("currency") or "").strip()
+    return {
+        "ticker": ticker,
+        "name": name or None,
+        "sector": info.get("sector") or None,
+        "industry": info.get("industry") or None,
+        # Monedas en subunidad ('GBp', 'ZAc') no se guardan: precios x100, mejor inferir del símbolo
+        "currency": currency if currency.isupper() else None,
+        "asset_type": asset_type_from_info(info),
+        "next_earnings": payload.get("next_earnings"),
+    }
+
+class MetadataSync:
+    """
+    Refresco de ticker_metadata guiado por antigüedad: solo se piden las fichas sin sincronizar, más viejas
+    que el TTL o cuyo earnings ya pasó, más las que tienen fundamentales vencidos (misma ficha de Yahoo).
+    Las descargas corren en un pool acotado con rate limit compartido; las escrituras se hacen en el hilo
+    principal en bloques (upsert masivo en ticker_metadata + snapshot en fundamentals).
+    """
+
+    def __init__(self, db: Database, provider: MarketDataProvider = None):
+        self.db = db
+        self.provider = provider or get_provider()
+        self.limiter = RateLimiter(MAX_CALLS_PER_SEC)
+        self.fundamentals = FundamentalsStore(db)
+
+    def stale(self, tickers: List[str], ttl_days: int = METADATA_TTL_DAYS) -> List[str]:
+        """Tickers cuya ficha hay que refrescar."""
+        if not tickers:
+            return []
+        in_list = ",".join([f"'{t}'" for t in tickers])
+        fresh = self.db.conn.execute(f"""
+            SELECT ticker FROM ticker_metadata
+            WHERE ticker IN ({in_list})
+              AND metadata_synced_at::DATE > current_date - {int(ttl_days)}
+              AND (next_earnings IS NULL OR next_earnings >= current_date)
+        """).fetchall()
+        fresh = {r[0] for r in fresh}
+        return [t for t in tickers if t not in fresh]
+
+    def refresh(self, tickers: List[str], force: bool = False, ttl_days: int = METADATA_TTL_DAYS) -> Dict[str, int]:
+        """Descarga y guarda las fichas vencidas (todas con force). Devuelve conteos ok / empty / error."""
+        tickers = list(dict.fromkeys(tickers))
+        if force:
+            pending = tickers
+        else:
+            due = set(self.stale(tickers, ttl_days)) | set(self.fundamentals.due(tickers))
+            pending = [t for t in tickers if t in due]
+        stats = {"requested": len(pending), "ok": 0, "empty": 0, "error": 0}
+        if not pending:
+            logging.info("   🗂️ Metadata al día, nada que refrescar.")
+            return stats
+
+        logging.info(f"   🗂️ Refrescando metadata de {len(pending)}/{len(tickers)} tickers ({MAX_WORKERS} hilos, {MAX_CALLS_PER_SEC}/s)...")
+        t_start = time.time()
+        rows: List[Dict[str, Any]] = []
+        fund_rows: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            futures = {pool.submit(self._fetch_one, t): t for t in pending}
+            for n, fut in enumerate(as_completed(futures), start=1):
+                ticker = futures[fut]
+                try:
+                    payload = fut.result()
+                except Exception as e:
+                    stats["error"] += 1
+                    logging.debug(f"      ❌ {ticker}: {e}")
+                    continue
+                if not payload:
+                    stats["empty"] += 1
+                    continue
+                stats["ok"] += 1
+                rows.append(metadata_from_info(ticker, payload))
+                fund_rows.append(fundamentals_from_info(ticker, payload))
+                if len(rows) >= FLUSH_EVERY:
+                    self.save(rows)
+                    self.fundamentals.save(fund_rows)
+                    rows, fund_rows = [], []
+                    logging.info(f"      💾 {n}/{len(pending)} fichas ({time.time() - t_start:.0f}s)")
+        self.save(rows)
+        self.fundamentals.save(fund_rows)
+
+        logging.info(
+            f"   ✅ Metadata: {stats['ok']} ok, {stats['empty']} vacías, {stats['error']} con error "
+            f"({time.time() - t_start:.1f}s)"
+        )
+        return stats
+
+    def _fetch_one(self, ticker: str) -> Dict[str, Any]:
+        self.limiter.wait()
+        return self.provider.fetch_info(ticker)
+
+    def save(self, rows: List[Dict[str, Any]]):
+        """Upsert masivo en ticker_metadata (COALESCE: un campo vacío no borra lo guardado)."""
+        if not rows:
+            return
+        df = pd.DataFrame(rows, columns=METADATA_COLUMNS)
+        df["next_earnings"] = pd.to_datetime(df["next_earnings"], errors="coerce")
+        self.db.conn.register("meta_new", df)
+        try:
+            self.db.conn.execute("""
+                INSERT INTO ticker_metadata (ticker, name, sector, industry, currency, asset_type, next_earnings, updated_at, metadata_synced_at)
+                SELECT ticker, name, sector, industry, currency, asset_type, next_earnings::TIMESTAMP, now(), now()
+                FROM meta_new
+                ON CONFLICT (ticker) DO UPDATE SET
+                    name = COALESCE(EXCLUDED.name, ticker_metadata.name),
+                    sector = COALESCE(EXCLUDED.sector, ticker_metadata.sector),
+                    industry = COALESCE(EXCLUDED.industry, ticker_metadata.industry),
+                    currency = COALESCE(EXCLUDED.currency, ticker_metadata.currency),
+                    asset_type = COALESCE(EXCLUDED.asset_type, ticker_metadata.asset_type),
+                    -- Earnings sí se pisa con NULL: si ya pasó y no hay fecha nueva, no debe seguir en el reporte
+                    next_earnings = EXCLUDED.next_earnings,
+                    updated_at = now(),
+                    metadata_synced_at = now();
+            """)
+        finally:
+            self.db.conn.unregister("meta_new")
+
+if __name__ == "__main__":
+    db = Database()
+    print(MetadataSync(db).stale(["AAPL", "MSFT"]))
@@ -1,4 +1,3 @@
-import requests
 import logging
 import os
 from datetime import datetime, timedelta
@@ -71,6 +70,7 @@ class Notifier:
                 return
 
         try:
+            import requests  # Solo al enviar: el job no paga el import si no hay señales
             payload = {"content": message}
             response = requests.post(self.discord_url, json=payload, timeout=10)
             
@@ -118,6 +118,7 @@ class Notifier:
 
         # 3. Enviar y Loguear cada una
         try:
+            import requests
             payload = {"content": msg}
             response = requests.post(self.discord_url, json=payload, timeout=10)
             
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Umbral de statement lento en ms (env SLOW_QUERY_MS; 0 = sin registro)
+SLOW_QUERY_MS = 1000
+
+# Por sitio + query, un EXPLAIN ANALYZE como mucho cada tanto (re-ejecutar duplica el costo del statement)
+PROFILE_COOLDOWN_SEC = 3600
+
+# Perfiles que se conservan en query_profiles
+PROFILE_RETENTION_DAYS = 30
+
+# Frames del proyecto que se guardan como sitio de llamada (el más cercano primero)
+CALL_SITE_DEPTH = 3
+
+# Solo se re-ejecutan con EXPLAIN ANALYZE las lecturas: un statement con escrituras no se repite nunca
+READ_PREFIX = re.compile(r"^\s*(SELECT|WITH|FROM)\b", re.IGNORECASE)
+WRITE_KEYWORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|CREATE|DROP|ALTER|COPY|ATTACH|CHECKPOINT|VACUUM)\b", re.IGNORECASE)
+
+# Métodos del resultado que materializan la consulta (execute() de una lectura puede ser streaming)
+FETCH_METHODS = {"df", "fetchdf", "fetch_df", "fetchall", "fetchone", "fetchmany", "fetchnumpy",
+                 "arrow", "fetch_arrow_table", "pl"}
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Estado por proceso: {(sitio, hash): {"last": monotonic del último perfil, "count": lentos desde entonces}}
+_recent: Dict[tuple, Dict[str, float]] = {}
+_recent_lock = threading.Lock()
+
+def slow_query_ms() -> float:
+    env = os.environ.get("SLOW_QUERY_MS")
+    try:
+        return float(env) if env is not None else SLOW_QUERY_MS
+    except ValueError:
+        return SLOW_QUERY_MS
+
+def is_read(query: str) -> bool:
+    return bool(READ_PREFIX.match(query)) and not WRITE_KEYWORDS.search(query)
+
+def call_site(depth: int = CALL_SITE_DEPTH) -> str:
+    """'screener.py:_screen:145 < api.py:get_screener:530' (frames del proyecto fuera de este módulo)."""
+    frames = []
+    frame = sys._getframe(1)
+    while frame and len(frames) < depth:
+        path = Path(frame.f_code.co_filename)
+        if path.name != "profiling.py" and PROJECT_ROOT in path.parents:
+            frames.append(f"{path.name}:{frame.f_code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return " < ".join(frames) or "?"
+
+class ProfiledConnection:
+    """
+    Envoltura de la conexión DuckDB que usa Database: cada execute() se cronometra (incluyendo el primer
+    fetch, donde se materializa una lectura streaming) y se etiqueta con su sitio de llamada. Lo que
+    pase del umbral se registra en query_profiles con el EXPLAIN ANALYZE de la consulta.
+    Todo lo demás (register, cursor, close...) pasa directo a la conexión.
+    """
+
+    def __init__(self, conn, db):
+        self._conn = conn
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, query: str, parameters=None):
+        t_start = time.perf_counter()
+        res = self._conn.execute(query) if parameters is None else self._conn.execute(query, parameters)
+        if is_read(query):
+            return ProfiledResult(res, self, query, parameters, t_start)
+        self._check(query, parameters, (time.perf_counter() - t_start) * 1000)
+        return res
+
+    def _check(self, query: str, parameters, elapsed_ms: float):
+        threshold = slow_query_ms()
+        if threshold <= 0 or elapsed_ms < threshold:
+            return
+        # El sitio se resuelve solo para los lentos (el fetch ocurre en la misma función que el execute)
+        site = call_site()
+        logging.warning(f"🐢 Query lenta ({elapsed_ms:.0f} ms) en {site}")
+        try:
+            self._capture(query, parameters, site, elapsed_ms)
+        except Exception as e:
+            logging.debug(f"No se pudo registrar el perfil de {site}: {e}")
+
+    def _capture(self, query: str, parameters, site: str, elapsed_ms: float):
+        sql_hash = hashlib.sha1(query.encode()).hexdigest()[:16]
+        key = (site, sql_hash)
+        now = time.monotonic()
+        with _recent_lock:
+            entry = _recent.setdefault(key, {"last": None, "count": 0})
+            entry["count"] += 1
+            if entry["last"] is not None and now - entry["last"] < PROFILE_COOLDOWN_SEC:
+                return
+            occurrences, entry["last"], entry["count"] = entry["count"], now, 0
+
+        profile = None
+        if is_read(query):
+            # Cursor aparte: el resultado pendiente del caller sigue intacto
+            try:
+                cur = self._conn.cursor()
+                sql = f"EXPLAIN ANALYZE {query}"
+                rows = cur.execute(sql).fetchall() if parameters is None else cur.execute(sql, parameters).fetchall()
+                profile = "\n".join(str(r[-1]) for r in rows)
+            except Exception as e:
+                profile = f"(EXPLAIN ANALYZE falló: {e})"
+
+        self._db.record_query_profile({
+            "call_site": site,
+            "sql_hash": sql_hash,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "occurrences": occurrences,
+            "process": Path(sys.argv[0]).name if sys.argv and sys.argv[0] else None,
+            "query": query.strip(),
+            "params": json.dumps(parameters, default=str) if parameters is not None else None,
+            "profile": profile,
+        })
+
+class ProfiledResult:
+    """Resultado de una lectura: el tiempo se cierra en el primer fetch (execute + materialización)."""
+
+    def __init__(self, conn, profiled: ProfiledConnection, query: str, parameters, t_start: float):
+        self._conn = conn
+        self._profiled = profiled
+        self._pending = (query, parameters, t_start)
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in FETCH_METHODS or self._pending is None:
+            return attr
+
+        def timed(*args, **kwargs):
+            out = attr(*args, **kwargs)
+            if self._pending is not None:
+                query, parameters, t_start = self._pending
+                self._pending = None
+                self._profiled._check(query, parameters, (time.perf_counter() - t_start) * 1000)
+            return out
+        return timed
+
+def save_query_profile(conn, payload: Dict[str, Any]) -> Optional[int]:
+    """Inserta un perfil en query_profiles (y recorta los más viejos que la retención)."""
+    profile_id = conn.execute("""
+        INSERT INTO query_profiles (call_site, sql_hash, elapsed_ms, occurrences, process, query, params, profile)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    """, [payload.get("call_site"), payload.get("sql_hash"), payload.get("elapsed_ms"), payload.get("occurrences"),
+          payload.get("process"), payload.get("query"), payload.get("params"), payload.get("profile")]).fetchone()[0]
+    conn.execute(f"DELETE FROM query_profiles WHERE captured_at < now() - INTERVAL {PROFILE_RETENTION_DAYS} DAY")
+    return int(profile_id)
@@ -0,0 +1,133 @@
+import logging
+import time
+from typing import List
+from svc_v2.db import Database
+
+# Benchmark por mercado: tickers .MX contra el IPC, el resto contra el S&P 500
+BENCHMARK_US = "^GSPC"
+BENCHMARK_MX = "^MXX"
+
+# Ventanas (en velas) para el retorno relativo
+RS_LOOKBACKS = [20, 60]
+
+# Indicadores que se rankean contra el universo (percentil 0-100 por vela)
+RANK_FIELDS = ["rsi", "adx", "vol_k"]
+
+# Columnas que expone la tabla (las consume el Screener / API)
+RS_FIELDS = (
+    [f"ret_{n}" for n in RS_LOOKBACKS]
+    + [f"rs_bench_{n}" for n in RS_LOOKBACKS]
+    + [f"rs_sector_{n}" for n in RS_LOOKBACKS]
+    + [f"pct_ret_{n}" for n in RS_LOOKBACKS]
+    + [f"pct_{f}" for f in RANK_FIELDS]
+)
+
+# Historia extra a leer para que los lag() de la primera vela recalculada estén completos
+BUFFER_DAYS = {"1d": 120, "1h": 30, "15m": 10}
+
+# Velas ya calculadas que se vuelven a rankear (llegan tickers tarde a la misma vela)
+RECOMPUTE_OVERLAP_DAYS = 3
+
+class RelativeStrengthEngine:
+    """
+    Etapa batch posterior al Analyzer. Por timeframe y vela calcula, en SQL set-based:
+    - Retorno relativo vs benchmark (^GSPC / ^MXX) y vs la mediana de su sector.
+    - Percentiles cross-sectional del universo (retornos e indicadores clave).
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def compute(self, timeframes: List[str], force_full: bool = False):
+        for tf in timeframes:
+            t_start = time.time()
+            start = None if force_full else self._resume_from(tf)
+            n = self._compute_tf(tf, start)
+            logging.info(f"📐 Relative Strength [{tf}]: {n} filas ({time.time() - t_start:.2f}s)")
+
+    def _resume_from(self, tf: str):
+        res = self.db.conn.execute(
+            f"SELECT MAX(timestamp) - INTERVAL {RECOMPUTE_OVERLAP_DAYS} DAY FROM relative_strength WHERE timeframe = ?",
+            [tf]
+        ).fetchone()
+        return res[0] if res else None
+
+    def _compute_tf(self, tf: str, start) -> int:
+        buffer_days = BUFFER_DAYS.get(tf, 120)
+        if start is not None:
+            read_cond = f"timestamp >= TIMESTAMP '{start}' - INTERVAL {buffer_days} DAY"
+            write_cond = f"timestamp >= TIMESTAMP '{start}'"
+        else:
+            read_cond = write_cond = "TRUE"
+
+        ret_cols = [f"close / NULLIF(lag(close, {n}) OVER w, 0) - 1 AS ret_{n}" for n in RS_LOOKBACKS]
+        bench_cols = [f"(p.ret_{n} - b.ret_{n}) * 100 AS rs_bench_{n}" for n in RS_LOOKBACKS]
+        sector_cols = [
+            f"CASE WHEN sector IS NOT NULL THEN "
+            f"(ret_{n} - median(ret_{n}) OVER (PARTITION BY timestamp, sector)) * 100 END AS rs_sector_{n}"
+            for n in RS_LOOKBACKS
+        ]
+        # Nulos fuera del ranking: se particiona por (x IS NULL) y se descarta ese grupo
+        ranked = [f"ret_{n}" for n in RS_LOOKBACKS] + RANK_FIELDS
+        pct_cols = [
+            f"CASE WHEN {col} IS NOT NULL THEN percent_rank() OVER "
+            f"(PARTITION BY timestamp, {col} IS NULL ORDER BY {col}) * 100 END AS pct_{col}"
+            for col in ranked
+        ]
+
+        self.db.conn.execute("BEGIN TRANSACTION")
+        try:
+            self.db.conn.execute(f"DELETE FROM relative_strength WHERE timeframe = '{tf}' AND {write_cond}")
+            self.db.conn.execute(f"""
+                INSERT INTO relative_strength (ticker, timeframe, timestamp, benchmark, {', '.join(RS_FIELDS)}, updated_at)
+                WITH px AS (
+                    SELECT ticker, timestamp, close, {', '.join(ret_cols)}
+                    FROM ohlcv
+                    WHERE timeframe = '{tf}' AND {read_cond}
+                    WINDOW w AS (PARTITION BY ticker ORDER BY timestamp)
+                ),
+                bench AS (
+                    SELECT * FROM px WHERE ticker IN ('{BENCHMARK_US}', '{BENCHMARK_MX}')
+                ),
+                base AS (
+                    SELECT ticker, timestamp,
+                           CASE WHEN ticker LIKE '%.MX' OR ticker = '{BENCHMARK_MX}'
+                                THEN '{BENCHMARK_MX}' ELSE '{BENCHMARK_US}' END AS benchmark,
+                           {', '.join([f"ret_{n}" for n in RS_LOOKBACKS])}
+                    FROM px
+                    WHERE {write_cond}
+                ),
+                with_bench AS (
+                    -- ASOF: el benchmark puede no tener vela ese día (feriados de cada mercado)
+                    SELECT p.*, {', '.join(bench_cols)}
+                    FROM base p
+                    ASOF LEFT JOIN bench b ON p.benchmark = b.ticker AND p.timestamp >= b.timestamp
+                ),
+                enriched AS (
+                    SELECT w.*, m.sector, {', '.join([f"i.{f}" for f in RANK_FIELDS])}
+                    FROM with_bench w
+                    LEFT JOIN ticker_metadata m ON w.ticker = m.ticker
+                    LEFT JOIN indicators i
+                           ON i.ticker = w.ticker AND i.timeframe = '{tf}' AND i.timestamp = w.timestamp
+                )
+                SELECT ticker, '{tf}' AS timeframe, timestamp, benchmark,
+                       {', '.join([f"ret_{n} * 100" for n in RS_LOOKBACKS])},
+                       {', '.join([f"rs_bench_{n}" for n in RS_LOOKBACKS])},
+                       {', '.join(sector_cols)},
+                       {', '.join(pct_cols)},
+                       now()
+                FROM enriched
+            """)
+            self.db.conn.execute("COMMIT")
+        except Exception:
+            self.db.conn.execute("ROLLBACK")
+            raise
+
+        res = self.db.conn.execute(
+            f"SELECT count(*) FROM relative_strength WHERE timeframe = '{tf}' AND {write_cond}"
+        ).fetchone()
+        return res[0] if res else 0
+
+if __name__ == "__main__":
+    db = Database()
+    RelativeStrengthEngine(db).compute(["1d"])
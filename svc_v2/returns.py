@@ -0,0 +1,155 @@
+import logging
+import time
+from typing import List, Optional
+from svc_v2.db import Database
+
+# Offsets en sesiones (días de mercado) y en velas del propio timeframe
+SESSION_OFFSETS = [1, 2, 3, 5]
+BAR_OFFSETS = [1, 4]
+
+# Ventana de historia necesaria por ticker (cubre 5 sesiones + viernes anterior con feriados)
+LOOKBACK_DAYS = 21
+
+class ReturnsEngine:
+    """
+    Mantiene la tabla `returns`: una fila por (ticker, timeframe) con variaciones
+    multi-horizonte sobre la última vela. Se actualiza solo para tickers con velas nuevas,
+    así la API y el screener leen columnas ya calculadas en vez de escanear ohlcv completo.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def refresh(self, timeframes: List[str], tickers: Optional[List[str]] = None) -> int:
+        """Recalcula returns para los tickers cuya última vela (o updated_at) cambió. Devuelve filas escritas."""
+        total = 0
+        for tf in timeframes:
+            t_start = time.time()
+            stale = self._stale_tickers(tf, tickers)
+            if not stale:
+                continue
+            self._upsert(tf, stale)
+            total += len(stale)
+            logging.info(f"📊 Returns [{tf}]: {len(stale)} tickers actualizados ({time.time() - t_start:.2f}s)")
+        return total
+
+    def _stale_tickers(self, tf: str, tickers: Optional[List[str]]) -> List[str]:
+        ticker_filter = ""
+        if tickers:
+            ticker_filter = "AND ticker IN (" + ",".join([f"'{t}'" for t in tickers]) + ")"
+
+        rows = self.db.conn.execute(f"""
+            WITH latest AS (
+                SELECT ticker, MAX(timestamp) as last_ts, MAX(updated_at) as last_upd
+                FROM ohlcv
+                WHERE timeframe = '{tf}' {ticker_filter}
+                GROUP BY ticker
+            )
+            SELECT l.ticker
+            FROM latest l
+            LEFT JOIN returns r ON r.ticker = l.ticker AND r.timeframe = '{tf}'
+            WHERE r.ticker IS NULL
+               OR l.last_ts > r.timestamp
+               OR l.last_upd > r.updated_at
+        """).fetchall()
+        return [r[0] for r in rows]
+
+    def _upsert(self, tf: str, tickers: List[str]):
+        tickers_sql = ",".join([f"('{t}')" for t in tickers])
+
+        session_cols = [f"max(close) FILTER (WHERE back = {n}) AS s{n}" for n in SESSION_OFFSETS]
+        bar_cols = [f"max(close) FILTER (WHERE back = {n}) AS b{n}" for n in BAR_OFFSETS]
+        chg_cols = (
+            [f"(c.close / NULLIF(s.s{n}, 0) - 1) * 100 AS chg_{n}d" for n in SESSION_OFFSETS]
+            + [f"(c.close / NULLIF(b.b{n}, 0) - 1) * 100 AS chg_{n}b" for n in BAR_OFFSETS]
+        )
+        out_cols = [f"chg_{n}d" for n in SESSION_OFFSETS] + [f"chg_{n}b" for n in BAR_OFFSETS]
+
+        query = f"""
+            INSERT INTO returns (ticker, timeframe, timestamp, close, {', '.join(out_cols)}, chg_fri, chg_prev_fri, updated_at)
+            WITH targets AS (
+                SELECT * FROM (VALUES {tickers_sql}) AS t(ticker)
+            ),
+            last AS (
+                SELECT o.ticker, MAX(o.timestamp) as last_ts
+                FROM ohlcv o
+                JOIN targets t ON o.ticker = t.ticker
+                WHERE o.timeframe = '{tf}'
+                GROUP BY o.ticker
+            ),
+            bars AS (
+                SELECT o.ticker, o.timestamp, o.close
+                FROM ohlcv o
+                JOIN last l ON o.ticker = l.ticker
+                WHERE o.timeframe = '{tf}'
+                  AND o.timestamp >= l.last_ts - INTERVAL {LOOKBACK_DAYS} DAY
+            ),
+            -- Cierre de cada sesión = última vela del día (en 1d es la propia vela)
+            sessions AS (
+                SELECT ticker, timestamp::DATE as d, arg_max(close, timestamp) as close
+                FROM bars
+                GROUP BY ticker, timestamp::DATE
+            ),
+            session_back AS (
+                SELECT ticker, d, close,
+                       row_number() OVER (PARTITION BY ticker ORDER BY d DESC) - 1 as back
+                FROM sessions
+            ),
+            session_pivot AS (
+                SELECT ticker, {', '.join(session_cols)}
+                FROM session_back
+                GROUP BY ticker
+            ),
+            -- Viernes: dayofweek=5. fri_rank 1 = último viernes (puede ser hoy), 2 = el anterior
+            fridays AS (
+                SELECT ticker,
+                       max(close) FILTER (WHERE fri_rank = 1) as last_fri,
+                       max(close) FILTER (WHERE fri_rank = 2) as prev_fri
+                FROM (
+                    SELECT ticker, close,
+                           row_number() OVER (PARTITION BY ticker ORDER BY d DESC) as fri_rank
+                    FROM sessions
+                    WHERE dayofweek(d) = 5
+                )
+                GROUP BY ticker
+            ),
+            bar_back AS (
+                SELECT ticker, timestamp, close,
+                       row_number() OVER (PARTITION BY ticker ORDER BY timestamp DESC) - 1 as back
+                FROM bars
+            ),
+            bar_pivot AS (
+                SELECT ticker, {', '.join(bar_cols)}
+                FROM bar_back
+                GROUP BY ticker
+            ),
+            current AS (
+                SELECT ticker, timestamp, close FROM bar_back WHERE back = 0
+            )
+            SELECT
+                c.ticker,
+                '{tf}' as timeframe,
+                c.timestamp,
+                c.close,
+                {', '.join(chg_cols)},
+                (c.close / NULLIF(f.last_fri, 0) - 1) * 100 as chg_fri,
+                (c.close / NULLIF(f.prev_fri, 0) - 1) * 100 as chg_prev_fri,
+                now() as updated_at
+            FROM current c
+            LEFT JOIN session_pivot s ON c.ticker = s.ticker
+            LEFT JOIN bar_pivot b ON c.ticker = b.ticker
+            LEFT JOIN fridays f ON c.ticker = f.ticker
+            ON CONFLICT (ticker, timeframe) DO UPDATE SET
+                timestamp = EXCLUDED.timestamp,
+                close = EXCLUDED.close,
+                {', '.join([f"{c} = EXCLUDED.{c}" for c in out_cols])},
+                chg_fri = EXCLUDED.chg_fri,
+                chg_prev_fri = EXCLUDED.chg_prev_fri,
+                updated_at = EXCLUDED.updated_at;
+        """
+        self.db.conn.execute(query)
+
+if __name__ == "__main__":
+    db = Database()
+    n = ReturnsEngine(db).refresh(["1d"])
+    print(f"Returns actualizados: {n}")
@@ -0,0 +1,228 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+from svc_v2.db import Database
+from svc_v2.relative_strength import BENCHMARK_US, BENCHMARK_MX
+from svc_v2.fx import FxService, BASE_CURRENCY
+
+# Ventanas en sesiones (velas 1d)
+VOL_WINDOWS = [20, 60]
+RISK_WINDOW = 252          # Beta, VaR histórico y drawdown
+MIN_OBS = 20               # Menos observaciones que esto -> métrica NULL
+TRADING_DAYS = 252
+
+# Historia a leer (calendario) para cubrir RISK_WINDOW sesiones con feriados
+HISTORY_DAYS = 400
+
+# Fila agregada del portafolio dentro de portfolio_risk
+PORTFOLIO_KEY = "_PORTFOLIO_"
+
+RISK_COLUMNS = [
+    "benchmark", "value_mxn", "weight",
+    "vol_20", "vol_60", "beta", "corr_bench",
+    "var_95_mxn", "var_99_mxn", "es_95_mxn", "var_95_pct",
+    "max_drawdown", "drawdown", "n_obs",
+]
+
+class RiskEngine:
+    """
+    Etapa de riesgo posterior al broad scan. Para todas las posiciones abiertas a la vez
+    (matriz sesiones x tickers, sin loops por ticker) calcula volatilidad, beta vs su benchmark,
+    VaR / ES histórico en MXN y drawdown, más una fila agregada del portafolio.
+    El VaR usa retornos convertidos a MXN (precio * tipo de cambio as-of de fx_rates), así incluye el riesgo cambiario.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def compute(self) -> int:
+        t_start = time.time()
+        holdings = self.db.conn.execute(
+            "SELECT ticker, qty FROM view_portfolio_holdings WHERE qty > 0.0001 ORDER BY ticker"
+        ).df()
+
+        if holdings.empty:
+            self.db.conn.execute("DELETE FROM portfolio_risk")
+            return 0
+
+        tickers = holdings["ticker"].tolist()
+        prices = self._closes(tickers + [BENCHMARK_US, BENCHMARK_MX])
+        if prices.empty:
+            logging.warning("⚠️ Risk: sin velas 1d para las posiciones")
+            return 0
+
+        fx = FxService(self.db)
+        currencies = fx.currencies(tickers + [BENCHMARK_US, BENCHMARK_MX])
+        px = prices.reindex(columns=tickers)
+
+        # Precios en MXN: cada columna * tasa as-of de su divisa (una matriz, sin loops)
+        prices_mxn = prices.reindex(columns=currencies.index) * fx.rate_matrix(currencies, prices.index)
+        px_mxn = prices_mxn[tickers]
+
+        rets = px.pct_change(fill_method=None).iloc[1:]
+        rets_mxn = px_mxn.pct_change(fill_method=None).iloc[1:]
+
+        # Benchmark de cada columna (mismo criterio que relative_strength)
+        bench_of = [BENCHMARK_MX if currencies[t] == BASE_CURRENCY else BENCHMARK_US for t in tickers]
+        bench_rets = prices.reindex(columns=[BENCHMARK_US, BENCHMARK_MX]).pct_change(fill_method=None).iloc[1:]
+        bench_mat = bench_rets.reindex(columns=bench_of)
+        bench_mat.columns = tickers
+        gspc_mxn = prices_mxn[BENCHMARK_US].pct_change(fill_method=None).iloc[1:]
+
+        last_px = px_mxn.ffill().iloc[-1]
+        value_mxn = holdings.set_index("ticker")["qty"] * last_px
+        total_mxn = float(value_mxn.sum())
+
+        rows = self._holding_metrics(px, rets, rets_mxn, bench_mat, value_mxn, total_mxn)
+        rows["benchmark"] = bench_of
+        portfolio = self._portfolio_metrics(rets_mxn, gspc_mxn, value_mxn, total_mxn)
+        risk_df = pd.concat([rows, portfolio], ignore_index=True)
+        risk_df["as_of"] = prices.index[-1].date()
+
+        self.db.conn.register("risk_new", risk_df)
+        self.db.conn.execute("BEGIN TRANSACTION")
+        try:
+            self.db.conn.execute("DELETE FROM portfolio_risk")
+            self.db.conn.execute(f"""
+                INSERT INTO portfolio_risk (ticker, as_of, {', '.join(RISK_COLUMNS)}, updated_at)
+                SELECT ticker, as_of, {', '.join(RISK_COLUMNS)}, now() FROM risk_new
+            """)
+            self.db.conn.execute("COMMIT")
+        except Exception:
+            self.db.conn.execute("ROLLBACK")
+            raise
+        finally:
+            self.db.conn.unregister("risk_new")
+
+        logging.info(f"🛡️ Risk: {len(tickers)} posiciones + portafolio ({time.time() - t_start:.2f}s)")
+        return len(risk_df)
+
+    def _closes(self, tickers) -> pd.DataFrame:
+        """Matriz de cierres 1d (fechas x tickers) de los últimos HISTORY_DAYS."""
+        in_list = ",".join([f"'{t}'" for t in tickers])
+        df = self.db.conn.execute(f"""
+            SELECT timestamp, ticker, close
+            FROM ohlcv
+            WHERE timeframe = '1d' AND ticker IN ({in_list})
+              AND timestamp >= (SELECT MAX(timestamp) FROM ohlcv WHERE timeframe = '1d') - INTERVAL {HISTORY_DAYS} DAY
+        """).df()
+        if df.empty:
+            return df
+        return df.pivot(index="timestamp", columns="ticker", values="close").sort_index()
+
+    @staticmethod
+    def _annual_vol(rets: pd.DataFrame, window: int) -> pd.Series:
+        tail = rets.tail(window)
+        vol = tail.std() * np.sqrt(TRADING_DAYS) * 100
+        return vol.where(tail.count() >= min(window, MIN_OBS))
+
+    @staticmethod
+    def _drawdowns(px: pd.DataFrame):
+        """(max drawdown, drawdown actual) en % dentro de la ventana."""
+        window = px.tail(RISK_WINDOW + 1).ffill()
+        dd = (window / window.cummax() - 1) * 100
+        return dd.min(), dd.iloc[-1]
+
+    @staticmethod
+    def _historical_var(pnl: pd.DataFrame):
+        """VaR 95/99 y ES 95 (pérdida positiva) por columna de escenarios de P&L."""
+        values = pnl.to_numpy(dtype=float)
+        q05, q01 = np.nanpercentile(values, [5, 1], axis=0)
+        tail = np.where(values <= q05, values, np.nan)
+        es = np.nanmean(tail, axis=0)
+        return -q05, -q01, -es
+
+    def _holding_metrics(self, px, rets, rets_mxn, bench_mat, value_mxn, total_mxn) -> pd.DataFrame:
+        window = rets.tail(RISK_WINDOW)
+        bench = bench_mat.tail(RISK_WINDOW)
+
+        # Beta / correlación con observaciones pareadas (feriados distintos por mercado)
+        both = window.notna() & bench.notna()
+        r = window.where(both)
+        b = bench.where(both)
+        r_dm = r - r.mean()
+        b_dm = b - b.mean()
+        cov = (r_dm * b_dm).mean()
+        beta = cov / (b_dm ** 2).mean()
+        corr = cov / (r.std(ddof=0) * b.std(ddof=0))
+        n_obs = both.sum()
+
+        # VaR histórico: escenarios = retornos MXN de la ventana aplicados a la posición actual
+        scen = rets_mxn.tail(RISK_WINDOW)
+        var95, var99, es95 = self._historical_var(scen * value_mxn)
+        max_dd, dd = self._drawdowns(px)
+
+        df = pd.DataFrame({
+            "ticker": value_mxn.index,
+            "value_mxn": value_mxn.values,
+            "weight": (value_mxn / total_mxn * 100).values if total_mxn > 0 else np.nan,
+            "vol_20": self._annual_vol(rets, 20).reindex(value_mxn.index).values,
+            "vol_60": self._annual_vol(rets, 60).reindex(value_mxn.index).values,
+            "beta": beta.where(n_obs >= MIN_OBS).values,
+            "corr_bench": corr.where(n_obs >= MIN_OBS).values,
+            "var_95_mxn": var95,
+            "var_99_mxn": var99,
+            "es_95_mxn": es95,
+            "max_drawdown": max_dd.values,
+            "drawdown": dd.values,
+            "n_obs": scen.count().values,
+        })
+        df["var_95_pct"] = np.where(df["value_mxn"] > 0, df["var_95_mxn"] / df["value_mxn"] * 100, np.nan)
+        return df
+
+    def _portfolio_metrics(self, rets_mxn, gspc_mxn, value_mxn, total_mxn) -> pd.DataFrame:
+        """
+        Fila agregada: simulación histórica con las posiciones actuales (retornos MXN ponderados por valor).
+        Beta vs ^GSPC en MXN (el grueso del universo cotiza en USD). Drawdown desde portfolio_equity.
+        """
+        scen = rets_mxn.tail(RISK_WINDOW)
+        # Días sin vela de un ticker (feriado local) cuentan como retorno 0 para esa posición
+        pnl = scen.fillna(0.0) @ value_mxn.reindex(scen.columns).fillna(0.0)
+        valid = scen.notna().any(axis=1)
+        pnl = pnl[valid]
+        port_ret = pnl / total_mxn if total_mxn > 0 else pnl * np.nan
+
+        var95, var99, es95 = self._historical_var(pnl.to_frame())
+
+        aligned = pd.concat([port_ret, gspc_mxn.reindex(port_ret.index)], axis=1).dropna()
+        beta = corr = np.nan
+        if len(aligned) >= MIN_OBS and aligned.iloc[:, 1].var() > 0:
+            beta = aligned.cov().iloc[0, 1] / aligned.iloc[:, 1].var()
+            corr = aligned.corr().iloc[0, 1]
+
+        dd_row = self.db.conn.execute(f"""
+            SELECT MIN(drawdown_mxn), arg_max(drawdown_mxn, date)
+            FROM (
+                SELECT date, twr_mxn / MAX(twr_mxn) OVER (ORDER BY date) * 100 - 100 AS drawdown_mxn
+                FROM portfolio_equity
+                WHERE date >= (SELECT MAX(date) FROM portfolio_equity) - INTERVAL {HISTORY_DAYS} DAY
+            )
+        """).fetchone()
+
+        def vol(window):
+            tail = port_ret.tail(window)
+            return tail.std() * np.sqrt(TRADING_DAYS) * 100 if tail.count() >= min(window, MIN_OBS) else np.nan
+
+        return pd.DataFrame([{
+            "ticker": PORTFOLIO_KEY,
+            "benchmark": BENCHMARK_US,
+            "value_mxn": total_mxn,
+            "weight": 100.0,
+            "vol_20": vol(20),
+            "vol_60": vol(60),
+            "beta": beta,
+            "corr_bench": corr,
+            "var_95_mxn": var95[0],
+            "var_99_mxn": var99[0],
+            "es_95_mxn": es95[0],
+            "var_95_pct": var95[0] / total_mxn * 100 if total_mxn > 0 else np.nan,
+            "max_drawdown": dd_row[0] if dd_row else np.nan,
+            "drawdown": dd_row[1] if dd_row else np.nan,
+            "n_obs": int(len(pnl)),
+        }])
+
+if __name__ == "__main__":
+    db = Database()
+    n = RiskEngine(db).compute()
+    print(f"Risk: {n} filas")
@@ -1,94 +1,205 @@
 import pandas as pd
 import logging
 from svc_v2.db import Database
+from svc_v2.relative_strength import RS_FIELDS
+from svc_v2.fundamentals import fundamentals_select, latest_fundamentals_sql
+
+# Definición declarativa de estrategias.
+# Una sola fuente de verdad para el Screener (última vela) y el Backtester (toda la historia).
+# - columns: columnas a devolver (sobre indicators + close + relative_strength + fundamentals)
+# - where: condiciones SQL evaluadas por vela
+# - order_by: orden del resultado del screen
+# - direction: 1 = Long (BUY), -1 = Short/Salida (SELL). Usado para medir retornos a favor.
+STRATEGIES = {
+    # Estrategia: Rebote de Pánico
+    "BUY_BOUNCE": {
+        "columns": "ticker, timestamp, close, gap_pct, chg_pct, rsi, vol_k, ema_200, (close / ema_50 - 1) * 100 as dist_ema50_pct",
+        "where": """
+            (gap_pct <= -6 OR chg_pct <= -6)
+            AND rsi <= 35  -- Stricter (was 5-60)
+            AND vol_k >= 0.8 -- Decent volume
+        """,
+        "order_by": "gap_pct ASC",
+        "direction": 1,
+    },
+    # Estrategia: Continuación de Tendencia
+    "BUY_TREND": {
+        "columns": "ticker, timestamp, close, adx, ema_50, ema_200, macd_hist",
+        "where": """
+            adx >= 25
+            AND vol_k >= 0.8 -- Ensure it's not dead volume
+            AND ema_50 > ema_200
+            AND close > ema_50
+            AND macd_hist > 0
+        """,
+        "order_by": "adx DESC",
+        "direction": 1,
+    },
+    # Estrategia: Tendencia con valuación razonable (PE contra el cierre de la vela, snapshot de fundamentals)
+    "BUY_VALUE_TREND": {
+        "columns": "ticker, timestamp, close, adx, pe, forward_pe, dividend_yield, market_cap",
+        "where": """
+            adx >= 25
+            AND vol_k >= 0.8
+            AND ema_50 > ema_200
+            AND close > ema_50
+            AND macd_hist > 0
+            AND pe < 25 -- NULL (sin EPS positivo o dato vencido) no pasa
+        """,
+        "order_by": "pe ASC",
+        "direction": 1,
+    },
+    # Estrategia: Venta en Euforia
+    "SELL_STRENGTH": {
+        "columns": "ticker, timestamp, close, rsi, vol_k",
+        "where": "rsi >= 70",
+        "order_by": "rsi DESC",
+        "direction": -1,
+    },
+}
+
+# Columnas de fuerza relativa disponibles en cada vela (rs_bench_20, pct_rsi, ...)
+RS_SELECT = ", ".join([f"r.{c}" for c in RS_FIELDS])
+
+# Máxima antigüedad de la vela usada en un screen "as of" (evita evaluar tickers deslistados)
+ASOF_MAX_STALENESS_DAYS = 10
 
 class ScreenerEngine:
     def __init__(self, db: Database):
         self.db = db
 
-    def run_screen(self, strategy_name: str, timeframe: str = "1d") -> pd.DataFrame:
+    def run_screen(self, strategy_name: str, timeframe: str = "1d", as_of=None) -> pd.DataFrame:
         """
         Ejecuta una estrategia específica y devuelve los candidatos.
+        :param as_of: Si se indica, evalúa contra la vela que cada ticker tenía en ese momento (ASOF JOIN).
         """
-        if strategy_name == "BUY_BOUNCE":
-            return self._screen_buy_bounce(timeframe)
-        elif strategy_name == "BUY_TREND":
-            return self._screen_buy_trend(timeframe)
-        elif strategy_name == "SELL_STRENGTH":
-            return self._screen_sell_strength(timeframe)
-        else:
+        strategy = STRATEGIES.get(strategy_name)
+        if strategy is None:
             logging.error(f"Estrategia desconocida: {strategy_name}")
             return pd.DataFrame()
 
-    def _screen_buy_bounce(self, tf: str) -> pd.DataFrame:
+        return self._screen(strategy, timeframe, as_of)
+
+    def replay(self, start, end, timeframe: str = "1d", strategies: list = None, days_to_keep: int = 3) -> pd.DataFrame:
+        """
+        Re-ejecuta las estrategias en cada vela de [start, end] en una sola query.
+        Devuelve un hit por (as_of, strategy, ticker) con added_at/expires_at como
+        los habría escrito el broad scan en dynamic_watchlist.
         """
-        Estrategia: Rebote de Pánico
+        strategies = [s for s in (strategies or STRATEGIES.keys()) if s in STRATEGIES]
+        if not strategies:
+            return pd.DataFrame()
+
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        dates_sql = f"""
+            SELECT DISTINCT timestamp AS as_of FROM indicators
+            WHERE timeframe = '{timeframe}' AND timestamp BETWEEN '{start}' AND '{end}'
         """
+        selects = [
+            f"""
+            SELECT as_of, '{name}' AS strategy, {STRATEGIES[name]['columns']}
+            FROM latest
+            WHERE ({STRATEGIES[name]['where']})
+            """
+            for name in strategies
+        ]
         query = f"""
-        WITH latest AS (
-            SELECT i.*, o.close,
-                   row_number() OVER (PARTITION BY i.ticker ORDER BY i.timestamp DESC) as rn
-            FROM indicators i
-            JOIN ohlcv o USING (ticker, timeframe, timestamp)
-            WHERE i.timeframe = '{tf}'
-        )
-        SELECT 
-            ticker, timestamp, close, gap_pct, chg_pct, rsi, vol_k, ema_200,
-            (close / ema_50 - 1) * 100 as dist_ema50_pct
-        FROM latest
-        WHERE rn = 1
-          AND (gap_pct <= -6 OR chg_pct <= -6)
-          AND rsi <= 35  -- Stricter (was 5-60)
-          AND vol_k >= 0.8 -- Decent volume
-        ORDER BY gap_pct ASC
+            {self._asof_cte(timeframe, dates_sql, start, end)},
+            hits AS (
+                {' UNION ALL BY NAME '.join(selects)}
+            )
+            SELECT *,
+                   as_of AS added_at,
+                   as_of + INTERVAL {int(days_to_keep)} DAY AS expires_at
+            FROM hits
+            ORDER BY as_of, strategy, ticker
         """
         return self.db.conn.execute(query).df()
 
-    def _screen_buy_trend(self, tf: str) -> pd.DataFrame:
-        """
-        Estrategia: Continuación de Tendencia
-        """
-        query = f"""
-        WITH latest AS (
-            SELECT i.*, o.close,
-                   row_number() OVER (PARTITION BY i.ticker ORDER BY i.timestamp DESC) as rn
-            FROM indicators i
-            JOIN ohlcv o USING (ticker, timeframe, timestamp)
-            WHERE i.timeframe = '{tf}'
+    def watchlist_as_of(self, as_of, timeframe: str = "1d", days_to_keep: int = 3) -> pd.DataFrame:
+        """Reconstruye la dynamic_watchlist vigente en `as_of` (ticker, reason, added_at, expires_at)."""
+        as_of = pd.Timestamp(as_of)
+        hits = self.replay(as_of - pd.Timedelta(days=days_to_keep), as_of, timeframe, days_to_keep=days_to_keep)
+        if hits.empty:
+            return pd.DataFrame(columns=['ticker', 'reason', 'added_at', 'expires_at'])
+
+        hits = hits[hits['expires_at'] > as_of]
+        return (
+            hits.groupby('ticker')
+            .agg(reason=('strategy', lambda s: ", ".join(dict.fromkeys(s))),
+                 added_at=('added_at', 'min'),
+                 expires_at=('expires_at', 'max'))
+            .reset_index()
         )
-        SELECT 
-            ticker, timestamp, close, adx, ema_50, ema_200, macd_hist
+
+    def _screen(self, strategy: dict, tf: str, as_of=None) -> pd.DataFrame:
+        """Evalúa las condiciones de la estrategia sobre la última vela (o la vigente en as_of) de cada ticker."""
+        query = f"""
+        {self._latest_cte(tf, as_of)}
+        SELECT
+            {strategy['columns']}
         FROM latest
-        WHERE rn = 1
-          AND adx >= 25
-          AND vol_k >= 0.8 -- Ensure it's not dead volume
-          AND ema_50 > ema_200
-          AND close > ema_50
-          AND macd_hist > 0
-        ORDER BY adx DESC
+        WHERE ({strategy['where']})
+        ORDER BY {strategy['order_by']}
         """
         return self.db.conn.execute(query).df()
 
-    def _screen_sell_strength(self, tf: str) -> pd.DataFrame:
+    def _latest_cte(self, tf: str, as_of=None) -> str:
+        """CTE 'latest': una fila (indicators + close + fundamentals) por ticker."""
+        if as_of is None:
+            return f"""
+            WITH latest AS (
+                SELECT l.*, {fundamentals_select('f', 'l.close', 'l.timestamp')}
+                FROM (
+                    SELECT i.*, o.close, {RS_SELECT},
+                           row_number() OVER (PARTITION BY i.ticker ORDER BY i.timestamp DESC) as rn
+                    FROM indicators i
+                    JOIN ohlcv o USING (ticker, timeframe, timestamp)
+                    LEFT JOIN relative_strength r USING (ticker, timeframe, timestamp)
+                    WHERE i.timeframe = '{tf}'
+                ) l
+                LEFT JOIN ({latest_fundamentals_sql()}) f ON f.ticker = l.ticker
+                WHERE l.rn = 1
+            )
+            """
+        as_of = pd.Timestamp(as_of)
+        return self._asof_cte(tf, f"SELECT TIMESTAMP '{as_of}' AS as_of", as_of, as_of)
+
+    def _asof_cte(self, tf: str, dates_sql: str, start: pd.Timestamp, end: pd.Timestamp) -> str:
         """
-        Estrategia: Venta en Euforia
+        CTE 'latest' point-in-time: grid (ticker x fecha) ASOF JOIN indicators/ohlcv.
+        Cada fila es la vela vigente del ticker en `as_of` (la última con timestamp <= as_of, y no más
+        vieja que ASOF_MAX_STALENESS_DAYS respecto a esa fecha) y el snapshot de fundamentals vigente.
         """
-        query = f"""
-        WITH latest AS (
-            SELECT i.*, o.close,
-                   row_number() OVER (PARTITION BY i.ticker ORDER BY i.timestamp DESC) as rn
-            FROM indicators i
-            JOIN ohlcv o USING (ticker, timeframe, timestamp)
-            WHERE i.timeframe = '{tf}'
-        )
-        SELECT 
-            ticker, timestamp, close, rsi, vol_k
-        FROM latest
-        WHERE rn = 1
-          AND rsi >= 70
-        ORDER BY rsi DESC
+        return f"""
+            WITH dates AS (
+                {dates_sql}
+            ),
+            ind AS (
+                SELECT i.*, o.close, {RS_SELECT}
+                FROM indicators i
+                JOIN ohlcv o USING (ticker, timeframe, timestamp)
+                LEFT JOIN relative_strength r USING (ticker, timeframe, timestamp)
+                WHERE i.timeframe = '{tf}'
+                  AND i.timestamp BETWEEN TIMESTAMP '{start}' - INTERVAL {ASOF_MAX_STALENESS_DAYS} DAY
+                                      AND TIMESTAMP '{end}'
+            ),
+            grid AS (
+                SELECT t.ticker, d.as_of
+                FROM (SELECT DISTINCT ticker FROM ind) t
+                CROSS JOIN dates d
+            ),
+            latest AS (
+                SELECT l.*, {fundamentals_select('f', 'l.close', 'l.as_of')}
+                FROM (
+                    SELECT g.as_of, ind.*
+                    FROM grid g
+                    ASOF JOIN ind ON g.ticker = ind.ticker AND g.as_of >= ind.timestamp
+                ) l
+                ASOF LEFT JOIN fundamentals f ON l.ticker = f.ticker AND l.as_of >= f.snapshot_date
+                WHERE l.timestamp >= l.as_of - INTERVAL {ASOF_MAX_STALENESS_DAYS} DAY
+            )
         """
-        return self.db.conn.execute(query).df()
 
 if __name__ == "__main__":
     # Test simple
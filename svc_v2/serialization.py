@@ -0,0 +1,44 @@
+import decimal
+from typing import Any, List
+import numpy as np
+import orjson
+import pandas as pd
+from starlette.responses import JSONResponse
+
+# NaN/inf -> null y escalares numpy los resuelve orjson de forma nativa
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _default(obj: Any):
+    """Fallback para tipos que orjson no conoce (Timestamp de pandas, NaT/NA, Decimal de DuckDB)."""
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, pd.Timedelta):
+        return str(obj)
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (np.datetime64, np.timedelta64)):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+def loads(body: bytes) -> Any:
+    return orjson.loads(body)
+
+def records(df: pd.DataFrame) -> List[dict]:
+    """
+    DataFrame -> lista de dicts sin pasar por dtype object.
+    Los NaN/inf quedan como float y se convierten a null al serializar.
+    """
+    if df.empty:
+        return []
+    return df.to_dict(orient="records")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse con orjson. Devolverla directo desde el endpoint evita el jsonable_encoder de FastAPI."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
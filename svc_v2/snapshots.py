@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import duckdb
+from svc_v2.db import Database
+
+# Snapshots de lectura junto al archivo principal: {dir de la DB}/snapshots/{stem}.{version}.duckdb
+# (la API en otro contenedor encuentra la misma carpeta con solo conocer la ruta de la DB)
+SNAPSHOT_DIRNAME = "snapshots"
+
+# Puntero a la versión vigente (contiene solo el nombre del archivo); se reemplaza con os.replace
+POINTER_FILE = "CURRENT"
+
+# Versiones que se conservan: una request que abrió la anterior sigue leyendo mientras se publica la nueva
+KEEP_SNAPSHOTS = 3
+
+# Firma del archivo fuente de la versión vigente (tamaño + mtime tras CHECKPOINT): si no cambió, no se copia
+SOURCE_FILE = "CURRENT.source"
+
+def snapshot_dir(db_path) -> Path:
+    return Path(db_path).parent / SNAPSHOT_DIRNAME
+
+def current_snapshot(db_path) -> Optional[Path]:
+    """Snapshot vigente de la DB (None si nunca se publicó o el archivo ya no existe)."""
+    pointer = snapshot_dir(db_path) / POINTER_FILE
+    try:
+        name = pointer.read_text().strip()
+    except OSError:
+        return None
+    path = pointer.parent / name
+    return path if name and path.exists() else None
+
+def source_signature(db_path) -> str:
+    """'{bytes}:{mtime_ns}:{wal bytes}' del archivo. Tras un CHECKPOINT sin escrituras pendientes no cambia."""
+    st = os.stat(db_path)
+    wal = Path(f"{db_path}.wal")
+    return f"{st.st_size}:{st.st_mtime_ns}:{wal.stat().st_size if wal.exists() else 0}"
+
+def publish_snapshot(db: Database, label: str = "", keep: int = KEEP_SNAPSHOTS) -> Optional[Path]:
+    """
+    Publica una copia de solo lectura de la DB. Con la conexión de escritura abierta (nadie más puede
+    escribir) se hace CHECKPOINT, se copia el archivo a un temporal, se valida abriéndolo y se publica
+    con dos renombres atómicos (archivo y puntero). Los lectores ven la versión anterior o la nueva,
+    nunca una copia a medias. Nunca rompe al caller (best effort).
+    Cada publicación copia el archivo completo: si nada se escribió desde la vigente, se devuelve esa.
+    """
+    t_start = time.time()
+    src = Path(db.db_path)
+    target_dir = snapshot_dir(src)
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    name = f"{src.stem}.{version}.duckdb"
+    tmp = target_dir / f"{name}.tmp"
+    try:
+        target_dir.mkdir(parents=True, exist_ok=True)
+        db.conn.execute("CHECKPOINT")
+        signature = source_signature(src)
+        current = current_snapshot(src)
+        source_file = target_dir / SOURCE_FILE
+        if current and source_file.exists() and source_file.read_text().strip() == signature:
+            logging.info(f"📸 Snapshot vigente sin cambios: {current.name}{f' (tras {label})' if label else ''}")
+            return current
+
+        shutil.copyfile(src, tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+
+        # Validación: la copia abre y tiene el esquema (una copia corrupta nunca se publica)
+        with duckdb.connect(str(tmp), read_only=True) as con:
+            con.execute("SELECT COUNT(*) FROM ohlcv").fetchone()
+
+        os.replace(tmp, target_dir / name)
+        pointer_tmp = target_dir / f"{POINTER_FILE}.tmp"
+        pointer_tmp.write_text(name)
+        os.replace(pointer_tmp, target_dir / POINTER_FILE)
+        # Después del puntero: un corte entre ambos solo provoca una copia de más, nunca un salto indebido
+        source_tmp = target_dir / f"{SOURCE_FILE}.tmp"
+        source_tmp.write_text(signature)
+        os.replace(source_tmp, source_file)
+    except Exception as e:
+        logging.error(f"❌ Error publicando snapshot de lectura: {e}")
+        tmp.unlink(missing_ok=True)
+        return None
+
+    _prune(target_dir, src.stem, name, keep)
+    size_mb = (target_dir / name).stat().st_size / 1e6
+    logging.info(f"📸 Snapshot publicado: {name} ({size_mb:.1f} MB, {time.time() - t_start:.1f}s){f' tras {label}' if label else ''}")
+    return target_dir / name
+
+def _prune(target_dir: Path, stem: str, current: str, keep: int):
+    """Borra versiones viejas (en Linux, un lector que aún la tenga abierta sigue leyendo el inode)."""
+    versions = sorted(target_dir.glob(f"{stem}.*.duckdb"), reverse=True)
+    for old in versions[max(keep, 1):]:
+        if old.name == current:
+            continue
+        try:
+            old.unlink()
+            Path(f"{old}.wal").unlink(missing_ok=True)
+        except OSError as e:
+            logging.debug(f"No se pudo borrar snapshot {old.name}: {e}")
+
+if __name__ == "__main__":
+    db = Database()
+    print(publish_snapshot(db, "manual"))
+    print(current_snapshot(db.db_path))
@@ -0,0 +1,149 @@
+import logging
+import math
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+# Tickers por llamada a Yahoo (URLs largas / estabilidad); punto de partida del chunk adaptativo
+CHUNK_SIZE = 50
+
+# Límites y control del chunk adaptativo (AIMD: crece de a poco, se recorta fuerte ante errores o lentitud)
+MIN_CHUNK_SIZE = 5
+MAX_CHUNK_SIZE = 100
+CHUNK_GROWTH = 10
+TARGET_CALL_SECONDS = 20.0
+ERROR_WINDOW = 10
+MAX_ERROR_RATE = 0.2
+
+# Costo fijo de una llamada expresado en velas-equivalentes (latencia + handshake ~ descargar este número de filas)
+REQUEST_COST_ROWS = 5000
+
+# Velas por sesión para estimar filas de una ventana
+BARS_PER_SESSION = {"1d": 1, "1h": 7, "15m": 26, "5m": 78}
+
+# Tamaño aproximado de una fila OHLCV en la respuesta (para reportar bytes)
+BYTES_PER_ROW = 64
+
+class SyncPlanner:
+    """
+    Plan de descargas del sync incremental. El Collector agrupa tickers por fecha de inicio exacta
+    (última vela - traslape), lo que con timestamps dispersos genera muchos grupos pequeños y una llamada
+    por grupo. El planner une grupos con un modelo de costo:
+
+        costo(segmento) = REQUEST_COST_ROWS * ceil(tickers / chunk_size) + filas descargadas
+
+    donde un segmento descarga desde el inicio más antiguo de sus grupos. Ordenados por fecha, el plan
+    óptimo es una partición en segmentos contiguos, así que se resuelve exacto con programación dinámica.
+    """
+
+    def __init__(self, timeframe: str, today: Optional[datetime] = None, chunk_size: int = CHUNK_SIZE):
+        self.timeframe = timeframe
+        self.today = (today or datetime.now()).date()
+        self.chunk_size = chunk_size
+
+    def estimate_rows(self, start: str) -> int:
+        """Velas esperadas por ticker desde `start` hasta hoy (sesiones hábiles x velas por sesión)."""
+        sessions = np.busday_count(pd.Timestamp(start).date(), self.today) + 1
+        return int(max(sessions, 1) * BARS_PER_SESSION.get(self.timeframe, 1))
+
+    def plan(self, starts: Dict[str, str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        `starts`: ticker -> fecha de inicio requerida (YYYY-MM-DD).
+        Devuelve (requests, report): una fila por llamada y el comparativo naive vs plan.
+        """
+        columns = ["start", "tickers", "n_tickers", "est_rows", "est_bytes"]
+        if not starts:
+            empty = pd.DataFrame(columns=columns)
+            return empty, self._report(empty, empty)
+
+        groups: Dict[str, List[str]] = {}
+        for ticker, start in starts.items():
+            groups.setdefault(start, []).append(ticker)
+        group_starts = sorted(groups)
+        members = [sorted(groups[s]) for s in group_starts]
+
+        naive = self._requests([(s, m) for s, m in zip(group_starts, members)])
+        planned = self._requests(self._segments(group_starts, members))
+        return planned, self._report(naive, planned)
+
+    def _segments(self, group_starts: List[str], members: List[List[str]]) -> List[Tuple[str, List[str]]]:
+        n = len(group_starts)
+        sizes = np.array([len(m) for m in members])
+        prefix = np.concatenate([[0], np.cumsum(sizes)])
+        rows = [self.estimate_rows(s) for s in group_starts]
+
+        # best[j] = costo mínimo de cubrir los grupos [0, j); cut[j] = inicio del último segmento
+        best = [0.0] + [math.inf] * n
+        cut = [0] * (n + 1)
+        for j in range(1, n + 1):
+            for i in range(j):
+                n_tickers = prefix[j] - prefix[i]
+                cost = best[i] + REQUEST_COST_ROWS * math.ceil(n_tickers / self.chunk_size) + rows[i] * n_tickers
+                if cost < best[j]:
+                    best[j], cut[j] = cost, i
+
+        segments = []
+        j = n
+        while j > 0:
+            i = cut[j]
+            segments.append((group_starts[i], [t for m in members[i:j] for t in m]))
+            j = i
+        return segments[::-1]
+
+    def _requests(self, segments: List[Tuple[str, List[str]]]) -> pd.DataFrame:
+        rows = []
+        for start, tickers in segments:
+            per_ticker = self.estimate_rows(start)
+            for i in range(0, len(tickers), self.chunk_size):
+                chunk = tickers[i:i + self.chunk_size]
+                rows.append({
+                    "start": start, "tickers": chunk, "n_tickers": len(chunk),
+                    "est_rows": per_ticker * len(chunk), "est_bytes": per_ticker * len(chunk) * BYTES_PER_ROW,
+                })
+        return pd.DataFrame(rows, columns=["start", "tickers", "n_tickers", "est_rows", "est_bytes"])
+
+    @staticmethod
+    def _report(naive: pd.DataFrame, planned: pd.DataFrame) -> pd.DataFrame:
+        def stats(req: pd.DataFrame) -> dict:
+            return {
+                "requests": len(req),
+                "groups": req["start"].nunique() if not req.empty else 0,
+                "est_rows": int(req["est_rows"].sum()) if not req.empty else 0,
+                "est_mb": round(req["est_bytes"].sum() / 1e6, 2) if not req.empty else 0.0,
+                "cost": int(len(req) * REQUEST_COST_ROWS + (req["est_rows"].sum() if not req.empty else 0)),
+            }
+        return pd.DataFrame([stats(naive), stats(planned)], index=["naive", "planned"])
+
+class AdaptiveChunker:
+    """
+    Tamaño de chunk que se ajusta con lo observado en la corrida:
+    - error (excepción / respuesta vacía) -> mitad,
+    - llamada más lenta que TARGET_CALL_SECONDS -> 3/4,
+    - llamada rápida (< mitad del objetivo) con tasa de errores reciente <= MAX_ERROR_RATE -> +CHUNK_GROWTH.
+    """
+
+    def __init__(self, size: int = CHUNK_SIZE):
+        self.size = size
+        self.outcomes = deque(maxlen=ERROR_WINDOW)
+
+    @property
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def record(self, n_tickers: int, seconds: float, ok: bool):
+        """Registra una llamada de `n_tickers` y recalcula el tamaño."""
+        self.outcomes.append(ok)
+        old = self.size
+
+        if not ok:
+            self.size = max(MIN_CHUNK_SIZE, self.size // 2)
+        elif seconds > TARGET_CALL_SECONDS:
+            self.size = max(MIN_CHUNK_SIZE, int(self.size * 0.75))
+        elif seconds < TARGET_CALL_SECONDS / 2 and n_tickers >= self.size and self.error_rate <= MAX_ERROR_RATE:
+            # Solo crece si la llamada usó el chunk completo (un resto chico no dice nada del límite)
+            self.size = min(MAX_CHUNK_SIZE, self.size + CHUNK_GROWTH)
+
+        if self.size != old:
+            logging.info(f"         📏 Chunk {old} -> {self.size} (última: {seconds:.1f}s, errores: {self.error_rate:.0%})")
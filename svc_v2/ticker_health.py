@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+import pandas as pd
+from svc_v2.db import Database
+
+# Fallas consecutivas (vacío o error) antes de poner el ticker en cuarentena
+QUARANTINE_AFTER = 3
+
+# Backoff exponencial: la primera cuarentena dura esto y se duplica con cada falla extra, hasta el tope
+BACKOFF_BASE_HOURS = 6
+BACKOFF_MAX_DAYS = 30
+
+# Resultado de una descarga por ticker: 'ok' | 'empty' | 'error', con el mensaje de error si hubo
+Outcome = Tuple[str, Optional[str]]
+
+class TickerHealth:
+    """
+    Salud de descarga por (ticker, timeframe). Símbolos deslistados, renombrados o con typo regresan vacíos
+    en cada corrida y ocupan lugar en los chunks; tras QUARANTINE_AFTER fallas seguidas se ponen en cuarentena
+    y el sync los salta hasta `quarantined_until`. Al vencer se vuelven a probar una vez: si fallan otra vez
+    la cuarentena se duplica, si traen velas el contador vuelve a cero.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def quarantined(self, timeframe: str, tickers: Optional[List[str]] = None) -> Set[str]:
+        """Tickers con cuarentena vigente en el timeframe."""
+        ticker_filter = ""
+        if tickers:
+            ticker_filter = "AND ticker IN (" + ",".join([f"'{t}'" for t in tickers]) + ")"
+        rows = self.db.conn.execute(f"""
+            SELECT ticker FROM ticker_health
+            WHERE timeframe = '{timeframe}' AND quarantined_until > now() {ticker_filter}
+        """).fetchall()
+        return {r[0] for r in rows}
+
+    def record(self, timeframe: str, outcomes: Dict[str, Outcome]):
+        """Aplica los resultados de una corrida (solo tickers con resultado conocido)."""
+        if not outcomes:
+            return
+
+        now = datetime.now()
+        in_list = ",".join([f"'{t}'" for t in outcomes])
+        prev = self.db.conn.execute(f"""
+            SELECT ticker, consecutive_failures, total_failures, last_success_at, last_failure_at
+            FROM ticker_health
+            WHERE timeframe = '{timeframe}' AND ticker IN ({in_list})
+        """).df().set_index("ticker")
+
+        rows = []
+        newly_quarantined = []
+        for ticker, (outcome, error) in outcomes.items():
+            old = prev.loc[ticker] if ticker in prev.index else None
+            consecutive = 0 if old is None else int(old["consecutive_failures"])
+            total = 0 if old is None else int(old["total_failures"])
+            last_success = None if old is None else old["last_success_at"]
+            last_failure = None if old is None else old["last_failure_at"]
+
+            until = None
+            if outcome == "ok":
+                consecutive, status, last_success = 0, "ok", now
+            else:
+                consecutive, total, last_failure = consecutive + 1, total + 1, now
+                status = "failing"
+                if consecutive >= QUARANTINE_AFTER:
+                    status = "quarantined"
+                    until = now + self.backoff(consecutive)
+                    newly_quarantined.append(f"{ticker} ({self.backoff(consecutive)})")
+
+            rows.append({
+                "ticker": ticker, "timeframe": timeframe, "status": status,
+                "consecutive_failures": consecutive, "total_failures": total,
+                "last_outcome": outcome, "last_error": error,
+                "last_success_at": None if pd.isna(last_success) else last_success,
+                "last_failure_at": None if pd.isna(last_failure) else last_failure,
+                "quarantined_until": until, "updated_at": now,
+            })
+
+        df = pd.DataFrame(rows)
+        self.db.conn.register("health_new", df)
+        try:
+            self.db.conn.execute("""
+                INSERT OR REPLACE INTO ticker_health
+                    (ticker, timeframe, status, consecutive_failures, total_failures, last_outcome, last_error,
+                     last_success_at, last_failure_at, quarantined_until, updated_at)
+                SELECT ticker, timeframe, status, consecutive_failures, total_failures, last_outcome, last_error,
+                       last_success_at::TIMESTAMP, last_failure_at::TIMESTAMP, quarantined_until::TIMESTAMP, updated_at::TIMESTAMP
+                FROM health_new
+            """)
+        finally:
+            self.db.conn.unregister("health_new")
+
+        failing = int((df["status"] != "ok").sum())
+        logging.info(f"   🩺 Health [{timeframe}]: {len(df) - failing} ok, {failing} con fallas")
+        if newly_quarantined:
+            logging.warning(f"   🚫 Cuarentena [{timeframe}]: {', '.join(newly_quarantined)}")
+
+    @staticmethod
+    def backoff(consecutive_failures: int) -> timedelta:
+        """Duración de la cuarentena: BACKOFF_BASE_HOURS * 2^(fallas extra), con tope BACKOFF_MAX_DAYS."""
+        extra = max(consecutive_failures - QUARANTINE_AFTER, 0)
+        hours = BACKOFF_BASE_HOURS * (2 ** min(extra, 16))
+        return min(timedelta(hours=hours), timedelta(days=BACKOFF_MAX_DAYS))
+
+    def report(self, include_failing: bool = False) -> pd.DataFrame:
+        """Tickers en cuarentena vigente (y opcionalmente los que ya fallan sin llegar a cuarentena)."""
+        cond = "quarantined_until > now()"
+        if include_failing:
+            cond += " OR consecutive_failures > 0"
+        return self.db.conn.execute(f"""
+            SELECT ticker, timeframe, status, consecutive_failures, total_failures, last_outcome, last_error,
+                   last_success_at, last_failure_at, quarantined_until,
+                   COALESCE(quarantined_until > now(), FALSE) AS in_quarantine
+            FROM ticker_health
+            WHERE {cond}
+            ORDER BY consecutive_failures DESC, ticker, timeframe
+        """).df()
+
+if __name__ == "__main__":
+    db = Database()
+    print(TickerHealth(db).report(include_failing=True))
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from svc_v2.db import Database
+
+@pytest.fixture
+def db(tmp_path):
+    """DB vacía con el esquema completo (una por test)."""
+    database = Database(str(tmp_path / "markets.duckdb"))
+    yield database
+    database.close()
+
+def insert_candles(db: Database, ticker: str, timeframe: str, dates, close: float = 100.0):
+    """Velas planas (OHLC = close) para los timestamps dados."""
+    df = pd.DataFrame({
+        "ticker": ticker,
+        "timeframe": timeframe,
+        "timestamp": pd.to_datetime(list(dates)),
+        "open": close, "high": close, "low": close, "close": close, "volume": 1000.0,
+    })
+    db.conn.register("candles_new", df)
+    try:
+        db.conn.execute("""
+            INSERT INTO ohlcv (ticker, timeframe, timestamp, open, high, low, close, volume)
+            SELECT ticker, timeframe, timestamp, open, high, low, close, volume FROM candles_new
+        """)
+    finally:
+        db.conn.unregister("candles_new")
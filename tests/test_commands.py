@@ -0,0 +1,38 @@
+from svc_v2.commands import APPLIED, CommandLog, CommandWriter
+
+def test_run_script_enqueues_snapshot_for_daemon(db, tmp_path, monkeypatch):
+    db.close()
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    monkeypatch.setenv("READ_SNAPSHOTS", "1")
+    from svc_v2 import api
+
+    script = tmp_path / "noop_tool.py"
+    script.write_text("")
+    api.run_script(str(script))
+
+    log = CommandLog(db.db_path)
+    pending = log.pending()
+    assert [c["kind"] for c in pending] == ["publish_snapshot"]
+
+    # El daemon lo aplica y publica antes del acuse
+    published = []
+    db._init_db(str(db.db_path), read_only=False)
+    assert CommandWriter(db, log).apply_pending(before_ack=lambda: published.append(True)) == 1
+    assert published == [True]
+    assert log.get(pending[0]["id"])["status"] == APPLIED
+
+def test_failed_ack_leaves_batch_pending(db):
+    log = CommandLog(db.db_path)
+    cmd_id = log.enqueue("add_transaction", {"ticker": "AAA", "side": "BUY", "qty": 1, "price": 10})
+
+    def no_snapshot():
+        raise RuntimeError("snapshot de lectura no publicado")
+
+    writer = CommandWriter(db, log)
+    assert writer.apply_pending(before_ack=no_snapshot) == 0
+    assert log.get(cmd_id)["status"] == "pending"
+
+    # El reintento no vuelve a insertar: solo acusa
+    assert writer.apply_pending(before_ack=lambda: None) == 1
+    assert log.get(cmd_id)["status"] == APPLIED
+    assert db.conn.execute("SELECT COUNT(*) FROM portfolio_transactions").fetchone()[0] == 1
@@ -0,0 +1,55 @@
+"""Motores que escriben DataFrames en DuckDB, llamados a través de Database (conexión envuelta)."""
+import numpy as np
+import pandas as pd
+
+from svc_v2.correlation import CorrelationEngine
+from svc_v2.gaps import GapDetector
+from tests.conftest import insert_candles
+
+SESSIONS = pd.bdate_range("2024-01-01", periods=10)
+
+def test_correlation_save_clusters(db):
+    tickers = ["AAA", "BBB", "CCC"]
+    corr = np.array([[1.0, 0.9, 0.1], [0.9, 1.0, 0.1], [0.1, 0.1, 1.0]], dtype=np.float32)
+
+    CorrelationEngine(db)._save_clusters(tickers, corr)
+
+    rows = db.conn.execute("SELECT ticker FROM correlation_clusters ORDER BY ticker").fetchall()
+    assert [r[0] for r in rows] == tickers
+
+def test_gap_scan_writes_index(db):
+    for t in ["AAA", "BBB", "CCC"]:
+        insert_candles(db, t, "1d", SESSIONS)
+    insert_candles(db, "DDD", "1d", SESSIONS.delete(4))
+
+    GapDetector(db).scan(["1d"])
+
+    gaps = db.conn.execute("SELECT ticker, gap_start, missing_bars FROM ohlcv_gaps").fetchall()
+    assert gaps == [("DDD", SESSIONS[4].to_pydatetime(), 1)]
+
+def test_gap_scan_with_tickers_keeps_other_tickers(db):
+    for t in ["AAA", "BBB", "CCC"]:
+        insert_candles(db, t, "1d", SESSIONS)
+    insert_candles(db, "DDD", "1d", SESSIONS.delete(4))
+    insert_candles(db, "EEE", "1d", SESSIONS.delete(6))
+    detector = GapDetector(db)
+    detector.scan(["1d"])
+    db.conn.execute("UPDATE ohlcv_gaps SET attempts = 2 WHERE ticker = 'EEE'")
+
+    detector.scan(["1d"], ["DDD"])
+
+    gaps = db.conn.execute("SELECT ticker, attempts FROM ohlcv_gaps ORDER BY ticker").fetchall()
+    assert gaps == [("DDD", 0), ("EEE", 2)]
+
+def test_replace_history_rescales_bars_older_than_refetch(db):
+    stored = pd.bdate_range("2024-01-01", periods=20)
+    insert_candles(db, "SPL", "1d", stored, close=100.0)
+    # Split 2:1: el proveedor solo devuelve las últimas 10 sesiones, ya a la mitad
+    refetch = pd.DataFrame({"ticker": "SPL", "date": stored[10:], "open": 50.0, "high": 50.0,
+                            "low": 50.0, "close": 50.0, "volume": 2000.0})
+
+    db.replace_ohlcv_history("SPL", "1d", refetch, factor=0.5, rescale_volume=True)
+
+    rows = db.conn.execute("SELECT close, volume FROM ohlcv WHERE ticker = 'SPL' ORDER BY timestamp").fetchall()
+    assert len(rows) == 20
+    assert all(close == 50.0 and volume == 2000.0 for close, volume in rows)
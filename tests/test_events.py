@@ -0,0 +1,41 @@
+import asyncio
+
+from svc_v2 import events
+
+class FakeRequest:
+    """Request mínimo para stream_events: Last-Event-ID y desconexión tras N chequeos."""
+
+    def __init__(self, last_event_id: str, polls: int):
+        self.headers = {"last-event-id": last_event_id}
+        self.polls = polls
+
+    async def is_disconnected(self) -> bool:
+        self.polls -= 1
+        return self.polls < 0
+
+def test_sse_replay_does_not_duplicate_queued_events(db, monkeypatch):
+    for i in range(3):
+        events.publish_event(db, events.SIGNAL, {"n": i})
+    db.close()
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    monkeypatch.setenv("READ_SNAPSHOTS", "0")
+    from svc_v2 import api
+
+    async def run():
+        queue = asyncio.Queue()
+        # El broadcaster leyó los eventos 2 y 3 mientras el cliente hacía replay desde el 1
+        for ev_id in (2, 3):
+            queue.put_nowait((ev_id, f"id: {ev_id}\nevent: signal\ndata: {{}}\n\n"))
+        queue.put_nowait((None, "event: screener_delta\ndata: {}\n\n"))
+
+        async def subscribe():
+            return queue
+        monkeypatch.setattr(api.broadcaster, "subscribe", subscribe)
+
+        response = await api.stream_events(FakeRequest("1", polls=3))
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(run())
+    ids = [c.split("\n")[0] for c in chunks if c.startswith("id: ")]
+    assert ids == ["id: 2", "id: 3"]
+    assert any(c.startswith("event: screener_delta") for c in chunks)
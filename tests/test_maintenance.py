@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from svc_v2.maintenance import StorageMaintenance
+from tests.conftest import insert_candles
+
+def test_compact_shrinks_file_and_keeps_data(db):
+    for t in ["BBB", "AAA"]:
+        insert_candles(db, t, "1d", pd.bdate_range("2024-01-01", periods=50))
+    db.add_transaction("AAA", "BUY", 1, 10)
+    db.conn.execute("CREATE TABLE junk AS SELECT range AS i, random() AS r FROM range(2000000)")
+    db.conn.execute("DROP TABLE junk")
+    db.conn.execute("CHECKPOINT")
+    bloated = os.path.getsize(db.db_path)
+
+    StorageMaintenance(db).run({"1h": 730})
+
+    assert os.path.getsize(db.db_path) < bloated / 2
+    assert db.conn.execute("SELECT COUNT(*) FROM ohlcv").fetchone()[0] == 100
+    assert db.conn.execute("SELECT ticker FROM ohlcv LIMIT 1").fetchone()[0] == "AAA"
+    db.add_transaction("AAA", "SELL", 1, 10)
+    assert db.conn.execute("SELECT MAX(id) FROM portfolio_transactions").fetchone()[0] == 2
+
+def test_storage_endpoint_measures_live_file(db, tmp_path, monkeypatch):
+    insert_candles(db, "AAA", "1d", pd.bdate_range("2024-01-01", periods=50))
+    StorageMaintenance(db).record()
+    db.close()
+    live_bytes = os.path.getsize(db.db_path)
+
+    # Snapshot vigente distinto de la DB viva (p. ej. una copia compacta)
+    snap = tmp_path / "snapshots" / "markets.1.duckdb"
+    snap.parent.mkdir()
+    snap.write_bytes(db.db_path.read_bytes())
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    monkeypatch.setenv("READ_SNAPSHOTS", "1")
+    from svc_v2 import api
+    monkeypatch.setattr(api, "current_snapshot", lambda path: snap)
+    db.db_path.write_bytes(db.db_path.read_bytes() + b"\0" * 4096)
+
+    body = TestClient(api.app).get("/api/v2/system/storage").json()
+    assert body["file_bytes"] == live_bytes + 4096
+    assert body["used_bytes"] is not None and body["measured_at"] is not None
+    assert body["tables"][0]["row_count"] == 50
@@ -0,0 +1,13 @@
+import pytest
+
+from svc_v2.market_data import MarketDataProvider, ReplayProvider, YFinanceProvider
+
+def test_incomplete_provider_fails_on_instantiation():
+    class OnlyCandles(MarketDataProvider):
+        def fetch(self, tickers, timeframe, start=None, end=None, period=None):
+            return None
+
+    with pytest.raises(TypeError):
+        OnlyCandles()
+    YFinanceProvider()
+    assert issubclass(ReplayProvider, MarketDataProvider) and not ReplayProvider.__abstractmethods__
@@ -0,0 +1,39 @@
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from svc_v2.db import Database
+from tests.conftest import insert_candles
+
+SESSIONS = pd.bdate_range("2024-01-01", periods=10)
+
+def test_portfolio_nulls_totals_without_fx(db, monkeypatch):
+    insert_candles(db, "AAPL", "1d", SESSIONS, close=200.0)
+    insert_candles(db, "WALMEX.MX", "1d", SESSIONS, close=60.0)
+    # Compra de un ticker en USD pagada en MXN: sin fx_rates no hay costo en USD
+    db.add_transaction("AAPL", "BUY", 1, 3000.0, timestamp="2024-01-02 10:00:00", currency="MXN")
+    db.add_transaction("WALMEX.MX", "BUY", 10, 50.0, timestamp="2024-01-02 10:00:00", currency="MXN")
+    db.close()
+
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    monkeypatch.setenv("READ_SNAPSHOTS", "0")
+    from svc_v2.api import app
+    body = TestClient(app).get("/api/v2/portfolio").json()
+
+    items = {i["ticker"]: i for i in body["items"]}
+    assert items["AAPL"]["missing_fx"] and not items["WALMEX.MX"]["missing_fx"]
+    totals = body["totals"]
+    assert totals["missing_fx"] == ["AAPL"]
+    assert totals["grand_total_mxn"]["invested"] is None
+    assert totals["usd"]["invested"] is None
+    assert totals["mxn"]["invested"] == 500.0
+
+def test_fx_rates_backfilled_on_open(db):
+    insert_candles(db, "USDMXN=X", "1d", SESSIONS, close=17.0)
+    assert db.conn.execute("SELECT COUNT(*) FROM fx_rates").fetchone()[0] == 0
+    db.close()
+
+    reopened = Database(str(db.db_path))
+    try:
+        assert reopened.conn.execute("SELECT COUNT(*) FROM fx_rates WHERE currency = 'USD'").fetchone()[0] == len(SESSIONS)
+    finally:
+        reopened.close()
@@ -0,0 +1,66 @@
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from svc_v2.screener import ScreenerEngine
+from tests.conftest import insert_candles
+
+ALIVE = pd.bdate_range("2024-01-01", "2024-02-29")
+DEAD = pd.bdate_range("2024-01-01", "2024-01-05")
+
+def insert_rsi(db, ticker: str, dates, rsi: float):
+    df = pd.DataFrame({"ticker": ticker, "timeframe": "1d", "timestamp": pd.to_datetime(list(dates)), "rsi": rsi})
+    db.conn.register("ind_new", df)
+    try:
+        db.conn.execute("INSERT INTO indicators (ticker, timeframe, timestamp, rsi) SELECT * FROM ind_new")
+    finally:
+        db.conn.unregister("ind_new")
+
+def test_replay_drops_delisted_ticker_after_staleness(db):
+    insert_candles(db, "LIVE", "1d", ALIVE)
+    insert_rsi(db, "LIVE", ALIVE, 50.0)
+    insert_candles(db, "DEAD", "1d", DEAD)
+    insert_rsi(db, "DEAD", DEAD, 80.0)
+    engine = ScreenerEngine(db)
+
+    hits = engine.replay("2024-01-01", "2024-02-29", strategies=["SELL_STRENGTH"])
+    dead = hits[hits["ticker"] == "DEAD"]
+    # Sigue apareciendo dentro de la ventana de antigüedad, nunca después
+    assert not dead.empty
+    assert dead["as_of"].max() <= pd.Timestamp("2024-01-15")
+    assert engine.run_screen("SELL_STRENGTH", as_of="2024-02-29").empty
+
+def test_screener_as_of_universe_skips_stale_rows(db, monkeypatch):
+    insert_candles(db, "LIVE", "1d", ALIVE)
+    insert_rsi(db, "LIVE", ALIVE, 50.0)
+    insert_candles(db, "DEAD", "1d", DEAD)
+    insert_rsi(db, "DEAD", DEAD, 80.0)
+    db.close()
+
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    monkeypatch.setenv("READ_SNAPSHOTS", "0")
+    from svc_v2.api import app
+    body = TestClient(app).get("/api/v2/screener", params={"scope": "universe", "as_of": "2024-02-29"}).json()
+
+    rows = {r["ticker"]: r for r in body["items"]}
+    assert rows["LIVE"]["rsi"] == 50.0
+    assert rows["DEAD"]["rsi"] is None and rows["DEAD"]["close"] is None
+
+def test_screener_rejects_bad_as_of(db, monkeypatch):
+    db.close()
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    from svc_v2.api import app
+    assert TestClient(app).get("/api/v2/screener", params={"as_of": "notadate"}).status_code == 400
+
+def test_screener_pagination_total(db, monkeypatch):
+    insert_candles(db, "LIVE", "1d", ALIVE)
+    insert_rsi(db, "LIVE", ALIVE, 50.0)
+    db.close()
+    monkeypatch.setenv("DB_PATH_OVERRIDE", str(db.db_path))
+    monkeypatch.setenv("READ_SNAPSHOTS", "0")
+    from svc_v2.api import app
+    client = TestClient(app)
+
+    count_only = client.get("/api/v2/screener", params={"scope": "universe", "limit": 0}).json()
+    assert count_only["items"] == [] and count_only["total"] == 1
+    assert client.get("/api/v2/screener", params={"limit": -1}).status_code == 400
+    assert client.get("/api/v2/screener", params={"offset": -1}).status_code == 400
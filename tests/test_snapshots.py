@@ -0,0 +1,18 @@
+from svc_v2.db import Database
+from svc_v2.snapshots import current_snapshot, publish_snapshot
+from tests.conftest import insert_candles
+
+def test_publish_skips_copy_when_nothing_was_written(db):
+    first = publish_snapshot(db, "primera")
+    assert first is not None and current_snapshot(db.db_path) == first
+
+    # Reabrir (esquema ya creado) y publicar sin escribir: mismo snapshot, sin copia nueva
+    db.close()
+    db._init_db(str(db.db_path), read_only=False)
+    assert publish_snapshot(db, "sin cambios") == first
+
+    insert_candles(db, "AAA", "1d", ["2024-01-02"])
+    second = publish_snapshot(db, "con cambios")
+    assert second is not None and second != first
+    with Database(str(second), read_only=True) as snap:
+        assert snap.conn.execute("SELECT COUNT(*) FROM ohlcv").fetchone()[0] == 1
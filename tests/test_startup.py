@@ -0,0 +1,17 @@
+import pytest
+
+from svc_v2.config_loader import load_settings
+from tools.bench_startup import LAZY_MODULES, cold_start_ms, import_profile, job_modules
+
+# Arranques por job (mediana): suficiente para absorber el ruido de un primer arranque en frío
+RUNS = 3
+
+@pytest.mark.parametrize("module", job_modules())
+def test_job_cold_start_within_budget(module):
+    budget = load_settings().system.startup_budget_ms
+    assert cold_start_ms(module, RUNS) <= budget
+
+@pytest.mark.parametrize("module", job_modules())
+def test_job_does_not_import_heavy_packages(module):
+    loaded = {name.split(".")[0] for name, _, _, _ in import_profile(module)}
+    assert not loaded & set(LAZY_MODULES)
@@ -0,0 +1,62 @@
+import argparse
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Ajustar path para importar módulos del proyecto
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from fastapi.testclient import TestClient
+from svc_v2.api import app
+
+# Silenciar el log por request (conexiones RO, httpx) para no ensuciar la tabla
+logging.getLogger().setLevel(logging.WARNING)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Endpoints de lectura que consume el frontend
+DEFAULT_ENDPOINTS = [
+    "/api/v2/screener",
+    "/api/v2/screener?scope=universe",
+    "/api/v2/portfolio",
+    "/api/v2/portfolio/transactions",
+    "/api/v2/portfolio/performance",
+    "/api/v2/portfolio/equity",
+    "/api/v2/ticker/{ticker}",
+]
+
+def bench(client: TestClient, url: str, runs: int, encoding: str):
+    """Latencia (ms) y tamaño en el cable (bytes) de un endpoint."""
+    headers = {"Accept-Encoding": encoding}
+    client.get(url, headers=headers)  # warm-up (caches de DuckDB / imports)
+
+    times = []
+    size = 0
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        res = client.get(url, headers=headers)
+        times.append((time.perf_counter() - t0) * 1000)
+        size = int(res.headers.get("content-length", len(res.content)))
+    return statistics.median(times), size, res.headers.get("content-encoding", "-")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia y tamaño de respuesta de la API V2")
+    parser.add_argument("--runs", type=int, default=10, help="Repeticiones por endpoint (se reporta la mediana)")
+    parser.add_argument("--ticker", default="NVDA", help="Ticker para /api/v2/ticker/{ticker}")
+    parser.add_argument("--encoding", nargs="*", default=["identity", "gzip", "br"], help="Accept-Encoding a probar")
+    parser.add_argument("--endpoints", nargs="*", help="Endpoints (default: lecturas del frontend)")
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    endpoints = [e.format(ticker=args.ticker) for e in (args.endpoints or DEFAULT_ENDPOINTS)]
+
+    print(f"{'endpoint':45} {'accept':>9} {'enc':>5} {'ms (p50)':>9} {'bytes':>10}")
+    for url in endpoints:
+        for enc in args.encoding:
+            ms, size, used = bench(client, url, args.runs, enc)
+            print(f"{url:45} {enc:>9} {used:>5} {ms:9.1f} {size:10d}")
+
+if __name__ == "__main__":
+    main()
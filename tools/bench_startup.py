@@ -0,0 +1,87 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Ajustar path para importar módulos del proyecto
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from svc_v2.config_loader import load_settings
+
+# Paquetes que un job no debe cargar al arrancar: se importan dentro de la función que los usa
+LAZY_MODULES = ["pandas_ta", "numba", "yfinance", "tqdm", "requests", "matplotlib", "plotly"]
+
+def job_modules() -> list:
+    """svc_v2.jobs.* (cada job corre como `python -m svc_v2.jobs.<nombre>` en un proceso nuevo)."""
+    return [f"svc_v2.jobs.{p.stem}" for p in sorted((PROJECT_ROOT / "svc_v2" / "jobs").glob("*.py")) if p.stem != "__init__"]
+
+def cold_start_ms(module: str, runs: int) -> float:
+    """Mediana del tiempo de pared de un intérprete nuevo que solo importa el módulo."""
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", f"import {module}"], cwd=PROJECT_ROOT, capture_output=True, text=True)
+        times.append((time.perf_counter() - t0) * 1000)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    return statistics.median(times)
+
+def import_profile(module: str) -> list:
+    """Desglose de `python -X importtime`: (módulo, self ms, acumulado ms, profundidad en el árbol de imports)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=PROJECT_ROOT, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us) / 1000, int(cum_us) / 1000, depth))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque en frío de los jobs y desglose de imports")
+    parser.add_argument("--jobs", nargs="+", help="Default: todos los de svc_v2/jobs (nombre corto, p. ej. broad_scan)")
+    parser.add_argument("--runs", type=int, default=5, help="Arranques por job (se reporta la mediana)")
+    parser.add_argument("--top", type=int, default=10, help="Paquetes más caros a mostrar por job")
+    parser.add_argument("--budget-ms", type=float, help="Default: system.startup_budget_ms de settings")
+    parser.add_argument("--check", action="store_true", help="Salir con código 1 si un job excede el presupuesto o carga un LAZY_MODULE")
+    args = parser.parse_args()
+
+    budget = args.budget_ms if args.budget_ms is not None else load_settings().system.startup_budget_ms
+    modules = [f"svc_v2.jobs.{j}" for j in args.jobs] if args.jobs else job_modules()
+
+    failures = []
+    print(f"{'job':34} {'ms (p50)':>9} {'budget':>8}")
+    for module in modules:
+        try:
+            ms = cold_start_ms(module, args.runs)
+        except RuntimeError as e:
+            print(f"{module:34} {'ERROR':>9}  {e}")
+            failures.append(module)
+            continue
+
+        profile = import_profile(module)
+        leaked = sorted({name.split(".")[0] for name, _, _, _ in profile} & set(LAZY_MODULES))
+        over = ms > budget
+        status = "❌" if over or leaked else "✅"
+        print(f"{module:34} {ms:9.0f} {budget:8.0f} {status}{'  eager: ' + ', '.join(leaked) if leaked else ''}")
+        if over or leaked:
+            failures.append(module)
+
+        # Self time agregado por paquete raíz (pandas, duckdb, svc_v2...): dónde se va el arranque
+        by_package = {}
+        for name, self_ms, _, _ in profile:
+            root = name.split(".")[0]
+            by_package[root] = by_package.get(root, 0.0) + self_ms
+        for root, total in sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+            print(f"    {root:30} {total:8.1f} ms")
+
+    if args.check and failures:
+        print(f"\n❌ Arranque fuera de presupuesto ({budget:.0f} ms) o con imports pesados: {', '.join(failures)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# Ajustar path para importar módulos del proyecto
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from svc_v2.db import Database
+from svc_v2.config_loader import load_settings
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta ohlcv a archivos para el proveedor de replay (offline)")
+    parser.add_argument("--out", help="Default: data.replay_path de settings")
+    parser.add_argument("--timeframes", nargs="+", default=["1d", "1h"], help="Timeframes a exportar")
+    parser.add_argument("--tickers", nargs="+", help="Default: todos los tickers con velas en la DB")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    args = parser.parse_args()
+
+    cfg = load_settings()
+    out = Path(args.out or cfg.data.replay_path)
+    db = Database(f"data/{cfg.system.db_filename}", read_only=True)
+
+    for tf in args.timeframes:
+        tickers = args.tickers or [r[0] for r in db.conn.execute(
+            "SELECT DISTINCT ticker FROM ohlcv WHERE timeframe = ? ORDER BY ticker", [tf]
+        ).fetchall()]
+        folder = out / tf
+        folder.mkdir(parents=True, exist_ok=True)
+
+        # Una sola lectura streaming por timeframe (antes: un COPY por ticker); un ticker en memoria a la vez
+        n = 0
+        for t, table in db.iter_candle_tables(tickers, tf):
+            # Mismo layout que ReplayProvider: {out}/{tf}/{ticker}.{format}
+            table = table.rename_columns(["date" if c == "timestamp" else c for c in table.column_names])
+            path = folder / f"{t}.{args.format}"
+            if args.format == "parquet":
+                pq.write_table(table, path)
+            else:
+                pa_csv.write_csv(table, path)
+            n += 1
+        logging.info(f"📼 [{tf}] {n} tickers exportados a {folder}")
+
+    db.close()
+
+if __name__ == "__main__":
+    main()
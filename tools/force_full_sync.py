@@ -1,9 +1,7 @@
 import logging
 import sys
-import pandas as pd
 from pathlib import Path
-import yfinance as yf
-from typing import List, Any, cast
+from typing import List
 
 # Ajustar path para importar módulos del proyecto
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -11,6 +9,7 @@ sys.path.append(str(PROJECT_ROOT))
 
 from svc_v2.db import Database
 from svc_v2.config_loader import load_settings, HoldingConfig
+from svc_v2.market_data import MarketDataProvider, get_provider
 
 import argparse
 
@@ -28,6 +27,7 @@ def main():
     
     cfg = load_settings()
     db = Database(f"data/{cfg.system.db_filename}")
+    provider = get_provider()
     
     # Construir universo
     print("   -> Construyendo universo...")
@@ -69,102 +69,44 @@ def main():
             except Exception as e:
                 print(f"      ❌ Error borrando datos: {e}")
 
-        yf_interval = tf 
-        
         chunk_size = 50 
         for i in range(0, len(all_tickers), chunk_size):
             chunk = all_tickers[i:i+chunk_size]
             print(f"   🔨 Batch {i}-{i+len(chunk)}: Descargando...")
             
             try:
-                # Forzar tipo Any para evitar que Pylance asuma None
-                data: Any = yf.download(chunk, period=period, interval=yf_interval, auto_adjust=True, threads=False, progress=False)
+                df_final = provider.fetch(chunk, tf, period=period)
                 
-                if data is None or (isinstance(data, pd.DataFrame) and data.empty):
-                    print(f"      ⚠️ Batch {i} vacío.")
+                if df_final.empty:
+                    print(f"      ⚠️ Batch {i} vacío. Activando Failover...")
+                    download_chunk_individually(chunk, period, tf, db, provider)
                     continue
 
-                df = cast(pd.DataFrame, data)
-                
-                # Stackear
-                if len(chunk) > 1:
-                    if isinstance(df.columns, pd.MultiIndex):
-                        df_final = df.stack(level=1, future_stack=True).reset_index()
-                    else:
-                         continue 
-                else:
-                    df_final = df.reset_index()
-                    df_final['Ticker'] = chunk[0] 
-                
-                # Limpiar columnas
-                df_final.columns = [str(c).lower() for c in df_final.columns]
-                if 'datetime' in df_final.columns: df_final.rename(columns={'datetime': 'date'}, inplace=True)
-                
-                # Fix TZ
-                if 'date' in df_final.columns:
-                     col_date = df_final['date']
-                     if isinstance(col_date.dtype, pd.DatetimeTZDtype):
-                         df_final['date'] = pd.to_datetime(col_date).dt.tz_convert("UTC").dt.tz_localize(None)
-                     
-                     # FIX DUPLICADOS 1D
-                     if tf == '1d':
-                         df_final['date'] = pd.to_datetime(df_final['date']).dt.normalize()
-
-                # Upsert directo
-                if 'date' in df_final.columns:
-                    db.upsert_ohlcv(df_final, tf)
-                    print(f"      ✅ Guardado en DB ({len(df_final)} filas).")
-                else:
-                    print(f"      ⚠️ Batch {i} corrupto (falta 'date'). Activando Failover...")
-                    download_chunk_individually(chunk, period, yf_interval, db)
+                # Upsert directo (el proveedor ya entrega formato largo normalizado)
+                db.upsert_ohlcv(df_final, tf)
+                print(f"      ✅ Guardado en DB ({len(df_final)} filas).")
                     
             except Exception as e:
                 print(f"      ❌ Error en batch: {e}. Activando Failover...")
-                download_chunk_individually(chunk, period, yf_interval, db)
+                download_chunk_individually(chunk, period, tf, db, provider)
 
     print("\n✅ Reparación completada. Ahora corre el Analyzer para recalcular indicadores.")
 
-def download_chunk_individually(tickers: List[str], period: str, interval: str, db: Database):
+def download_chunk_individually(tickers: List[str], period: str, timeframe: str, db: Database, provider: MarketDataProvider):
     """Intenta descargar lista ticker por ticker para salvar lo que se pueda."""
     print(f"      🚑 Iniciando rescate de {len(tickers)} tickers...")
     for t in tickers:
         try:
-            data: Any = yf.download(t, period=period, interval=interval, auto_adjust=True, threads=False, progress=False)
+            df = provider.fetch([t], timeframe, period=period)
             
-            if data is None or (isinstance(data, pd.DataFrame) and data.empty):
-                if period == '730d': 
-                    data = yf.download(t, period="1y", interval=interval, auto_adjust=True, threads=False, progress=False)
+            if df.empty and period == '730d': 
+                df = provider.fetch([t], timeframe, period="1y")
             
-            if data is None or (isinstance(data, pd.DataFrame) and data.empty):
+            if df.empty:
                 print(f"         ⚠️ {t}: Sin datos.")
                 continue
-                
-            df = cast(pd.DataFrame, data).reset_index()
-            df['Ticker'] = t
-            
-            # Sanitización robusta de columnas
-            new_cols = []
-            for c in df.columns:
-                if isinstance(c, tuple):
-                    new_cols.append(str(c[0]).lower())
-                else:
-                    new_cols.append(str(c).lower())
-            df.columns = new_cols
-
-            if 'datetime' in df.columns: df.rename(columns={'datetime': 'date'}, inplace=True)
-            
-            if 'date' in df.columns:
-                col_date = df['date']
-                if isinstance(col_date.dtype, pd.DatetimeTZDtype):
-                    df['date'] = pd.to_datetime(col_date).dt.tz_convert("UTC").dt.tz_localize(None)
-                
-                # FIX DUPLICADOS 1D
-                if interval == '1d':
-                    df['date'] = pd.to_datetime(df['date']).dt.normalize()
 
-                db.upsert_ohlcv(df, interval)
-            else:
-                print(f"         ❌ {t}: Estructura inválida.")
+            db.upsert_ohlcv(df, timeframe)
 
         except Exception as e:
             print(f"         ❌ {t}: Error {e}")
@@ -0,0 +1,41 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Ajustar path para importar módulos del proyecto
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from svc_v2.db import Database
+from svc_v2.config_loader import load_settings
+from svc_v2.collector import Collector
+
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Dry-run del plan de descargas del sync incremental (sin red)")
+    parser.add_argument("--timeframes", nargs="+", default=["1d"], help="Timeframes a planear")
+    parser.add_argument("--tickers", nargs="+", help="Default: todos los tickers con velas en la DB")
+    parser.add_argument("--show", action="store_true", help="Mostrar cada llamada del plan")
+    args = parser.parse_args()
+
+    cfg = load_settings()
+    db = Database(f"data/{cfg.system.db_filename}", read_only=True)
+    col = Collector(db)
+
+    for tf in args.timeframes:
+        tickers = args.tickers or [r[0] for r in db.conn.execute(
+            "SELECT DISTINCT ticker FROM ohlcv WHERE timeframe = ? ORDER BY ticker", [tf]
+        ).fetchall()]
+        requests, report = col.plan_sync(tickers, tf)
+
+        print(f"\n📋 [{tf}] {len(tickers)} tickers")
+        print(report.to_string())
+        if args.show:
+            print(requests.drop(columns=["tickers"]).to_string(index=False))
+
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Ajustar path para importar módulos del proyecto
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.append(str(PROJECT_ROOT))
+
+from svc_v2.db import Database
+from svc_v2.backtester import Backtester, DEFAULT_HORIZONS
+from svc_v2.config_loader import load_settings
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest vectorizado de estrategias del Screener")
+    parser.add_argument("--strategy", nargs="*", help="Estrategias a evaluar (default: todas)")
+    parser.add_argument("--timeframes", nargs="*", default=["1d"], help="Timeframes (default: 1d)")
+    parser.add_argument("--horizons", nargs="*", type=int, default=DEFAULT_HORIZONS, help="Velas forward a medir")
+    parser.add_argument("--no-cache", action="store_true", help="Ignorar caché y recalcular")
+    parser.add_argument("--hits", metavar="STRATEGY", help="Mostrar el detalle de hits de una estrategia")
+    args = parser.parse_args()
+
+    print("📈 BACKTEST DE ESTRATEGIAS (Full History)...")
+
+    cfg = load_settings()
+    db = Database(f"data/{cfg.system.db_filename}")
+    bt = Backtester(db)
+
+    t_start = time.time()
+    if args.hits:
+        df = bt.get_hits(args.hits, timeframe=args.timeframes[0], horizons=args.horizons)
+        print(df.head(100).to_string(index=False))
+        print(f"\n   -> {len(df)} hits totales.")
+    else:
+        df = bt.run(strategies=args.strategy, timeframes=args.timeframes,
+                    horizons=args.horizons, use_cache=not args.no_cache)
+        if df.empty:
+            print("   (Sin resultados)")
+        else:
+            print(df.drop(columns=['def_hash', 'data_version']).round(2).to_string(index=False))
+
+    print(f"\n✅ Backtest completado en {time.time() - t_start:.2f}s.")
+    db.close()
+
+if __name__ == "__main__":
+    main()